@@ -4,82 +4,421 @@ import os
 import re
 from utils import *
 import base64
+import cv2
+import numpy as np
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
 
-client = OpenAI()
-print("[OCR_ai.py] OpenAI Client (OCR) โหลดสำเร็จ")
+# ===================================================================
+# CONFIGURATION
+# ===================================================================
 
+# "openai" | "local" | "fallback" (local ก่อน ถ้าไม่มั่นใจค่อยส่ง remote)
+OCR_ENGINE = os.getenv("OCR_ENGINE", "openai").lower()
+OCR_OPENAI_MODEL = os.getenv("OCR_OPENAI_MODEL", "gpt-4o")
+OCR_LOCAL_MODEL = os.getenv("OCR_LOCAL_MODEL", "model/ocr_char_model.pt")
+OCR_LOCAL_MIN_CONF = float(os.getenv("OCR_LOCAL_MIN_CONF", "0.6"))
+# รวมภาพป้ายจากหลาย request ที่มาพร้อมกันเป็น request เดียว (0 = ปิด)
+OCR_BATCH_WINDOW_MS = int(os.getenv("OCR_BATCH_WINDOW_MS", "0"))
+OCR_BATCH_MAX_SIZE = int(os.getenv("OCR_BATCH_MAX_SIZE", "8"))
+OCR_BATCH_CONCURRENCY = int(os.getenv("OCR_BATCH_CONCURRENCY", "4"))
 
-def read_plate(img_b64: str):
+THAI_PLATE_CHARS = "กขฃคฅฆงจฉชซฌญฎฏฐฑฒณดตถทธนบปผฝพฟภมยรลวศษสหฬอฮ"
+NO_PLATE = "ไม่มีป้ายทะเบียน"
+# 1กก 1234 / กข 1234 / กทม (ไม่มีบรรทัดล่าง)
+PLATE_PATTERN = re.compile(rf"^\d?[{THAI_PLATE_CHARS}]{{1,3}}( \d{{1,4}})?$")
 
-    try:
-        response = client.responses.create(
-            model="gpt-4o",
-            input=[
-                {
-                    "role": "system",
-                    "content": (
-                        """
-                        คุณคือ OCR สำหรับภาพ “ป้ายทะเบียนมอเตอร์ไซค์ของไทย” (ครอปเฉพาะป้าย)
-                        รูปแบบบรรทัด:
-                        1) plate_top:มีได้ 3 ตัวเท่านั้น 
-                        - ถ้ามีเลข เลขอยู่หน้าสุด 
-                        - สองตัวขวาต้องเป็นอักษรไทย
-                        -มีเลขซ้ายสุด → 1กก, 2ขข, 3พร, 9ธน
-                        -ไม่มีเลข → กข, กทม, พร, นค
-                        - อักขระสับสนที่พบบ่อย: ฐ↔ร, 0↔O↔อ, 1↔I↔l
-                        2) province: ชื่อจังหวัดจริงของไทยเท่านั้น (เช่น กรุงเทพมหานคร, เชียงใหม่, ขอนแก่น)
-                        3) plate_bottom: ตัวเลขล้วน 1-4 หลัก
-                        4)ห้ามมีสระภาษาไทยในป้ายทะเบียน
-                        5) ตัวอักษรมีได้แค่ ก ข ฃ ค ฅ ฆ ง จ ฉ ช ซ ฌ ญ ฎ ฏ ฐ ฑ ฒ ณ ด ต ถ ท ธ น บ ป ผ ฝ พ ฟ ภ ม ย ร ล ว ศ ษ ส ห ฬ อ ฮ
-
-                        กติกา:
-                        - ไม่มั่นใจตัวไหน ใส่ “?” แทนตำแหน่งนั้น เช่น ก?123
-                        - ห้ามเดาหรือเติมจังหวัดถ้าไม่เห็นชัด
-                        - ออกผลเป็น JSON เท่านั้น
-                        - ค่า plate = plate_top ต่อด้วย plate_bottom เคาะ spacebar 1 ที(ถ้าไม่มีบรรทัดล่าง ให้ใช้เฉพาะ plate_top) เว้นแบบนี้ plate: "6กย 4054"
-                        -ถ้าไม่มีป้ายทะเบียนหรือภาพอะไรไม่รู้ให้plate เป็น "ไม่มีป้ายทะเบียน" province เป็น Null
-                        Output JSON:
-                        {
-                        "plate": "<plate_top(+plate_bottom)>",
-                        "province": "<provinceหรือเว้นว่างถ้าไม่เห็น>"
-                        }
-                        """
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "input_text",
-                            "text": f'อ่านป้ายทะเบียนแล้ว output เป็น format JSON ',
-                        },
-                        {
-                            "type": "input_image",
-                            "image_url": f"data:image/jpeg;base64,{img_b64}",
-                            "detail": "high",
-                        },
-                    ],
-                },
-            ],
-        )
+SYSTEM_PROMPT = (
+    """
+    คุณคือ OCR สำหรับภาพ “ป้ายทะเบียนมอเตอร์ไซค์ของไทย” (ครอปเฉพาะป้าย)
+    รูปแบบบรรทัด:
+    1) plate_top:มีได้ 3 ตัวเท่านั้น 
+    - ถ้ามีเลข เลขอยู่หน้าสุด 
+    - สองตัวขวาต้องเป็นอักษรไทย
+    -มีเลขซ้ายสุด → 1กก, 2ขข, 3พร, 9ธน
+    -ไม่มีเลข → กข, กทม, พร, นค
+    - อักขระสับสนที่พบบ่อย: ฐ↔ร, 0↔O↔อ, 1↔I↔l
+    2) province: ชื่อจังหวัดจริงของไทยเท่านั้น (เช่น กรุงเทพมหานคร, เชียงใหม่, ขอนแก่น)
+    3) plate_bottom: ตัวเลขล้วน 1-4 หลัก
+    4)ห้ามมีสระภาษาไทยในป้ายทะเบียน
+    5) ตัวอักษรมีได้แค่ ก ข ฃ ค ฅ ฆ ง จ ฉ ช ซ ฌ ญ ฎ ฏ ฐ ฑ ฒ ณ ด ต ถ ท ธ น บ ป ผ ฝ พ ฟ ภ ม ย ร ล ว ศ ษ ส ห ฬ อ ฮ
+
+    กติกา:
+    - ไม่มั่นใจตัวไหน ใส่ “?” แทนตำแหน่งนั้น เช่น ก?123
+    - ห้ามเดาหรือเติมจังหวัดถ้าไม่เห็นชัด
+    - ออกผลเป็น JSON เท่านั้น
+    - ค่า plate = plate_top ต่อด้วย plate_bottom เคาะ spacebar 1 ที(ถ้าไม่มีบรรทัดล่าง ให้ใช้เฉพาะ plate_top) เว้นแบบนี้ plate: "6กย 4054"
+    -ถ้าไม่มีป้ายทะเบียนหรือภาพอะไรไม่รู้ให้plate เป็น "ไม่มีป้ายทะเบียน" province เป็น Null
+    Output JSON:
+    {
+    "plate": "<plate_top(+plate_bottom)>",
+    "province": "<provinceหรือเว้นว่างถ้าไม่เห็น>"
+    }
+    """
+)
+
+
+def no_plate_result() -> dict:
+    return {"plate": NO_PLATE, "province": None}
+
+
+def is_valid_plate(plate: str | None) -> bool:
+    return bool(plate) and bool(PLATE_PATTERN.match(plate))
+
+
+def parse_json_output(txt: str):
+    """ตัด ```json ... ``` ที่โมเดลชอบครอบมาแล้ว parse"""
+    txt = re.sub(
+        r"^\s*```(?:json)?\s*|\s*```\s*$",
+        "",
+        txt.strip(),
+        flags=re.IGNORECASE | re.DOTALL,
+    )
+    return json.loads(txt)
+
+
+# ===================================================================
+# OCR ENGINES
+# ===================================================================
+
+
+class OCREngine(ABC):
+    """Interface ของ OCR engine: read() รับภาพป้าย (base64 JPEG) คืน dict plate/province/confidence"""
+
+    name = "base"
+
+    @property
+    def available(self) -> bool:
+        """False = ใช้งานไม่ได้ (เช่นไม่มีไฟล์โมเดล) FallbackEngine จะข้ามไปเลย"""
+        return True
+
+    @abstractmethod
+    def read(self, img_b64: str) -> dict:
+        ...
+
+
+class OpenAIEngine(OCREngine):
+    """อ่านป้ายด้วย GPT-4o ผ่าน OpenAI Responses API"""
+
+    name = "openai"
+
+    def __init__(self, model: str = OCR_OPENAI_MODEL):
+        self.model = model
+        self._client = None
+
+    @property
+    def client(self) -> OpenAI:
+        if self._client is None:
+            self._client = OpenAI()
+            print("[OCR_ai.py] OpenAI Client (OCR) โหลดสำเร็จ")
+        return self._client
+
+    def read(self, img_b64: str) -> dict:
         try:
-            txt = response.output_text.strip()
-            txt = re.sub(
-                r"^\s*```(?:json)?\s*|\s*```\s*$",
-                "",
-                txt,
-                flags=re.IGNORECASE | re.DOTALL,
+            response = self.client.responses.create(
+                model=self.model,
+                input=[
+                    {
+                        "role": "system",
+                        "content": SYSTEM_PROMPT,
+                    },
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "input_text",
+                                "text": f'อ่านป้ายทะเบียนแล้ว output เป็น format JSON ',
+                            },
+                            {
+                                "type": "input_image",
+                                "image_url": f"data:image/jpeg;base64,{img_b64}",
+                                "detail": "high",
+                            },
+                        ],
+                    },
+                ],
             )
-            return json.loads(txt)
+            try:
+                result = parse_json_output(response.output_text)
+                return {**result, "confidence": None, "engine": self.name}
+            except Exception as e:
+                print(f"[ERROR OCR] {e}")
+                return no_plate_result()
         except Exception as e:
             print(f"[ERROR OCR] {e}")
+            return no_plate_result()
+
+    def read_many(self, img_b64_list: list[str]) -> list[dict]:
+        """ส่งหลายภาพใน request เดียว ขอผลเป็น JSON array เรียงตามลำดับภาพ"""
+        if len(img_b64_list) == 1:
+            return [self.read(img_b64_list[0])]
+
+        content = [
+            {
+                "type": "input_text",
+                "text": (
+                    f"มีภาพป้ายทะเบียน {len(img_b64_list)} ภาพ อ่านทีละภาพแล้ว output เป็น "
+                    f"JSON array ที่มี {len(img_b64_list)} object เรียงตามลำดับภาพ "
+                    "แต่ละ object ใช้ format เดียวกับด้านบน"
+                ),
+            }
+        ]
+        for i, img_b64 in enumerate(img_b64_list, start=1):
+            content.append({"type": "input_text", "text": f"ภาพที่ {i}"})
+            content.append(
+                {
+                    "type": "input_image",
+                    "image_url": f"data:image/jpeg;base64,{img_b64}",
+                    "detail": "high",
+                }
+            )
+
+        try:
+            response = self.client.responses.create(
+                model=self.model,
+                input=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": content},
+                ],
+            )
+            results = parse_json_output(response.output_text)
+            if not isinstance(results, list) or len(results) != len(img_b64_list):
+                raise ValueError(
+                    f"expected {len(img_b64_list)} results, got {results!r}"
+                )
+            return [
+                {**(r if isinstance(r, dict) else no_plate_result()),
+                 "confidence": None, "engine": self.name}
+                for r in results
+            ]
+        except Exception as e:
+            # ผลรวมใช้ไม่ได้ ส่งทีละภาพแทน
+            print(f"[ERROR OCR batch] {e} -> fallback ทีละภาพ")
+            return [self.read(img_b64) for img_b64 in img_b64_list]
+
+
+class LocalCharEngine(OCREngine):
+    """
+    อ่านป้ายบน CPU ด้วย YOLO ที่ detect ทีละตัวอักษร
+    - class ที่เป็นอักขระเดียว = ตัวอักษรไทย/ตัวเลข
+    - class ที่ยาวกว่า 1 ตัว = ชื่อจังหวัด
+    แยกบรรทัดบน/ล่างจากตำแหน่งแนวตั้ง แล้วเรียงซ้ายไปขวา
+    perform_ocr ถูกเรียกพร้อมกันหลาย thread: โหลดโมเดลและ inference อยู่ใต้ model_lock (YOLO ไม่ thread-safe)
+    โหลดโมเดลไม่สำเร็จครั้งเดียวจะจำไว้ ไม่ลองโหลดซ้ำทุกภาพ
+    """
+
+    name = "local"
+
+    def __init__(self, model_path: str = OCR_LOCAL_MODEL, conf: float = 0.25):
+        self.model_path = model_path
+        self.conf = conf
+        self._model = None
+        self._load_error = None
+        self.model_lock = threading.Lock()
+        if not os.path.exists(model_path):
+            self._load_error = f"ไม่พบไฟล์โมเดล {model_path}"
+            print(f"[OCR_ai.py] Local OCR ใช้งานไม่ได้: {self._load_error}")
+
+    @property
+    def available(self) -> bool:
+        return self._load_error is None
+
+    @property
+    def model(self):
+        # เรียกภายใต้ model_lock เท่านั้น
+        if self._model is None and self._load_error is None:
+            try:
+                from ultralytics import YOLO
+
+                self._model = YOLO(self.model_path)
+                print(f"[OCR_ai.py] Local OCR model โหลดสำเร็จ: {self.model_path}")
+            except Exception as e:
+                self._load_error = str(e)
+                print(f"[OCR_ai.py] Local OCR โหลดโมเดลไม่สำเร็จ ปิดการใช้งาน: {e}")
+        return self._model
+
+    def read(self, img_b64: str) -> dict:
+        if not self.available:
+            return {**no_plate_result(), "confidence": 0.0, "engine": self.name}
+        try:
+            buffer = np.frombuffer(base64.b64decode(img_b64), dtype=np.uint8)
+            img = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+            if img is None:
+                return no_plate_result()
+
+            with self.model_lock:
+                model = self.model
+                if model is None:
+                    return {**no_plate_result(), "confidence": 0.0, "engine": self.name}
+                result = model(img, conf=self.conf, verbose=False)[0]
+            if not result.boxes or len(result.boxes) == 0:
+                return {**no_plate_result(), "confidence": 0.0, "engine": self.name}
+
+            names = result.names
+            boxes = result.boxes.xyxy.cpu().numpy()
+            classes = result.boxes.cls.cpu().numpy().astype(int)
+            confs = result.boxes.conf.cpu().numpy()
+
+            chars, province, province_conf = [], None, 0.0
+            for box, cls, conf in zip(boxes, classes, confs):
+                label = names[cls]
+                if len(label) > 1:
+                    if conf > province_conf:
+                        province, province_conf = label, float(conf)
+                elif label.isdigit() or label in THAI_PLATE_CHARS:
+                    chars.append((box, label, float(conf)))
+
+            if not chars:
+                return {**no_plate_result(), "confidence": 0.0, "engine": self.name}
+
+            top, bottom = self._split_lines(chars)
+            plate = "".join(c[1] for c in top)
+            if bottom:
+                plate = f"{plate} {''.join(c[1] for c in bottom)}"
+
+            used_confs = [c[2] for c in chars] + ([province_conf] if province else [])
             return {
-                "plate": "ไม่มีป้ายทะเบียน",
-                "province": None,
+                "plate": plate,
+                "province": province,
+                "confidence": min(used_confs),
+                "engine": self.name,
             }
-    except Exception as e:
-        print(f"[ERROR OCR] {e}")
-        return {
-            "plate": "ไม่มีป้ายทะเบียน",
-            "province": None
-        }
+        except Exception as e:
+            print(f"[ERROR OCR local] {e}")
+            return {**no_plate_result(), "confidence": 0.0, "engine": self.name}
+
+    @staticmethod
+    def _split_lines(chars: list) -> tuple[list, list]:
+        """แบ่งตัวอักษรเป็นบรรทัดบน/ล่างด้วยช่องว่างแนวตั้งที่กว้างที่สุด"""
+        chars = sorted(chars, key=lambda c: (c[0][1] + c[0][3]) / 2)
+        centers = [(c[0][1] + c[0][3]) / 2 for c in chars]
+        heights = [c[0][3] - c[0][1] for c in chars]
+
+        split = None
+        if len(chars) > 1:
+            gaps = [centers[i + 1] - centers[i] for i in range(len(chars) - 1)]
+            widest = int(np.argmax(gaps))
+            if gaps[widest] > float(np.median(heights)) * 0.5:
+                split = widest + 1
+
+        by_x = lambda line: sorted(line, key=lambda c: c[0][0])
+        if split is None:
+            return by_x(chars), []
+        return by_x(chars[:split]), by_x(chars[split:])
+
+
+class FallbackEngine(OCREngine):
+    """ลอง engine แรก (local) ก่อน ถ้าผลไม่มั่นใจหรือรูปแบบป้ายผิด ค่อยส่ง engine ถัดไป (remote)"""
+
+    name = "fallback"
+
+    def __init__(self, engines: list[OCREngine], min_confidence: float = OCR_LOCAL_MIN_CONF):
+        self.engines = engines
+        self.min_confidence = min_confidence
+
+    def _is_confident(self, result: dict) -> bool:
+        confidence = result.get("confidence")
+        return (
+            confidence is not None
+            and confidence >= self.min_confidence
+            and is_valid_plate(result.get("plate"))
+            and bool(result.get("province"))
+        )
+
+    def read(self, img_b64: str) -> dict:
+        result = no_plate_result()
+        engines = [engine for engine in self.engines if engine.available] or self.engines[-1:]
+        for i, engine in enumerate(engines):
+            result = engine.read(img_b64)
+            if i == len(engines) - 1 or self._is_confident(result):
+                return result
+            print(
+                f"[OCR] {engine.name} ไม่มั่นใจ ({result.get('plate')}, "
+                f"conf={result.get('confidence')}) ส่งต่อ engine ถัดไป"
+            )
+        return result
+
+
+class OCRBatchDispatcher(OCREngine):
+    """
+    รวบภาพป้ายที่เข้ามาพร้อมกัน (จากหลาย /batch) ภายในช่วง window_ms
+    แล้วส่งเป็น request เดียวผ่าน engine.read_many() จากนั้นคืนผลให้แต่ละคนที่รออยู่
+    """
+
+    def __init__(
+        self,
+        engine: OpenAIEngine,
+        window_ms: int = OCR_BATCH_WINDOW_MS,
+        max_size: int = OCR_BATCH_MAX_SIZE,
+        concurrency: int = OCR_BATCH_CONCURRENCY,
+    ):
+        self.engine = engine
+        self.name = f"{engine.name}-batched"
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._queue: "queue.Queue[tuple[str, Future]]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="ocr-batch"
+        )
+        self._thread = threading.Thread(
+            target=self._collect_loop, name="ocr-dispatcher", daemon=True
+        )
+        self._thread.start()
+
+    def read(self, img_b64: str) -> dict:
+        future: Future = Future()
+        self._queue.put((img_b64, future))
+        return future.result()
+
+    def _collect_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: list[tuple[str, Future]]):
+        try:
+            print(f"[OCR] ส่ง {len(batch)} ภาพใน request เดียว")
+            results = self.engine.read_many([img_b64 for img_b64, _ in batch])
+        except Exception as e:
+            print(f"[ERROR OCR batch] {e}")
+            results = [no_plate_result()] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+def build_remote_engine() -> OCREngine:
+    remote = OpenAIEngine()
+    if OCR_BATCH_WINDOW_MS > 0:
+        return OCRBatchDispatcher(remote)
+    return remote
+
+
+def build_engine(name: str = OCR_ENGINE) -> OCREngine:
+    if name == "local":
+        return LocalCharEngine()
+    if name == "fallback":
+        return FallbackEngine([LocalCharEngine(), build_remote_engine()])
+    return build_remote_engine()
+
+
+engine = build_engine()
+print(f"[OCR_ai.py] OCR engine: {engine.name}")
+
+
+def read_plate(img_b64: str):
+    return engine.read(img_b64)
@@ -0,0 +1,83 @@
+from main_api import supabase, dashboard_stats, BKK
+from datetime import datetime, timedelta
+import argparse
+import logging
+
+logger = logging.getLogger("backfill_rollups")
+logger.setLevel(logging.INFO)
+
+
+def _first_event_date() -> str | None:
+    """วันที่ (เวลา Bangkok) ของ Event แรกสุดในระบบ"""
+    first = (
+        supabase.table("Event")
+        .select("datetime")
+        .order("datetime", desc=False)
+        .limit(1)
+        .execute()
+    )
+    if not first.data:
+        return None
+    return (
+        datetime.fromisoformat(first.data[0]["datetime"])
+        .astimezone(BKK)
+        .strftime("%Y-%m-%d")
+    )
+
+
+def _yesterday() -> str:
+    return (datetime.now(BKK) - timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def backfill_rollups(start: str | None = None, end: str | None = None):
+    """
+    สร้าง event_rollup_hourly / event_rollup_daily จาก Event ย้อนหลัง
+    - ทุกวันได้แถวใน event_rollup_days ด้วย (วันที่ไม่มี Event = 0) จะได้ไม่ถูกนับใหม่ทีหลัง
+    - คำนวณทีละวัน (เวลา Bangkok) แล้วเขียนทับของเดิม รันซ้ำกี่ครั้งก็ได้ผลเหมือนเดิม
+    - ค่าเริ่มต้น: ตั้งแต่วันของ Event แรกจนถึงเมื่อวาน (วันนี้ใช้ตัวนับใน memory)
+    """
+    start = start or _first_event_date()
+    end = end or _yesterday()
+
+    if not start:
+        logger.warning("⚠️ No events found to backfill")
+        return
+
+    logger.info(f"🚀 Backfilling rollups: {start} → {end}")
+
+    day = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d")
+    days_done = 0
+    events_total = 0
+
+    while day <= last:
+        date = day.strftime("%Y-%m-%d")
+        try:
+            counts = dashboard_stats.rebuild_day(date)
+            events_total += sum(counts.values())
+            days_done += 1
+            logger.debug(f"✅ {date}: {sum(counts.values())} events")
+        except Exception as e:
+            logger.error(f"❌ Failed to backfill {date}: {e}")
+        day += timedelta(days=1)
+
+    logger.info("=" * 50)
+    logger.info("✅ Backfill completed!")
+    logger.info(f"📅 Days processed: {days_done}")
+    logger.info(f"📊 Events counted: {events_total}")
+    logger.info("=" * 50)
+
+
+if __name__ == "__main__":
+    # ตั้งค่า logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    parser = argparse.ArgumentParser(description="Backfill event rollup tables")
+    parser.add_argument("--start", help="YYYY-MM-DD (default: first event date)")
+    parser.add_argument("--end", help="YYYY-MM-DD (default: yesterday)")
+    args = parser.parse_args()
+
+    backfill_rollups(args.start, args.end)
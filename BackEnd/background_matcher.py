@@ -2,6 +2,20 @@ import asyncio
 from datetime import datetime
 from typing import TYPE_CHECKING
 import logging
+import time
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from matching_logic import (
+    prepare_plates,
+    prepare_sessions,
+    score_matrix,
+    MATCH_THRESHOLD,
+    MATCH_TYPES,
+    _EXACT,
+)
+from session_index import parked_index
 
 if TYPE_CHECKING:
     from supabase import Client
@@ -10,7 +24,13 @@ logger = logging.getLogger("background_matcher")
 logger.setLevel(logging.INFO)
 
 # Constants
-CHECK_INTERVAL_SECONDS = 30
+# งานหลักมาจาก queue (exit ใหม่, entry ใหม่, แก้ป้าย) การ sweep ทั้งตารางเป็นแค่ safety net
+SWEEP_INTERVAL_SECONDS = 300
+
+# State ของ matcher (สร้างตอน process_unmatched_sessions เริ่มทำงาน)
+_loop: asyncio.AbstractEventLoop | None = None
+_queue: asyncio.Queue | None = None
+_pending_exits: dict = {}  # session_id -> unmatched exit session ที่ยังรอคู่
 
 
 def _calculate_duration_minutes(entry_time_str: str, exit_time_str: str) -> int:
@@ -39,7 +59,7 @@ def _update_entry_session(
     match_result: dict,
     duration: int,
 ):
-    """อัปเดต entry session ให้เป็น completed"""
+    """อัปเดตเฉพาะคอลัมน์ฝั่งออกของ entry session ให้เป็น completed (เฉพาะที่ยัง parked อยู่)"""
     return (
         supabase.table("parkingsession")
         .update(
@@ -54,6 +74,7 @@ def _update_entry_session(
             }
         )
         .eq("session_id", entry_session["session_id"])
+        .eq("status", "parked")
         .execute()
     )
 
@@ -61,7 +82,11 @@ def _update_entry_session(
 def _delete_unmatched_session(supabase: "Client", session_id: str):
     """ลบ exit session ที่เป็น unmatched"""
     return (
-        supabase.table("parkingsession").delete().eq("session_id", session_id).execute()
+        supabase.table("parkingsession")
+        .delete()
+        .eq("session_id", session_id)
+        .eq("status", "unmatched")
+        .execute()
     )
 
 
@@ -93,10 +118,16 @@ def _process_match_result(
         supabase, entry_session, exit_session, match_result, duration
     )
 
+    parked_index.remove(entry_session["session_id"])
     if not update_result.data:
-        logger.error(f"Failed to update entry session {entry_session['session_id']}")
+        # ถูกปิดไปแล้วโดย worker อื่นหรือ /api/exit รอบหน้าค่อยหาคู่ใหม่
+        logger.warning(
+            f"Entry session {entry_session['session_id']} is no longer parked, skipped"
+        )
         return False
 
+    _pending_exits.pop(exit_session["session_id"], None)
+
     # ลบ exit session ที่เป็น unmatched
     _delete_unmatched_session(supabase, exit_session["session_id"])
 
@@ -137,6 +168,9 @@ async def _match_single_session(supabase: "Client", exit_session: dict) -> bool:
 
 async def _process_batch(supabase: "Client", unmatched_sessions: list) -> int:
     """ประมวลผล batch ของ unmatched sessions"""
+    if parked_index.ensure_fresh(supabase):
+        return await _process_batch_matrix(supabase, unmatched_sessions)
+
     matched_count = 0
 
     for exit_session in unmatched_sessions:
@@ -152,36 +186,299 @@ async def _process_batch(supabase: "Client", unmatched_sessions: list) -> int:
     return matched_count
 
 
+async def _process_batch_matrix(supabase: "Client", unmatched_sessions: list) -> int:
+    """
+    จับคู่ exit ทั้งหมดกับรถที่จอดอยู่พร้อมกันแบบ 1:1 (assignment problem)
+    ให้ผลรวมคะแนนสูงสุด แทนการให้แต่ละ exit เลือกคันที่ดีที่สุดของตัวเองตามลำดับ loop
+    """
+    exits = [s for s in unmatched_sessions if _validate_exit_session(s)]
+    if not exits:
+        return 0
+
+    scores, types, sessions = parked_index.score_exits(
+        [s["plate_number_exit"] for s in exits],
+        [s.get("province", "") for s in exits],
+    )
+    pairs = _solve_assignment(scores, types)
+    if not pairs:
+        logger.debug(f"No match found for {len(exits)} exit(s)")
+        return 0
+
+    matches = [
+        (
+            exits[row],
+            {
+                "session": sessions[col],
+                "match_type": MATCH_TYPES[types[row, col]],
+                "confidence": round(float(scores[row, col]), 2),
+            },
+        )
+        for row, col in pairs
+    ]
+    return _apply_matches_bulk(supabase, matches)
+
+
+def _solve_assignment(scores: np.ndarray, types: np.ndarray) -> list[tuple[int, int]]:
+    """
+    คืนคู่ (แถว exit, คอลัมน์ entry) เฉพาะคู่ที่ผ่านเกณฑ์
+    คู่ exact จองก่อนเสมอ (คันที่เข้าก่อนได้ก่อน) ที่เหลือจับคู่ให้คะแนนรวมสูงสุด
+    กัน fuzzy สองคู่ที่คะแนนรวมกันสูงกว่ามาแย่ง exact match ไป
+    """
+    pairs = []
+    taken_rows, taken_cols = set(), set()
+    for row in range(types.shape[0]):
+        for col in np.flatnonzero(types[row] == _EXACT):
+            if int(col) not in taken_cols:
+                pairs.append((row, int(col)))
+                taken_rows.add(row)
+                taken_cols.add(int(col))
+                break
+
+    valid = (types != 0) & (scores >= MATCH_THRESHOLD)
+    if taken_rows:
+        valid[list(taken_rows), :] = False
+    if taken_cols:
+        valid[:, list(taken_cols)] = False
+    rows = np.flatnonzero(valid.any(axis=1))
+    cols = np.flatnonzero(valid.any(axis=0))
+    if rows.size == 0:
+        return pairs
+
+    # คิดเฉพาะแถว/คอลัมน์ที่มีคู่ที่เป็นไปได้ ลดขนาดปัญหา
+    sub_valid = valid[np.ix_(rows, cols)]
+    weights = np.where(sub_valid, scores[np.ix_(rows, cols)], 0.0)
+    row_idx, col_idx = linear_sum_assignment(weights, maximize=True)
+
+    return pairs + [
+        (int(rows[r]), int(cols[c]))
+        for r, c in zip(row_idx, col_idx)
+        if sub_valid[r, c]
+    ]
+
+
+def _apply_matches_bulk(supabase: "Client", matches: list[tuple[dict, dict]]) -> int:
+    """
+    ปิด entry sessions ทีละคู่ด้วย update แบบมีเงื่อนไข (เฉพาะคอลัมน์ฝั่งออก และเฉพาะที่ยัง parked)
+    แล้วลบ exit sessions ของคู่ที่สำเร็จด้วย delete ครั้งเดียว
+    """
+    applied = []
+    for exit_session, match_result in matches:
+        entry_session = match_result["session"]
+        duration = _calculate_duration_minutes(
+            entry_session["entry_time"], exit_session["exit_time"]
+        )
+        update_result = _update_entry_session(
+            supabase, entry_session, exit_session, match_result, duration
+        )
+        parked_index.remove(entry_session["session_id"])
+        if not update_result.data:
+            # ถูกปิดไปแล้วโดย worker อื่นหรือ /api/exit exit นี้ยังรอคู่ในรอบหน้า
+            logger.warning(
+                f"Entry session {entry_session['session_id']} is no longer parked, skipped"
+            )
+            continue
+        applied.append((exit_session, match_result, duration))
+
+    if not applied:
+        return 0
+
+    exit_ids = [exit_session["session_id"] for exit_session, _, _ in applied]
+    (
+        supabase.table("parkingsession")
+        .delete()
+        .in_("session_id", exit_ids)
+        .eq("status", "unmatched")
+        .execute()
+    )
+
+    for exit_session, match_result, duration in applied:
+        _pending_exits.pop(exit_session["session_id"], None)
+        logger.info(
+            f"[Background] Matched: {exit_session['plate_number_exit']} | "
+            f"Type: {match_result['match_type']} | "
+            f"Confidence: {match_result['confidence']:.2f} | "
+            f"Duration: {duration} min"
+        )
+
+    return len(applied)
+
+
+# ===================================================================
+# WORK QUEUE
+# ===================================================================
+
+
+def _enqueue(kind: str, payload: dict | None):
+    """ส่งงานเข้า queue ของ matcher เรียกได้ทั้งจาก event loop และจาก thread อื่น"""
+    if _loop is None or _queue is None or not payload:
+        return
+    try:
+        _loop.call_soon_threadsafe(_queue.put_nowait, (kind, payload))
+    except RuntimeError:
+        # loop ปิดไปแล้ว (ตอน shutdown)
+        pass
+
+
+def notify_unmatched_exit(exit_session: dict | None):
+    """มี exit ใหม่ที่ยังหาคู่ไม่ได้"""
+    _enqueue("exit", exit_session)
+
+
+def notify_new_entry(entry_session: dict | None):
+    """มีรถเข้าใหม่ อาจเป็นคู่ของ exit ที่รออยู่"""
+    _enqueue("entry", entry_session)
+
+
+def notify_session_corrected(session: dict | None):
+    """แก้ป้ายใน parkingsession (fix_session_plate)"""
+    _enqueue("session_corrected", session)
+
+
+def notify_event_corrected(event: dict | None):
+    """แก้ป้ายใน Event (update_event)"""
+    _enqueue("event_corrected", event)
+
+
+def _sync_session_from_event(supabase: "Client", event: dict) -> list:
+    """
+    คัดลอกป้าย/จังหวัดที่แก้ใน Event ไปยัง session ที่ป้ายมาจาก Event นี้ตัวเดียว
+    - parked ที่ Event นี้เป็นขาเข้า
+    - unmatched (exit ที่ยังไม่มีคู่) ที่ Event นี้เป็นขาออก
+    session ที่ผูก entry คู่กับ exit แล้วไม่แตะ แก้ exit ต้องไม่ไปเขียนทับป้าย/จังหวัดของ entry
+    (ใช้ fix_session_plate แทน)
+    """
+    event_id = event.get("event_id")
+    sessions = (
+        supabase.table("parkingsession")
+        .select("*")
+        .or_(
+            f"and(status.eq.parked,entry_event_id.eq.{event_id}),"
+            f"and(status.eq.unmatched,exit_event_id.eq.{event_id},entry_event_id.is.null)"
+        )
+        .execute()
+    ).data or []
+
+    updated = []
+    for session in sessions:
+        plate_field = (
+            "plate_number_entry"
+            if session.get("status") == "parked"
+            else "plate_number_exit"
+        )
+        resp = (
+            supabase.table("parkingsession")
+            .update({plate_field: event.get("plate"), "province": event.get("province")})
+            .eq("session_id", session["session_id"])
+            .eq("status", session["status"])
+            .execute()
+        )
+        if resp.data:
+            updated.append(resp.data[0])
+    return updated
+
+
+def _relevant_exits(entries: list[dict]) -> list[dict]:
+    """exit ที่รออยู่ซึ่งได้คะแนนกับ entry ใหม่ถึงเกณฑ์ (ไม่ต้อง retry คันอื่น)"""
+    exits = list(_pending_exits.values())
+    if not exits or not entries:
+        return []
+
+    scores, _ = score_matrix(
+        prepare_plates(
+            [s.get("plate_number_exit") for s in exits],
+            [s.get("province") for s in exits],
+        ),
+        prepare_sessions(entries),
+    )
+    relevant = scores.max(axis=1) >= MATCH_THRESHOLD
+    return [s for s, keep in zip(exits, relevant) if keep]
+
+
+async def _handle_work(supabase: "Client", items: list[tuple[str, dict]]) -> int:
+    """รวมงานที่ค้างใน queue แล้ว match เฉพาะ exit ที่เกี่ยวข้อง"""
+    to_retry: dict = {}
+    new_entries: list[dict] = []
+
+    for kind, payload in items:
+        if kind == "event_corrected":
+            sessions = await asyncio.to_thread(_sync_session_from_event, supabase, payload)
+        else:
+            sessions = [payload]
+
+        for session in sessions:
+            if session.get("status") == "unmatched":
+                _pending_exits[session["session_id"]] = session
+                to_retry[session["session_id"]] = session
+            elif session.get("status") == "parked":
+                parked_index.update(session)
+                new_entries.append(session)
+
+    for session in _relevant_exits(new_entries):
+        to_retry[session["session_id"]] = session
+
+    if not to_retry:
+        return 0
+
+    return await _process_batch(supabase, list(to_retry.values()))
+
+
+async def _sweep(supabase: "Client") -> int:
+    """ดึง unmatched ทั้งหมดจาก database แล้วลอง match ใหม่ (safety net)"""
+    unmatched = _fetch_unmatched_sessions(supabase)
+
+    _pending_exits.clear()
+    for session in unmatched.data or []:
+        _pending_exits[session["session_id"]] = session
+
+    if not _pending_exits:
+        logger.debug("No unmatched sessions found")
+        return 0
+
+    logger.info(f"🔍 Found {len(_pending_exits)} unmatched exit session(s)")
+    return await _process_batch(supabase, list(_pending_exits.values()))
+
+
 async def process_unmatched_sessions(supabase: "Client"):
     """
-    รันทุก 30 วินาที - หาและ match session ที่ยังไม่ได้ pair
+    Matcher แบบ event-driven: รองาน (exit ใหม่ / entry ใหม่ / แก้ป้าย) จาก queue
+    และ sweep ทั้งตารางทุก SWEEP_INTERVAL_SECONDS เผื่อมีงานหลุด
     """
+    global _loop, _queue
+    _loop = asyncio.get_running_loop()
+    _queue = asyncio.Queue()
+
     logger.info(
-        f"Background matcher started - checking every {CHECK_INTERVAL_SECONDS}s"
+        f"Background matcher started - event-driven, sweep every {SWEEP_INTERVAL_SECONDS}s"
     )
 
+    next_sweep = time.monotonic()
+
     while True:
         try:
-            # ดึง exit sessions ที่ยังไม่ match
-            unmatched = _fetch_unmatched_sessions(supabase)
-
-            if not unmatched.data or len(unmatched.data) == 0:
-                logger.debug("No unmatched sessions found")
-                await asyncio.sleep(CHECK_INTERVAL_SECONDS)
-                continue
-
-            logger.info(f"🔍 Found {len(unmatched.data)} unmatched exit session(s)")
-
-            # ประมวลผล batch
-            matched_count = await _process_batch(supabase, unmatched.data)
+            timeout = next_sweep - time.monotonic()
+            if timeout <= 0:
+                matched_count = await _sweep(supabase)
+                pending_count = len(_pending_exits) + matched_count
+                next_sweep = time.monotonic() + SWEEP_INTERVAL_SECONDS
+            else:
+                try:
+                    items = [await asyncio.wait_for(_queue.get(), timeout)]
+                except asyncio.TimeoutError:
+                    continue
+
+                # รวบงานที่เข้ามาพร้อมกันให้เป็นรอบเดียว
+                while not _queue.empty():
+                    items.append(_queue.get_nowait())
+
+                matched_count = await _handle_work(supabase, items)
+                pending_count = len(_pending_exits) + matched_count
 
             if matched_count > 0:
                 logger.info(
-                    f"Successfully matched {matched_count}/{len(unmatched.data)} "
+                    f"Successfully matched {matched_count}/{pending_count} "
                     f"session(s)"
                 )
 
         except Exception as e:
             logger.error(f"Background matcher error: {str(e)}", exc_info=True)
-
-        await asyncio.sleep(CHECK_INTERVAL_SECONDS)
+            await asyncio.sleep(1)
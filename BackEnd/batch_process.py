@@ -1,6 +1,9 @@
-import os,requests,cv2,io,base64
+import os,cv2,io,base64,time,asyncio
+import httpx
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from ultralytics import YOLO
+from detector import _elapsed_ms
+from inference_pool import InferencePool, InferencePoolBusy, InferencePoolUnavailable, RETRY_AFTER_SECONDS
 from supabase import create_client
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 import numpy as np
@@ -10,19 +13,14 @@ from utils import *
 from datetime import datetime
 import uvicorn
 from OCR_ai import *
+from ocr_cache import ocr_cache, plate_hash
+from burst_dedup import burst_dedup
+from event_outbox import EventOutbox, EVENT_OUTBOX_DB
 
 load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-try:
-    model_lpr = YOLO("model/lpr_model.pt")
-    model_mc = YOLO("model/motorcycle_model.pt")
-    print("โหลด YOLO สำเร็จ")
-except Exception as e:
-    print(f"!!! ไม่พบโมเดล 'model/lpr_model.pt': {e}")
-    exit()
-
 try:
     supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
     print("Supabase Client (AI Server) โหลดสำเร็จ")
@@ -31,37 +29,55 @@ except Exception as e:
     supabase = None
 
 API_URL_EVENT = "https://license-plate-recognition-wlxn.onrender.com/events"
+API_URL_EVENT_BULK = "https://license-plate-recognition-wlxn.onrender.com/events/bulk"
 API_URL_CHECK = "https://license-plate-recognition-wlxn.onrender.com/check_plate"
-PAD = 10
-MIN_CONFIDENCE = 0.3
-SCORE_WEIGHTS = {
-    'area': 0.3,
-    'sharpness': 0.3,
-    'confidence': 0.4
-}
+# HTTP client ที่ใช้ร่วมกันทุก request ขาออก (keep-alive / HTTP/2)
+HTTP_TIMEOUT = httpx.Timeout(10.0, connect=3.0)
+HTTP_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "20")),
+    max_keepalive_connections=10,
+    keepalive_expiry=60,
+)
 
-app = FastAPI()
+# Event ที่ต้องส่งไป API Server จะถูกเก็บลงไฟล์ก่อน แล้วค่อยทยอยส่งเบื้องหลัง
+event_outbox = EventOutbox(EVENT_OUTBOX_DB, API_URL_EVENT, API_URL_EVENT_BULK)
+# โมเดลรันใน worker process (INFERENCE_WORKERS) หรือใน process นี้ถ้าตั้งเป็น 0
+inference_pool = InferencePool()
+http_client: Optional[httpx.AsyncClient] = None
 
-def send_event(payload:dict):
+def _create_http_client() -> httpx.AsyncClient:
     try:
-        r = requests.post(API_URL_EVENT, json=payload, timeout=10)
-        r.raise_for_status()
-        return r.json()
-    except requests.HTTPError as e:
-        print(f"[ERROR] API Server (/events) ปฏิเสธ: {e.response.text}")
-        raise HTTPException(
-            status_code=502, detail=f"API Server Error: {e.response.text}"
-        )
+        return httpx.AsyncClient(http2=True, timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+    except ImportError:
+        # ไม่ได้ติดตั้ง h2 ใช้ HTTP/1.1 keep-alive แทน
+        print("[WARN] ไม่พบแพ็กเกจ h2 ใช้ HTTP/1.1")
+        return httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client
+    http_client = _create_http_client()
+    # โหลดโมเดลและรันรอบแรกตอน startup ไม่ให้ request แรกต้องรอ lazy init
+    try:
+        await inference_pool.start()
     except Exception as e:
-        print(f"[ERROR] เชื่อมต่อ API Server (/events) ไม่ได้: {e}")
-        raise HTTPException(
-            status_code=503, detail=f"Cannot connect to API Server: {e}"
-        )
-    
-def check_plate_in_system(plate: str, province: str):
+        print(f"!!! โหลดโมเดลไม่สำเร็จ: {e}")
+        raise
+    event_outbox.start()
+    try:
+        yield
+    finally:
+        event_outbox.stop()
+        await inference_pool.stop()
+        await wait_background_uploads()
+        await http_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+async def check_plate_in_system(plate: str, province: str):
     try:
         params = {"plate": plate, "province": province}
-        r = requests.get(API_URL_CHECK, params=params, timeout=10)
+        r = await http_client.get(API_URL_CHECK, params=params)
         r.raise_for_status()
         data = r.json()
         if data.get("exists"):
@@ -71,124 +87,31 @@ def check_plate_in_system(plate: str, province: str):
         print(f"[ERROR] เชื่อมต่อ API Server (/check_plate) ไม่ได้: {e}")
         return None
 
-# เปลี่ยนเป็นขาวดำแล้ววัดค่าความคม คืนเป็น float
-def blur_score(img_np):
-    gray = cv2.cvtColor(img_np,cv2.COLOR_BGR2GRAY)
-    return cv2.Laplacian(gray,cv2.CV_64F).var()
-
-def normalize_area(area: float, max_area: float = 50000) -> float:
-    return min(area / max_area, 1.0)
-
-def normalize_sharpness(sharpness: float, max_sharpness: float = 1000) -> float:
-    return min(sharpness / max_sharpness, 1.0)
-
-# คำนวณ score ของแต่ละป้าย
-def calculate_plate_score(area: float, sharpness: float, confidence: float) -> float:
-    area_norm = normalize_area(area)
-    sharp_norm = normalize_sharpness(sharpness)
-    
-    score = (
-        area_norm * SCORE_WEIGHTS['area'] +
-        sharp_norm * SCORE_WEIGHTS['sharpness'] +
-        confidence * SCORE_WEIGHTS['confidence']
-    )
-    
-    return score
-
-# ตรวจหามอไซ คืนมอไซ
-def detect_motorcycle(pil_image:Image.Image,frame_np:np.ndarray)->List[np.ndarray]:
-    mc = []
 
-    if model_mc:
-        try:
-            mc_results = model_mc(pil_image, classes=[3], verbose=False)
-            if mc_results[0].boxes and len(mc_results[0].boxes) > 0:
-                for box in mc_results[0].boxes.xyxy.cpu().numpy():
-                    x1, y1, x2, y2 = map(int, box)
-                    cropped = safe_crop(frame_np, x1, y1, x2, y2, pad=PAD)
-                    if cropped is not None:
-                        mc.append(cropped)
-        except Exception as e:
-            print(f"Error in motorcycle detection: {e}")
-    
-    if not mc:
-        mc.append(frame_np)
-    
-    return mc
-
-# หาป้ายที่ดีจากการคำนวณคะแนน
-def detect_best_plate(mc:np.ndarray)->Optional[dict]:
-    try:
-        results = model_lpr(
-            Image.fromarray(mc), 
-            classes=[0], 
-            verbose=False, 
-            conf=MIN_CONFIDENCE
-        )
-
-        if not results[0].boxes or len(results[0].boxes) == 0:
-            return None
-        
-        confs = results[0].boxes.conf.cpu().numpy()
-        boxes = results[0].boxes.xyxy.cpu().numpy()
-        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
-
-        best_idx = areas.argmax()
-        conf, box, area = confs[best_idx], boxes[best_idx], areas[best_idx]
-
-        if conf < MIN_CONFIDENCE:
-            return None
-        
-        sharpness = blur_score(mc)
-        score = calculate_plate_score(area, sharpness, conf)
-
-        plate_crop = safe_crop(mc, *map(int, box), pad=PAD)
-        if plate_crop is None:
-            return None
-        
-        return {
-            'crop': plate_crop,
-            'score': score,
-            'confidence': float(conf),
-            'area': float(area),
-            'sharpness': float(sharpness)
-        }
-    except Exception as e:
-        print(f"Error in plate detection: {e}")
-        return None
-
-# เรียกใช้สองที่หามอไซกับป้ายแล้วเปรียบเทียบคะแนน
-def process_img(image_bytes: bytes, filename: str)->Optional[dict]:
+# รันงานที่ block (โมเดล/OCR) ใน thread pool ไม่ให้ค้าง event loop ส่วน HTTP ที่เป็น async await ตรง ๆ
+# และจับเวลาเก็บใน timings
+async def _run_stage(timings: dict, name: str, func, *args):
+    t0 = time.perf_counter()
     try:
-        pil_image = Image.open(io.BytesIO(image_bytes))
-        frame_np = np.array(pil_image)
-
-        mcs = detect_motorcycle(pil_image,frame_np)
-
-        best_plate = None
-        for mc in mcs:
-            plate_info = detect_best_plate(mc)
-
-            if plate_info and(best_plate is None or plate_info['score']>best_plate['score']):
-                best_plate = plate_info
-            
-            if best_plate:
-                return {
-                    **best_plate,
-                    'full_image_bytes': image_bytes,
-                    'filename': filename
-                }
-            return None
-    except Exception as e:
-        print(f"Error processing image {filename}: {e}")
-        return None
+        if asyncio.iscoroutinefunction(func):
+            return await func(*args)
+        return await asyncio.to_thread(func, *args)
+    finally:
+        timings[name] = _elapsed_ms(t0)
 
 # ส่งภาพที่ครอปไป OCR
-def perform_ocr(plate_crop: np.ndarray) -> Tuple[Optional[str], Optional[str]]:
+def perform_ocr(plate_crop: np.ndarray, cam_id: int = 0) -> Tuple[Optional[str], Optional[str]]:
     try:
+        # ป้ายหน้าตาเหมือนเดิมจากกล้องเดิม (เช่นรถจอดนิ่ง) ใช้ผลเดิมไม่ต้องยิง OCR ซ้ำ
+        cache_key, cached = ocr_cache.lookup(plate_crop, cam_id)
+        if cached:
+            print(f"[OCR CACHE] hit: {cached['plate']} | {cached['province']}")
+            return cached["plate"], cached["province"]
+
         _, buffer = cv2.imencode(".jpg", plate_crop)
         img_b64 = base64.b64encode(buffer).decode("utf-8")
         ocr_result = read_plate(img_b64=img_b64)
+        ocr_cache.store(cache_key, ocr_result, cam_id)
         
         plate_text = ocr_result.get("plate")
         province_text = ocr_result.get("province")
@@ -199,17 +122,76 @@ def perform_ocr(plate_crop: np.ndarray) -> Tuple[Optional[str], Optional[str]]:
         print(f"OCR error: {e}")
         return None, None
 
-def upload_image(image_bytes: bytes) -> Optional[str]:
+# ภาพจาก PIL เป็น RGB/RGBA/ขาวดำ แปลงเป็น BGR ก่อนเข้ารหัสด้วย OpenCV
+def _to_bgr(img_np: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    if img_np is None or img_np.ndim == 2:
+        return img_np
+    if img_np.shape[2] == 4:
+        return cv2.cvtColor(img_np, cv2.COLOR_RGBA2BGR)
+    return cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
+
+# บีบอัดรูปเต็ม + รูปย่อ + ภาพป้าย (จากภาพที่ decode แล้ว หรือจาก bytes ของรูปแรกกรณีไม่เจอป้าย)
+def make_derivatives(image_np: Optional[np.ndarray], plate_crop=None, image_bytes=None) -> dict:
+    try:
+        if image_np is None:
+            image_bgr = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        else:
+            image_bgr = _to_bgr(image_np)
+        if image_bgr is None:
+            return {}
+        return build_image_derivatives(image_bgr, _to_bgr(plate_crop))
+    except Exception as e:
+        print(f"Image encode error: {e}")
+        return {}
+
+# อัปโหลดเบื้องหลัง ได้ URL ทันทีโดยไม่ต้องรอ
+def upload_images(derivatives: dict) -> dict:
     try:
-        return upload_image_to_storage(image_bytes, ext="jpg", folder="plates")
+        if derivatives:
+            return upload_derivatives_background(http_client, derivatives)
     except Exception as e:
         print(f"Image upload error: {e}")
-        return None
+    return {"blob": None, "thumb_url": None, "plate_url": None}
     
 @app.get("/")
 def root():
     return {"message": "Hello Test"}
 
+@app.get("/ocr/cache/stats")
+def ocr_cache_stats():
+    return ocr_cache.get_stats()
+
+@app.get("/outbox/stats")
+def outbox_stats():
+    return event_outbox.get_stats()
+
+@app.get("/upload/stats")
+def upload_stats():
+    return get_upload_stats()
+
+@app.get("/dedup/stats")
+def dedup_stats():
+    return burst_dedup.get_stats()
+
+@app.get("/inference/stats")
+def inference_stats():
+    return inference_pool.get_stats()
+
+# burst ซ้ำของรถคันเดิม: ตอบกลับด้วย Event เดิม ไม่ส่ง Event ใหม่
+def _duplicate_response(duplicate: dict, timings: dict, t_start: float) -> dict:
+    timings['total_ms'] = _elapsed_ms(t_start)
+    print(f"Duplicate burst merged into outbox #{duplicate['outbox_id']} (repeat {duplicate['repeats']})")
+    print(f"Stage timings: {timings}")
+    print(f"{'='*60}\n")
+    return {
+        "message": "รถคันเดิมในช่วงเวลาสั้น ๆ รวมกับ Event ก่อนหน้า",
+        "duplicate": True,
+        "outbox_id": duplicate["outbox_id"],
+        "repeats": duplicate["repeats"],
+        "data": duplicate["payload"],
+        "timings": timings,
+    }
+
 @app.post("/batch")
 async def handle_flutter_batch(
     images: List[UploadFile] = File(...),
@@ -225,44 +207,81 @@ async def handle_flutter_batch(
     print(f"Camera: {cam_id} | Direction: {direction} | Images: {len(images)}")
     print(f"{'='*60}\n")
 
-    best_result = None
-    first_image_bytes = None
-
-    for i ,file in enumerate(images):
+    frames = []
+    for file in images:
         try:
-            image_bytes = await file.read()
-
-            if i == 0:
-                first_image_bytes = image_bytes
+            frames.append((await file.read(), file.filename))
+        except Exception as e:
+            print(f" Failed to read {file.filename}: {e}")
 
-            result = process_img(image_bytes, file.filename)
+    first_image_bytes = frames[0][0] if frames else None
 
-            if result and (best_result is None or result['score'] > best_result['score']):
-                best_result = result
-                print(f" New best plate found in {file.filename}")
-                print(f"  Score: {result['score']:.3f} | Conf: {result['confidence']:.2f} | Area: {result['area']:.0f}")
-        except Exception as e:
-            print(f" Failed to process {file.filename}: {e}")
-            continue
+    t_start = time.perf_counter()
+    try:
+        best_result, timings = await inference_pool.process_frames(frames)
+    except InferencePoolBusy as e:
+        # คิวเต็ม: ให้กล้องส่ง burst นี้ใหม่ภายหลัง ดีกว่ารอจน timeout
+        print(f" Batch {batch_id} rejected: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail="Inference queue is full, retry later",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+    except InferencePoolUnavailable as e:
+        # worker ตายระหว่างประมวลผล burst นี้ pool ถูกสร้างใหม่แล้ว ให้กล้องส่งซ้ำ
+        print(f" Batch {batch_id} failed: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Inference worker restarted, retry later",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+    print(f" Detection timings: {timings}")
 
+    crop_hash = None
     if best_result:
         print(f"\n Best plate selected from {best_result['filename']}")
-        
+        print(f"  Score: {best_result['score']:.3f} | Conf: {best_result['confidence']:.2f} | Area: {best_result['area']:.0f}")
+
+        # ภาพป้ายแทบเหมือนกับ burst ก่อนหน้าของกล้องนี้ ใช้ผลอ่านป้ายเดิมไม่ต้อง OCR ซ้ำ
+        crop_hash = plate_hash(best_result['crop'])
+        previous_read = burst_dedup.match_crop(cam_id, crop_hash)
+
+        # บีบอัดรูปทันทีที่รู้เฟรมที่ดีที่สุด ทำขนานกับ OCR
+        encode_task = asyncio.create_task(
+            _run_stage(
+                timings, "encode_ms", make_derivatives,
+                best_result['full_image_np'], best_result['crop'], best_result['full_image_bytes']
+            )
+        )
+
         #ส่งไป ocr
-        plate_text, province_text = perform_ocr(best_result['crop'])
-        
-        #อัพรูป
-        image_url = upload_image(best_result['full_image_bytes'])
-        
-        #เช็ครถในระบบ
-        vehicle_id = check_plate_in_system(plate_text, province_text)
-        
+        if previous_read:
+            plate_text, province_text = previous_read['plate'], previous_read['province']
+        else:
+            plate_text, province_text = await _run_stage(
+                timings, "ocr_ms", perform_ocr, best_result['crop'], cam_id
+            )
+
+        # อ่านป้ายได้ตรงกับ Event ล่าสุดของกล้องนี้ ถึงจะรวมเป็น Event เดิม
+        duplicate = burst_dedup.match_plate(cam_id, plate_text)
+        if duplicate:
+            encode_task.cancel()
+            return _duplicate_response(duplicate, timings, t_start)
+
+        #เช็ครถในระบบ (ต้องรอผล OCR ก่อน)
+        vehicle_id = await _run_stage(
+            timings, "lookup_ms", check_plate_in_system, plate_text, province_text
+        )
+
+        # อัปโหลดเบื้องหลัง ได้ URL เลยไม่ต้องรอ
+        image_urls = upload_images(await encode_task)
+
         event_payload = {
             "datetime": datetime.now().isoformat(),
             "plate": plate_text,
             "province": province_text,
             "direction": direction,
-            "blob": image_url,
+            **image_urls,
             "cam_id": cam_id,
             "vehicle_id": vehicle_id,
         }
@@ -273,21 +292,37 @@ async def handle_flutter_batch(
         print("\n No license plate detected in batch")
         
         # Upload first image as fallback
-        image_url = upload_image(first_image_bytes) if first_image_bytes else None
+        image_urls = upload_images(
+            await _run_stage(timings, "encode_ms", make_derivatives, None, None, first_image_bytes)
+            if first_image_bytes
+            else {}
+        )
         
         event_payload = {
             "datetime": datetime.now().isoformat(),
             "plate": "ไม่มีป้ายทะเบียน",
             "province": None,
             "direction": direction,
-            "blob": image_url,
+            **image_urls,
             "cam_id": cam_id,
             "vehicle_id": None,
         }
     
+    # บันทึกลง outbox แล้วตอบกลับเลย ไม่ต้องรอ API Server
+    outbox_id = await _run_stage(timings, "enqueue_ms", event_outbox.enqueue, event_payload)
+    if crop_hash is not None:
+        burst_dedup.remember(cam_id, crop_hash, event_payload["plate"], event_payload, outbox_id)
+    timings['total_ms'] = _elapsed_ms(t_start)
+
+    print(f"Stage timings: {timings}")
     print(f"{'='*60}\n")
-    
-    return send_event(event_payload)
+
+    return {
+        "message": "บันทึก Event ลงคิวส่งเรียบร้อยแล้ว",
+        "outbox_id": outbox_id,
+        "data": event_payload,
+        "timings": timings,
+    }
 
 if __name__ == "__main__":
     print("http://0.0.0.0:8001")
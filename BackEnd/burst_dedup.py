@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from typing import Optional
+
+from ocr_cache import INVALID_PLATE, hamming
+
+# ===================================================================
+# CONFIGURATION
+# ===================================================================
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+# burst ที่ห่างจากครั้งล่าสุดไม่เกินนี้ (กล้องเดียวกัน) ถือเป็นรถคันเดิม
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "20"))
+# รถจอดนิ่งนานแค่ไหนก็ตาม หลังจากนี้จะนับเป็น Event ใหม่
+DEDUP_MAX_SPAN_SECONDS = float(os.getenv("DEDUP_MAX_SPAN_SECONDS", "300"))
+# ระยะ Hamming ของ dHash ภาพป้าย (256 bit) ที่ใช้ผลอ่านป้ายเดิมแทนการ OCR ใหม่
+# ป้ายไทยพื้นขาวหน้าตาคล้ายกันมาก จึงต้องแทบเป็นภาพเดียวกันเท่านั้น
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "4"))
+
+
+def normalize_plate(plate: Optional[str]) -> Optional[str]:
+    if not plate or plate == INVALID_PLATE:
+        return None
+    return "".join(plate.split()).lower() or None
+
+
+class BurstDeduplicator:
+    """
+    จำ Event ล่าสุดของแต่ละกล้องไว้ช่วงสั้น ๆ เพื่อรวม burst ที่มาซ้ำเป็น Event เดียว
+    - ก่อน OCR: hash ภาพป้ายแทบเหมือนกัน ใช้ผลอ่านป้ายเดิมแทนการยิง OCR (ยังไม่รวม Event)
+    - หลัง OCR: ป้ายที่อ่านได้ตรงกันเท่านั้นถึงรวมเป็น Event เดิม (ไม่ต้องอัปโหลด / ส่ง Event)
+    หน้าต่างเวลาเลื่อนตาม burst ที่ถูกรวม รถที่จอดนิ่งจึงนับเป็นครั้งเดียว
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = DEDUP_WINDOW_SECONDS,
+        max_span_seconds: float = DEDUP_MAX_SPAN_SECONDS,
+        max_distance: int = DEDUP_MAX_DISTANCE,
+        enabled: bool = DEDUP_ENABLED,
+    ):
+        self.window_seconds = window_seconds
+        self.max_span_seconds = max_span_seconds
+        self.max_distance = max_distance
+        self.enabled = enabled
+        self._recent: dict[int, list[dict]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"checked": 0, "ocr_skipped": 0, "merged_by_plate": 0}
+
+    def _live(self, cam_id: int, now: float) -> list[dict]:
+        entries = [
+            e
+            for e in self._recent.get(cam_id, [])
+            if now - e["last_seen"] <= self.window_seconds
+            and now - e["first_seen"] <= self.max_span_seconds
+        ]
+        self._recent[cam_id] = entries
+        return entries
+
+    def _merge(self, entry: dict, now: float) -> dict:
+        entry["last_seen"] = now
+        entry["repeats"] += 1
+        return dict(entry)
+
+    def match_crop(self, cam_id: int, crop_hash: int) -> Optional[dict]:
+        """
+        ผลอ่านป้าย (plate/province) ของ Event กล้องนี้ที่ภาพป้ายแทบเหมือนกัน ใช้แทนการ OCR
+        ไม่ถือว่าซ้ำและไม่เลื่อนหน้าต่างเวลา การรวม Event ตัดสินที่ match_plate
+        """
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self.stats["checked"] += 1
+            for entry in self._live(cam_id, now):
+                if hamming(crop_hash, entry["crop_hash"]) <= self.max_distance:
+                    self.stats["ocr_skipped"] += 1
+                    return {
+                        "plate": entry["payload"].get("plate"),
+                        "province": entry["payload"].get("province"),
+                    }
+        return None
+
+    def match_plate(self, cam_id: int, plate: Optional[str]) -> Optional[dict]:
+        """หา Event ของกล้องนี้ที่อ่านป้ายได้ตรงกัน"""
+        key = normalize_plate(plate)
+        if not self.enabled or not key:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            for entry in self._live(cam_id, now):
+                if entry["plate_key"] == key:
+                    self.stats["merged_by_plate"] += 1
+                    return self._merge(entry, now)
+        return None
+
+    def remember(
+        self, cam_id: int, crop_hash: int, plate: Optional[str], payload: dict, outbox_id: int
+    ):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._live(cam_id, now).append(
+                {
+                    "crop_hash": crop_hash,
+                    "plate_key": normalize_plate(plate),
+                    "payload": payload,
+                    "outbox_id": outbox_id,
+                    "first_seen": now,
+                    "last_seen": now,
+                    "repeats": 0,
+                }
+            )
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "merged": self.stats["merged_by_plate"],
+                "tracked": sum(len(v) for v in self._recent.values()),
+                "window_seconds": self.window_seconds,
+                "enabled": self.enabled,
+            }
+
+
+burst_dedup = BurstDeduplicator()
@@ -0,0 +1,454 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import TYPE_CHECKING
+import logging
+import threading
+import time
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+logger = logging.getLogger("dashboard_stats")
+logger.setLevel(logging.INFO)
+
+# Constants
+ROLLUP_HOURLY_TABLE = "event_rollup_hourly"
+ROLLUP_DAILY_TABLE = "event_rollup_daily"
+ROLLUP_DAYS_TABLE = "event_rollup_days"  # วันที่คำนวณแล้ว (รวมวันที่ไม่มี Event)
+RESEED_INTERVAL_SECONDS = 600  # นับใหม่จาก Event เป็นระยะ กันตัวเลขเพี้ยนจาก worker อื่น
+PAGE_SIZE = 1000
+VISITOR = "visitor"
+GRANULARITIES = ("hour", "day", "week", "month")
+MAX_RANGE_DAYS = {"hour": 31, "day": 400, "week": 400, "month": 800}
+
+# Persisted rollup: สร้างตารางด้วย event_rollups.sql (ถ้ายังไม่มีจะนับจาก Event แทน)
+
+
+def role_key(event: dict, member_role: str | None = None) -> str:
+    """ใช้กฎเดียวกับ unknown_or_visitor เดิม: ไม่มีป้าย หรือไม่ผูกกับรถในระบบ = visitor"""
+    if not event.get("plate") or event.get("vehicle_id") is None:
+        return VISITOR
+    return member_role or "member"
+
+
+def _member_role(event: dict) -> str | None:
+    vehicle = event.get("Vehicle") or {}
+    if isinstance(vehicle, list):
+        vehicle = vehicle[0] if vehicle else {}
+    member = vehicle.get("member") or {}
+    if isinstance(member, list):
+        member = member[0] if member else {}
+    return member.get("role")
+
+
+def _to_daily(counts: Counter) -> Counter:
+    """ตัด hour ออกจาก key: (hour, direction, cam_id, role) -> (direction, cam_id, role)"""
+    daily: Counter = Counter()
+    for (_, direction, cam_id, role), n in counts.items():
+        daily[(direction, cam_id, role)] += n
+    return daily
+
+
+def _date_span(start: str, end: str) -> list[str]:
+    first = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d")
+    return [
+        (first + timedelta(days=i)).strftime("%Y-%m-%d")
+        for i in range((last - first).days + 1)
+    ]
+
+
+def _bucket_label(date: str, hour: int | None, granularity: str) -> str:
+    if granularity == "hour":
+        return f"{date} {hour:02d}:00"
+    if granularity == "week":
+        day = datetime.strptime(date, "%Y-%m-%d")
+        return (day - timedelta(days=day.weekday())).strftime("%Y-%m-%d")
+    if granularity == "month":
+        return date[:7]
+    return date
+
+
+class DashboardAggregator:
+    """
+    ตัวนับ Event รายชั่วโมงสำหรับ dashboard
+    - วันนี้: นับใน memory (seed จาก Event ครั้งแรก แล้วบวกเพิ่มตอน insert)
+    - วันที่ปิดแล้ว: อ่านจากตาราง event_rollup_hourly ถ้ายังไม่มีจะคำนวณจาก Event แล้วบันทึกไว้
+    key ของตัวนับ: (hour, direction, cam_id, role)
+    """
+
+    def __init__(self, supabase: "Client", tz: tzinfo):
+        self.supabase = supabase
+        self.tz = tz
+        self._lock = threading.Lock()
+        self._today: str | None = None
+        self._counts: Counter = Counter()
+        self._seeded_at: float | None = None
+        self._stale_days: set[str] = set()
+
+    # ---------------------------------------------------------------
+    # Helpers
+    # ---------------------------------------------------------------
+
+    def _local(self, value) -> datetime:
+        dt = value if isinstance(value, datetime) else datetime.fromisoformat(value)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.astimezone(self.tz)
+
+    def _today_str(self) -> str:
+        return datetime.now(self.tz).strftime("%Y-%m-%d")
+
+    def _bucket(self, event: dict, member_role: str | None = None):
+        local = self._local(event["datetime"])
+        key = (
+            local.hour,
+            (event.get("direction") or "UNKNOWN").upper(),
+            event.get("cam_id") or 0,
+            role_key(event, member_role),
+        )
+        return local.strftime("%Y-%m-%d"), key
+
+    def _day_range_utc(self, date: str) -> tuple[str, str]:
+        start_local = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=self.tz)
+        end_local = start_local + timedelta(days=1)
+        return (
+            start_local.astimezone(timezone.utc).isoformat(),
+            end_local.astimezone(timezone.utc).isoformat(),
+        )
+
+    def _count_from_events(self, date: str) -> Counter:
+        """นับ Event ของวันจาก database (แบ่งหน้าตาม event_id)"""
+        start_utc, end_utc = self._day_range_utc(date)
+        counts: Counter = Counter()
+        last_id = None
+
+        while True:
+            qb = (
+                self.supabase.table("Event")
+                .select(
+                    "event_id, datetime, direction, cam_id, plate, vehicle_id, "
+                    "Vehicle!Event_vehicle_id_fkey(member:Member!Vehicle_member_id_fkey(role))"
+                )
+                .gte("datetime", start_utc)
+                .lt("datetime", end_utc)
+                .order("event_id")
+                .limit(PAGE_SIZE)
+            )
+            if last_id is not None:
+                qb = qb.gt("event_id", last_id)
+
+            rows = qb.execute().data or []
+            for event in rows:
+                _, key = self._bucket(event, _member_role(event))
+                counts[key] += 1
+
+            if len(rows) < PAGE_SIZE:
+                return counts
+            last_id = rows[-1]["event_id"]
+
+    # ---------------------------------------------------------------
+    # Live counters
+    # ---------------------------------------------------------------
+
+    def record(self, event: dict | None, member_role: str | None = None):
+        """เรียกหลัง insert Event สำเร็จ"""
+        if not event or not event.get("datetime"):
+            return
+        try:
+            date, key = self._bucket(event, member_role)
+        except Exception as e:
+            logger.error(f"Dashboard counter skipped event: {e}")
+            return
+
+        with self._lock:
+            if date == self._today and self._seeded_at is not None:
+                self._counts[key] += 1
+            elif date < self._today_str():
+                # Event ย้อนหลัง (เช่น replay หลังเน็ตหลุด) rollup ของวันนั้นต้องคำนวณใหม่
+                self._stale_days.add(date)
+
+    def _today_counts(self) -> Counter:
+        today = self._today_str()
+        with self._lock:
+            fresh = (
+                self._today == today
+                and self._seeded_at is not None
+                and time.monotonic() - self._seeded_at < RESEED_INTERVAL_SECONDS
+            )
+            if fresh:
+                return Counter(self._counts)
+
+        counts = self._count_from_events(today)
+        with self._lock:
+            self._today = today
+            self._counts = counts
+            self._seeded_at = time.monotonic()
+            return Counter(counts)
+
+    # ---------------------------------------------------------------
+    # Closed days
+    # ---------------------------------------------------------------
+
+    def _load_rollup(self, date: str) -> Counter | None:
+        """rollup ของวันจากตาราง ถ้าไม่มี (ยังไม่คำนวณ) คืน None; อ่านตารางไม่ได้จะโยน exception"""
+        rows = (
+            self.supabase.table(ROLLUP_HOURLY_TABLE)
+            .select("hour, direction, cam_id, role, event_count")
+            .eq("bucket_date", date)
+            .execute()
+        ).data
+        if not rows:
+            # วันว่างไม่มีแถวใน rollup ดูจากตาราง event_rollup_days ว่าคำนวณแล้วหรือยัง
+            return Counter() if self._fetch_rollup_days(date, date) else None
+        return Counter(
+            {
+                (r["hour"], r["direction"], r["cam_id"], r["role"]): r["event_count"]
+                for r in rows
+            }
+        )
+
+    def _fetch_rollup(self, table: str, start: str, end: str) -> list[dict]:
+        """อ่านแถว rollup ของช่วงวันที่ (แบ่งหน้าละ PAGE_SIZE)"""
+        key_columns = ["bucket_date", "direction", "cam_id", "role"]
+        if table == ROLLUP_HOURLY_TABLE:
+            key_columns.insert(1, "hour")
+
+        rows, offset = [], 0
+        while True:
+            qb = (
+                self.supabase.table(table)
+                .select(", ".join(key_columns + ["event_count"]))
+                .gte("bucket_date", start)
+                .lte("bucket_date", end)
+            )
+            for column in key_columns:
+                qb = qb.order(column)
+            page = qb.range(offset, offset + PAGE_SIZE - 1).execute().data or []
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                return rows
+            offset += PAGE_SIZE
+
+    def _fetch_rollup_days(self, start: str, end: str) -> dict[str, int]:
+        """วันที่มี rollup แล้วในช่วง [start, end] -> จำนวน Event ของวันนั้น"""
+        days, offset = {}, 0
+        while True:
+            page = (
+                self.supabase.table(ROLLUP_DAYS_TABLE)
+                .select("bucket_date, event_count")
+                .gte("bucket_date", start)
+                .lte("bucket_date", end)
+                .order("bucket_date")
+                .range(offset, offset + PAGE_SIZE - 1)
+                .execute()
+            ).data or []
+            days.update({r["bucket_date"]: r["event_count"] for r in page})
+            if len(page) < PAGE_SIZE:
+                return days
+            offset += PAGE_SIZE
+
+    def _save_rollup(self, date: str, counts: Counter):
+        """เขียน rollup ของวันใหม่ทั้งวัน (hourly + daily) รันซ้ำได้ผลเหมือนเดิม"""
+        hourly_rows = [
+            {
+                "bucket_date": date,
+                "hour": hour,
+                "direction": direction,
+                "cam_id": cam_id,
+                "role": role,
+                "event_count": n,
+            }
+            for (hour, direction, cam_id, role), n in counts.items()
+        ]
+        daily_rows = [
+            {
+                "bucket_date": date,
+                "direction": direction,
+                "cam_id": cam_id,
+                "role": role,
+                "event_count": n,
+            }
+            for (direction, cam_id, role), n in _to_daily(counts).items()
+        ]
+
+        for table, rows in (
+            (ROLLUP_HOURLY_TABLE, hourly_rows),
+            (ROLLUP_DAILY_TABLE, daily_rows),
+        ):
+            self.supabase.table(table).delete().eq("bucket_date", date).execute()
+            if rows:
+                self.supabase.table(table).insert(rows).execute()
+
+        # เขียนหลังสุด: มีแถวนี้ = rollup ของวันครบแล้ว (วันว่างก็มีแถว event_count = 0)
+        self.supabase.table(ROLLUP_DAYS_TABLE).upsert(
+            {
+                "bucket_date": date,
+                "event_count": sum(counts.values()),
+                "rebuilt_at": datetime.now(timezone.utc).isoformat(),
+            },
+            on_conflict="bucket_date",
+        ).execute()
+
+    def rebuild_day(self, date: str) -> Counter:
+        """คำนวณ rollup ของวันจาก Event แล้วบันทึกทับของเดิม"""
+        counts = self._count_from_events(date)
+        self._save_rollup(date, counts)
+        with self._lock:
+            self._stale_days.discard(date)
+        return counts
+
+    def _closed_day_counts(self, date: str) -> Counter:
+        with self._lock:
+            stale = date in self._stale_days
+
+        if not stale:
+            try:
+                counts = self._load_rollup(date)
+            except Exception as e:
+                # ตาราง rollup ยังไม่ได้สร้าง (event_rollups.sql) หรืออ่านไม่ได้
+                logger.warning(f"Rollup unavailable for {date}, counting events: {e}")
+                return self._count_from_events(date)
+            if counts is not None:
+                return counts
+
+        try:
+            return self.rebuild_day(date)
+        except Exception as e:
+            logger.error(f"Failed to persist rollup for {date}: {e}")
+            return self._count_from_events(date)
+
+    def _closed_range_counts(
+        self, days: list[str], hourly: bool
+    ) -> dict[str, Counter]:
+        """ตัวนับของหลายวันที่ปิดแล้ว: อ่าน rollup ทีเดียว วันที่ขาดหายค่อยคำนวณเติม"""
+        table = ROLLUP_HOURLY_TABLE if hourly else ROLLUP_DAILY_TABLE
+        try:
+            rollup_rows = self._fetch_rollup(table, days[0], days[-1])
+            done_days = self._fetch_rollup_days(days[0], days[-1])
+        except Exception as e:
+            logger.warning(f"Rollup unavailable, counting events day by day: {e}")
+            fallback: dict[str, Counter] = {}
+            for date in days:
+                counts = self._count_from_events(date)
+                fallback[date] = counts if hourly else _to_daily(counts)
+            return fallback
+
+        per_day: dict[str, Counter] = {}
+        for r in rollup_rows:
+            key = (r["direction"], r["cam_id"], r["role"])
+            if hourly:
+                key = (r["hour"], *key)
+            per_day.setdefault(r["bucket_date"], Counter())[key] += r["event_count"]
+
+        with self._lock:
+            stale = set(self._stale_days)
+
+        for date in days:
+            if date in stale or date not in done_days:
+                counts = self._closed_day_counts(date)
+                per_day[date] = counts if hourly else _to_daily(counts)
+        return per_day
+
+    def counts_for(self, date: str) -> Counter:
+        """ตัวนับรายชั่วโมงของวัน (YYYY-MM-DD ตามเวลา Bangkok)"""
+        datetime.strptime(date, "%Y-%m-%d")  # ValueError ถ้ารูปแบบผิด
+        today = self._today_str()
+        if date == today:
+            return self._today_counts()
+        if date < today:
+            return self._closed_day_counts(date)
+        return Counter()
+
+    # ---------------------------------------------------------------
+    # Dashboard views
+    # ---------------------------------------------------------------
+
+    def hourly(self, date: str) -> list[dict]:
+        hourly_data = {
+            h: {"label": f"{h:02d}:00", "inside": 0, "outside": 0} for h in range(24)
+        }
+        for (hour, direction, _, _), n in self.counts_for(date).items():
+            if direction == "IN":
+                hourly_data[hour]["inside"] += n
+            elif direction == "OUT":
+                hourly_data[hour]["outside"] += n
+        return [hourly_data[h] for h in range(24)]
+
+    def summary(self, date: str) -> dict:
+        counts = self.counts_for(date)
+        return {
+            "date": date,
+            "total_events": sum(counts.values()),
+            "in": sum(n for (_, d, _, _), n in counts.items() if d == "IN"),
+            "out": sum(n for (_, d, _, _), n in counts.items() if d == "OUT"),
+            "unknown_or_visitor": sum(
+                n for (_, _, _, role), n in counts.items() if role == VISITOR
+            ),
+        }
+
+    def range_summary(
+        self,
+        start: str,
+        end: str,
+        granularity: str = "day",
+        cam_id: int | None = None,
+    ) -> list[dict]:
+        """สรุปจำนวน Event ช่วงวันที่ [start, end] ตาม granularity จากตาราง rollup"""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+        days = _date_span(start, end)
+        if not days:
+            raise ValueError("start must not be after end")
+        if len(days) > MAX_RANGE_DAYS[granularity]:
+            raise ValueError(
+                f"Range too large for granularity '{granularity}' "
+                f"(max {MAX_RANGE_DAYS[granularity]} days)"
+            )
+
+        hourly = granularity == "hour"
+        today = self._today_str()
+        closed = [d for d in days if d < today]
+        per_day = self._closed_range_counts(closed, hourly) if closed else {}
+        if today in days:
+            counts = self._today_counts()
+            per_day[today] = counts if hourly else _to_daily(counts)
+
+        buckets: dict[str, dict] = {}
+        for date in days:
+            if hourly:
+                for hour in range(24):
+                    label = _bucket_label(date, hour, granularity)
+                    buckets[label] = _empty_bucket(label)
+            else:
+                label = _bucket_label(date, None, granularity)
+                buckets.setdefault(label, _empty_bucket(label))
+
+        for date, counts in per_day.items():
+            for key, n in counts.items():
+                hour = key[0] if hourly else None
+                direction, cam, role = key[1:] if hourly else key
+                if cam_id is not None and cam != cam_id:
+                    continue
+                bucket = buckets[_bucket_label(date, hour, granularity)]
+                bucket["total"] += n
+                if direction == "IN":
+                    bucket["in"] += n
+                elif direction == "OUT":
+                    bucket["out"] += n
+                bucket["by_role"][role] = bucket["by_role"].get(role, 0) + n
+                cam_key = str(cam)
+                bucket["by_camera"][cam_key] = bucket["by_camera"].get(cam_key, 0) + n
+
+        return list(buckets.values())
+
+
+def _empty_bucket(label: str) -> dict:
+    return {
+        "bucket": label,
+        "total": 0,
+        "in": 0,
+        "out": 0,
+        "by_role": {},
+        "by_camera": {},
+    }
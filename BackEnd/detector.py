@@ -0,0 +1,311 @@
+import io
+import os
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from inference_backend import INFERENCE_BACKEND, load_detector, warm_up
+from utils import safe_crop
+
+# ===================================================================
+# CONFIGURATION
+# ===================================================================
+
+LPR_MODEL_PATH = "model/lpr_model.pt"
+MC_MODEL_PATH = "model/motorcycle_model.pt"
+PAD = 10
+MIN_CONFIDENCE = 0.3
+SCORE_WEIGHTS = {
+    'area': 0.3,
+    'sharpness': 0.3,
+    'confidence': 0.4
+}
+# หยุดประมวลผล burst เมื่อเจอป้ายที่ดีพอ: score รวมต้องถึง 'score' และแต่ละเทอม (normalize แล้ว) ต้องไม่ต่ำกว่าค่าที่กำหนด
+EARLY_EXIT_ENABLED = os.getenv("EARLY_EXIT_ENABLED", "1") == "1"
+EARLY_EXIT_THRESHOLDS = {
+    'score': float(os.getenv("EARLY_EXIT_SCORE", "0.7")),
+    'area': float(os.getenv("EARLY_EXIT_MIN_AREA", "0.3")),
+    'sharpness': float(os.getenv("EARLY_EXIT_MIN_SHARPNESS", "0.3")),
+    'confidence': float(os.getenv("EARLY_EXIT_MIN_CONFIDENCE", "0.6"))
+}
+# จำนวนเฟรมต่อการเรียกโมเดลหนึ่งรอบ (เฟรมคมสุดมาก่อน)
+DETECT_CHUNK_SIZE = int(os.getenv("DETECT_CHUNK_SIZE", "3"))
+RANK_MAX_WIDTH = 320
+
+# โหลดใน process ที่ใช้งานจริงเท่านั้น (API เมื่อไม่ใช้ worker pool หรือใน worker แต่ละตัว)
+model_lpr = None
+model_mc = None
+# predictor ของ ultralytics ไม่ thread-safe: request ที่รันพร้อมกันใน thread ต้องเรียกโมเดลทีละตัว
+model_lpr_lock = threading.Lock()
+model_mc_lock = threading.Lock()
+
+def load_models():
+    """โหลดโมเดลป้ายและมอไซ (INFERENCE_BACKEND=torch|onnx|openvino, INFERENCE_INT8=1 สำหรับโมเดล quantize)"""
+    global model_lpr, model_mc
+    model_lpr = load_detector(LPR_MODEL_PATH)
+    model_mc = load_detector(MC_MODEL_PATH)
+    print(f"โหลด YOLO สำเร็จ (backend: {INFERENCE_BACKEND}, pid: {os.getpid()})")
+
+def warm_up_models() -> dict:
+    """รันโมเดลรอบแรกให้ lazy init เกิดก่อนรับงานจริง คืนเวลาเป็น ms ต่อโมเดล"""
+    with model_mc_lock, model_lpr_lock:
+        return {
+            "motorcycle": warm_up(model_mc),
+            "plate": warm_up(model_lpr),
+        }
+
+# เปลี่ยนเป็นขาวดำแล้ววัดค่าความคม คืนเป็น float
+def blur_score(img_np):
+    gray = img_np if img_np.ndim == 2 else cv2.cvtColor(img_np,cv2.COLOR_BGR2GRAY)
+    return cv2.Laplacian(gray,cv2.CV_64F).var()
+
+# วัดความคมแบบเร็วบนภาพย่อขาวดำ ใช้จัดลำดับเฟรมก่อนเข้าโมเดล
+def quick_blur_score(img_np: np.ndarray) -> float:
+    h, w = img_np.shape[:2]
+    if w > RANK_MAX_WIDTH:
+        img_np = cv2.resize(
+            img_np, (RANK_MAX_WIDTH, max(1, int(h * RANK_MAX_WIDTH / w))),
+            interpolation=cv2.INTER_AREA
+        )
+    if img_np.ndim == 3:
+        img_np = cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY)
+    return blur_score(img_np)
+
+def normalize_area(area: float, max_area: float = 50000) -> float:
+    return min(area / max_area, 1.0)
+
+def normalize_sharpness(sharpness: float, max_sharpness: float = 1000) -> float:
+    return min(sharpness / max_sharpness, 1.0)
+
+# คำนวณ score ของแต่ละป้าย
+def calculate_plate_score(area: float, sharpness: float, confidence: float) -> float:
+    area_norm = normalize_area(area)
+    sharp_norm = normalize_sharpness(sharpness)
+    
+    score = (
+        area_norm * SCORE_WEIGHTS['area'] +
+        sharp_norm * SCORE_WEIGHTS['sharpness'] +
+        confidence * SCORE_WEIGHTS['confidence']
+    )
+    
+    return score
+
+# ป้ายนี้ดีพอจะหยุด burst ได้หรือยัง
+def is_good_enough(plate_info: Optional[dict]) -> bool:
+    if not EARLY_EXIT_ENABLED or plate_info is None:
+        return False
+    return (
+        plate_info['score'] >= EARLY_EXIT_THRESHOLDS['score'] and
+        normalize_area(plate_info['area']) >= EARLY_EXIT_THRESHOLDS['area'] and
+        normalize_sharpness(plate_info['sharpness']) >= EARLY_EXIT_THRESHOLDS['sharpness'] and
+        plate_info['confidence'] >= EARLY_EXIT_THRESHOLDS['confidence']
+    )
+
+# ตรวจหามอไซ คืนมอไซ
+def detect_motorcycle(pil_image:Image.Image,frame_np:np.ndarray)->List[np.ndarray]:
+    return detect_motorcycles_batch([pil_image], [frame_np])[0]
+
+# ตรวจหามอไซทุกเฟรมใน burst ด้วยการเรียกโมเดลครั้งเดียว คืน list ของมอไซต่อเฟรม
+def detect_motorcycles_batch(
+    pil_images: List[Image.Image], frames_np: List[np.ndarray]
+) -> List[List[np.ndarray]]:
+    mcs_per_frame = [[] for _ in frames_np]
+
+    if model_mc and frames_np:
+        try:
+            with model_mc_lock:
+                mc_results = model_mc(pil_images, classes=[3], verbose=False)
+            for i, result in enumerate(mc_results):
+                if not result.boxes or len(result.boxes) == 0:
+                    continue
+                for box in result.boxes.xyxy.cpu().numpy():
+                    x1, y1, x2, y2 = map(int, box)
+                    cropped = safe_crop(frames_np[i], x1, y1, x2, y2, pad=PAD)
+                    if cropped is not None:
+                        mcs_per_frame[i].append(cropped)
+        except Exception as e:
+            print(f"Error in motorcycle detection: {e}")
+
+    # เฟรมที่หามอไซไม่เจอ ใช้ทั้งภาพแทน
+    for i, mcs in enumerate(mcs_per_frame):
+        if not mcs:
+            mcs.append(frames_np[i])
+
+    return mcs_per_frame
+
+# หาป้ายที่ดีจากการคำนวณคะแนน
+def detect_best_plate(mc:np.ndarray)->Optional[dict]:
+    return detect_best_plates_batch([mc])[0]
+
+# หาป้ายของมอไซทุกคันด้วยการเรียกโมเดลครั้งเดียว คืนผลตามลำดับ mcs
+def detect_best_plates_batch(mcs: List[np.ndarray]) -> List[Optional[dict]]:
+    plates = [None] * len(mcs)
+    if not mcs:
+        return plates
+
+    try:
+        inputs = [Image.fromarray(mc) for mc in mcs]
+        with model_lpr_lock:
+            results = model_lpr(inputs, classes=[0], verbose=False, conf=MIN_CONFIDENCE)
+    except Exception as e:
+        print(f"Error in plate detection: {e}")
+        return plates
+
+    for i, (mc, result) in enumerate(zip(mcs, results)):
+        try:
+            plates[i] = _best_plate_from_result(mc, result)
+        except Exception as e:
+            print(f"Error in plate detection: {e}")
+
+    return plates
+
+def _best_plate_from_result(mc: np.ndarray, result) -> Optional[dict]:
+    if not result.boxes or len(result.boxes) == 0:
+        return None
+
+    confs = result.boxes.conf.cpu().numpy()
+    boxes = result.boxes.xyxy.cpu().numpy()
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    best_idx = areas.argmax()
+    conf, box, area = confs[best_idx], boxes[best_idx], areas[best_idx]
+
+    if conf < MIN_CONFIDENCE:
+        return None
+
+    sharpness = blur_score(mc)
+    score = calculate_plate_score(area, sharpness, conf)
+
+    plate_crop = safe_crop(mc, *map(int, box), pad=PAD)
+    if plate_crop is None:
+        return None
+
+    return {
+        'crop': plate_crop,
+        'score': score,
+        'confidence': float(conf),
+        'area': float(area),
+        'sharpness': float(sharpness)
+    }
+
+# เรียกใช้สองที่หามอไซกับป้ายแล้วเปรียบเทียบคะแนน
+def process_img(image_bytes: bytes, filename: str)->Optional[dict]:
+    best_result, _ = process_frames([(image_bytes, filename)])
+    return best_result
+
+# ประมวลผลทั้ง burst: decode -> เรียงเฟรมตามความคม -> หามอไซ/ป้ายทีละชุด (batch)
+# หยุดเมื่อเจอป้ายที่ดีพอ คืนป้ายที่ดีที่สุด + เวลาแต่ละขั้น
+def process_frames(frames: List[Tuple[bytes, str]]) -> Tuple[Optional[dict], dict]:
+    timings = {'detect_motorcycle_ms': 0.0, 'detect_plate_ms': 0.0}
+
+    t0 = time.perf_counter()
+    decoded = []
+    for frame_index, (image_bytes, filename) in enumerate(frames):
+        try:
+            pil_image = Image.open(io.BytesIO(image_bytes))
+            decoded.append((pil_image, np.array(pil_image), image_bytes, filename, frame_index))
+        except Exception as e:
+            print(f"Error processing image {filename}: {e}")
+    timings['decode_ms'] = _elapsed_ms(t0)
+
+    if not decoded:
+        return None, timings
+
+    t0 = time.perf_counter()
+    order = sorted(
+        range(len(decoded)), key=lambda i: quick_blur_score(decoded[i][1]), reverse=True
+    )
+    timings['rank_ms'] = _elapsed_ms(t0)
+
+    chunk_size = max(1, DETECT_CHUNK_SIZE) if EARLY_EXIT_ENABLED else len(order)
+    best_plate, best_owner = None, None
+    passes = 0
+
+    for start in range(0, len(order), chunk_size):
+        chunk = order[start:start + chunk_size]
+        passes += 1
+
+        t0 = time.perf_counter()
+        mcs_per_frame = detect_motorcycles_batch(
+            [decoded[i][0] for i in chunk], [decoded[i][1] for i in chunk]
+        )
+        timings['detect_motorcycle_ms'] += _elapsed_ms(t0)
+
+        # รวมมอไซของทุกเฟรมในชุดเป็น list เดียว แล้วจำว่ามาจากเฟรมไหน
+        all_mcs, owners = [], []
+        for frame_idx, mcs in zip(chunk, mcs_per_frame):
+            all_mcs.extend(mcs)
+            owners.extend([frame_idx] * len(mcs))
+
+        t0 = time.perf_counter()
+        plates = detect_best_plates_batch(all_mcs)
+        timings['detect_plate_ms'] += _elapsed_ms(t0)
+
+        for plate_info, frame_idx in zip(plates, owners):
+            if plate_info and (best_plate is None or plate_info['score'] > best_plate['score']):
+                best_plate, best_owner = plate_info, frame_idx
+
+        if is_good_enough(best_plate):
+            break
+
+    timings['detector_passes'] = passes
+    timings['frames_scanned'] = min(passes * chunk_size, len(order))
+
+    if best_plate is None:
+        return None, timings
+
+    _, image_np, image_bytes, filename, frame_index = decoded[best_owner]
+    return {
+        **best_plate,
+        'full_image_bytes': image_bytes,
+        'full_image_np': image_np,
+        'filename': filename,
+        'frame_index': frame_index
+    }, timings
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+# ===================================================================
+# WORKER PROCESS
+# ===================================================================
+
+# initializer ของ worker: โหลดโมเดลครั้งเดียวต่อ process แล้ว warm-up ก่อนรับงาน
+def init_worker():
+    load_models()
+    print(f"Warm-up worker {os.getpid()}: {warm_up_models()} ms")
+
+def worker_info() -> int:
+    return os.getpid()
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    # ฝั่ง API เป็นเจ้าของ block (unlink เอง) worker แค่เปิดอ่าน ไม่ให้ resource tracker ลบแทน
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+# อ่านเฟรม (JPEG bytes) จาก shared memory ตาม layout [(offset, length, filename)] แล้วประมวลผลทั้ง burst
+# คืนเฉพาะผลที่เล็ก (ภาพป้าย + คะแนน + index ของเฟรม) ไม่ส่งภาพเต็มกลับข้าม process
+def process_shared_frames(
+    shm_name: str, layout: List[Tuple[int, int, str]]
+) -> Tuple[Optional[dict], dict]:
+    shm = _attach_shared_memory(shm_name)
+    try:
+        frames = [
+            (bytes(shm.buf[offset:offset + length]), filename)
+            for offset, length, filename in layout
+        ]
+    finally:
+        shm.close()
+
+    best_result, timings = process_frames(frames)
+    if best_result is not None:
+        best_result.pop('full_image_bytes', None)
+        best_result.pop('full_image_np', None)
+    timings['worker_pid'] = os.getpid()
+    return best_result, timings
@@ -0,0 +1,7 @@
+-- Idempotency key ของ Event (event_outbox.py ส่งซ้ำได้เมื่อ timeout / 5xx)
+-- main_api ใช้หา Event เดิมก่อน insert, unique index กันสอง request ที่มาพร้อมกัน
+
+alter table "Event" add column if not exists idempotency_key text;
+
+create unique index if not exists event_idempotency_key_key
+    on "Event" (idempotency_key);
@@ -0,0 +1,7 @@
+-- ภาพย่อ / ภาพป้ายที่ batch_process สร้างคู่กับ blob (Event.thumb_url / Event.plate_url)
+-- รันครั้งเดียวใน Supabase SQL editor แล้วตั้ง EVENT_IMAGE_COLUMNS=true ใน .env
+-- ถ้ายังไม่ได้ตั้ง main_api จะไม่เขียน/อ่านสองคอลัมน์นี้ (ไม่ error แต่ไม่มี thumbUrl/plateUrl)
+
+alter table "Event"
+    add column if not exists thumb_url text,
+    add column if not exists plate_url text;
@@ -0,0 +1,227 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ===================================================================
+# CONFIGURATION
+# ===================================================================
+
+# ไฟล์ SQLite เก็บ Event ที่ยังส่งไม่ถึง API Server (อยู่รอดแม้ process ตาย)
+EVENT_OUTBOX_DB = os.getenv("EVENT_OUTBOX_DB", "event_outbox.db")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_BACKOFF_BASE_SECONDS = float(os.getenv("OUTBOX_BACKOFF_BASE_SECONDS", "1"))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "300"))
+OUTBOX_IDLE_SECONDS = 30  # ตื่นมาเช็คเองเป็นระยะ แม้ไม่มีใคร wake
+OUTBOX_TIMEOUT_SECONDS = 10
+# status ที่ส่งซ้ำไปก็ไม่ผ่าน: ย้ายไปเก็บเป็น failed ไม่ให้ขวางคิว
+PERMANENT_FAILURES = {400, 401, 403, 404, 413, 422}
+
+
+class EventOutbox:
+    """
+    Outbox ของ Event: /batch บันทึก payload ลง SQLite (WAL) แล้วตอบกลับทันที
+    thread เบื้องหลังคอยส่งตามลำดับด้วย requests.Session ที่ reuse connection
+    - ส่งเป็นชุดผ่าน bulk endpoint ถ้ามี ถ้า server ไม่รองรับจะส่งทีละ Event
+    - ส่งไม่ได้: รอแบบ exponential backoff แล้วลองใหม่ (ข้อมูลยังอยู่ในไฟล์)
+    - ทุก Event มี idempotency_key เก็บไว้ใน payload ส่งซ้ำกี่ครั้ง server ก็บันทึกครั้งเดียว
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        event_url: str,
+        bulk_url: Optional[str] = None,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+    ):
+        self.event_url = event_url
+        self.bulk_url = bulk_url
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._failures = 0
+        self._next_attempt = 0.0
+        self.stats = {"queued": 0, "delivered": 0, "failed": 0, "retries": 0}
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'pending',
+                last_error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, id);
+            """
+        )
+
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_maxsize=4))
+        self._session.mount("https://", HTTPAdapter(pool_maxsize=4))
+
+    # ---------------------------------------------------------------
+    # Producer
+    # ---------------------------------------------------------------
+
+    def enqueue(self, payload: dict) -> int:
+        """บันทึก payload ลงไฟล์ (commit แล้วถึงคืนค่า) และปลุก thread ให้ส่ง"""
+        payload.setdefault("idempotency_key", uuid.uuid4().hex)
+        with self._lock, self._db:
+            cur = self._db.execute(
+                "INSERT INTO outbox (payload, created_at) VALUES (?, ?)",
+                (json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+            self.stats["queued"] += 1
+        self._wake.set()
+        return cur.lastrowid
+
+    # ---------------------------------------------------------------
+    # Drain worker
+    # ---------------------------------------------------------------
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="event-outbox", daemon=True
+        )
+        self._thread.start()
+        print(f"[OUTBOX] เริ่มส่ง Event ค้าง {self.pending_count()} รายการ")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=OUTBOX_TIMEOUT_SECONDS)
+
+    def _run(self):
+        while not self._stop.is_set():
+            delay = self._next_attempt - time.monotonic()
+            if delay > 0:
+                self._wait(delay)
+                continue
+
+            rows = self._pending(self.batch_size)
+            if not rows:
+                self._wait(OUTBOX_IDLE_SECONDS)
+                continue
+
+            try:
+                self._deliver(rows)
+                self._failures = 0
+            except Exception as e:
+                self._failures += 1
+                self.stats["retries"] += 1
+                backoff = min(
+                    OUTBOX_BACKOFF_MAX_SECONDS,
+                    OUTBOX_BACKOFF_BASE_SECONDS * 2 ** (self._failures - 1),
+                )
+                self._next_attempt = time.monotonic() + backoff
+                self._mark_attempt([row_id for row_id, _ in rows], str(e))
+                print(f"[OUTBOX] ส่งไม่สำเร็จ ({e}) ลองใหม่ใน {backoff:.0f} วินาที")
+
+    def _wait(self, seconds: float):
+        self._wake.wait(seconds)
+        self._wake.clear()
+
+    def _pending(self, limit: int) -> list[tuple[int, dict]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, payload FROM outbox WHERE status = 'pending' "
+                "ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def _deliver(self, rows: list[tuple[int, dict]]):
+        if self.bulk_url and len(rows) > 1:
+            r = self._session.post(
+                self.bulk_url,
+                json=[payload for _, payload in rows],
+                timeout=OUTBOX_TIMEOUT_SECONDS,
+            )
+            if r.status_code in (404, 405):
+                print("[OUTBOX] API Server ไม่มี bulk endpoint ส่งทีละ Event แทน")
+                self.bulk_url = None
+            elif r.status_code in PERMANENT_FAILURES:
+                # ทั้งชุดถูกปฏิเสธ: ส่งทีละรายการเพื่อแยกตัวที่เสียออก
+                pass
+            else:
+                r.raise_for_status()
+                self._done([row_id for row_id, _ in rows])
+                return
+
+        for row_id, payload in rows:
+            r = self._session.post(
+                self.event_url, json=payload, timeout=OUTBOX_TIMEOUT_SECONDS
+            )
+            if r.status_code in PERMANENT_FAILURES:
+                print(f"[ERROR] API Server (/events) ปฏิเสธ: {r.text}")
+                self._mark_failed(row_id, r.text)
+                continue
+            r.raise_for_status()
+            self._done([row_id])
+
+    # ---------------------------------------------------------------
+    # Bookkeeping
+    # ---------------------------------------------------------------
+
+    def _done(self, ids: list[int]):
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+            self.stats["delivered"] += len(ids)
+
+    def _mark_attempt(self, ids: list[int], error: str):
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?",
+                [(error, i) for i in ids],
+            )
+
+    def _mark_failed(self, row_id: int, error: str):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE outbox SET status = 'failed', attempts = attempts + 1, "
+                "last_error = ? WHERE id = ?",
+                (error, row_id),
+            )
+            self.stats["failed"] += 1
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status = 'pending'"
+            ).fetchone()[0]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            counts = dict(
+                self._db.execute(
+                    "SELECT status, COUNT(*) FROM outbox GROUP BY status"
+                ).fetchall()
+            )
+            oldest = self._db.execute(
+                "SELECT MIN(created_at) FROM outbox WHERE status = 'pending'"
+            ).fetchone()[0]
+        return {
+            **self.stats,
+            "pending": counts.get("pending", 0),
+            "failed_stored": counts.get("failed", 0),
+            "oldest_pending_age_s": round(time.time() - oldest, 1) if oldest else 0,
+            "consecutive_failures": self._failures,
+            "bulk_enabled": self.bulk_url is not None,
+        }
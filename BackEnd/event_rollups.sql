@@ -0,0 +1,30 @@
+-- Persisted dashboard rollups (dashboard_stats.py)
+-- รันครั้งเดียวใน Supabase SQL editor ก่อนใช้ /dashboard/range
+-- ถ้ายังไม่ได้สร้าง dashboard จะนับจากตาราง Event ตรง ๆ แทน (ช้ากว่าแต่ไม่ error)
+
+create table if not exists event_rollup_hourly (
+    bucket_date date not null,          -- วันที่ตามเวลา Bangkok
+    hour smallint not null,             -- 0-23 ตามเวลา Bangkok
+    direction text not null,            -- IN / OUT / UNKNOWN
+    cam_id integer not null default 0,  -- 0 = ไม่ทราบกล้อง
+    role text not null,                 -- role ของสมาชิก หรือ 'visitor'
+    event_count integer not null,
+    primary key (bucket_date, hour, direction, cam_id, role)
+);
+
+create table if not exists event_rollup_daily (
+    bucket_date date not null,
+    direction text not null,
+    cam_id integer not null default 0,
+    role text not null,
+    event_count integer not null,
+    primary key (bucket_date, direction, cam_id, role)
+);
+
+-- หนึ่งแถวต่อวันที่คำนวณ rollup แล้ว (รวมวันที่ไม่มี Event เลย event_count = 0)
+-- ใช้แยก "วันว่าง" ออกจาก "ยังไม่ได้คำนวณ" โดยไม่ต้องนับจาก Event ซ้ำ
+create table if not exists event_rollup_days (
+    bucket_date date primary key,
+    event_count integer not null,
+    rebuilt_at timestamptz not null default now()
+);
@@ -0,0 +1,94 @@
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from ultralytics import YOLO
+
+# ===================================================================
+# CONFIGURATION
+# ===================================================================
+
+# torch = โหลด .pt ตรง ๆ, onnx = ONNX Runtime, openvino = OpenVINO (CPU Intel)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").lower()
+# quantize เป็น INT8 (onnx: dynamic quantization, openvino: NNCF ต้องมีชุดภาพ calibration)
+INFERENCE_INT8 = os.getenv("INFERENCE_INT8", "0") == "1"
+INFERENCE_IMGSZ = int(os.getenv("INFERENCE_IMGSZ", "640"))
+# yaml ของ dataset สำหรับ calibrate INT8 ของ OpenVINO
+INFERENCE_CALIB_DATA = os.getenv("INFERENCE_CALIB_DATA")
+WARMUP_RUNS = int(os.getenv("INFERENCE_WARMUP_RUNS", "2"))
+
+BACKENDS = ("torch", "onnx", "openvino")
+
+
+def _exported_path(pt_path: Path, backend: str, int8: bool) -> Path:
+    """ตำแหน่งไฟล์ที่ export ไว้ (อยู่ข้าง .pt ตามรูปแบบชื่อของ ultralytics)"""
+    if backend == "onnx":
+        return pt_path.with_name(f"{pt_path.stem}{'_int8' if int8 else ''}.onnx")
+    return pt_path.with_name(f"{pt_path.stem}{'_int8' if int8 else ''}_openvino_model")
+
+
+def _quantize_onnx(fp32_path: Path, int8_path: Path) -> None:
+    from onnxruntime.quantization import QuantType, quantize_dynamic  # optional dependency
+
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QUInt8)
+
+
+def _export(pt_path: Path, backend: str, int8: bool) -> Path:
+    """export ครั้งแรกครั้งเดียว ครั้งต่อไปใช้ไฟล์เดิม"""
+    target = _exported_path(pt_path, backend, int8)
+    if target.exists():
+        return target
+
+    print(f"[INFERENCE] export {pt_path.name} -> {target.name}")
+    model = YOLO(str(pt_path))
+    if backend == "onnx":
+        fp32 = _exported_path(pt_path, "onnx", False)
+        if not fp32.exists():
+            fp32 = Path(
+                model.export(format="onnx", imgsz=INFERENCE_IMGSZ, dynamic=True, simplify=True)
+            )
+        if int8:
+            _quantize_onnx(fp32, target)
+        return target
+
+    kwargs = {"format": "openvino", "imgsz": INFERENCE_IMGSZ, "dynamic": True}
+    if int8:
+        kwargs["int8"] = True
+        if INFERENCE_CALIB_DATA:
+            kwargs["data"] = INFERENCE_CALIB_DATA
+    exported = Path(model.export(**kwargs))
+    if exported != target:
+        exported.rename(target)
+    return target
+
+
+def load_detector(
+    pt_path: str, backend: str = INFERENCE_BACKEND, int8: bool = INFERENCE_INT8
+) -> YOLO:
+    """
+    โหลดโมเดล YOLO ตาม backend ที่เลือก ได้ object YOLO เหมือนกันทุกแบบ
+    (เรียก model(images, ...) ได้เหมือนเดิม) ถ้า export/โหลดไม่ได้จะกลับไปใช้ .pt
+    """
+    if backend not in BACKENDS:
+        print(f"[INFERENCE] ไม่รู้จัก backend '{backend}' ใช้ torch แทน")
+        backend = "torch"
+    if backend == "torch":
+        return YOLO(pt_path)
+
+    try:
+        model = YOLO(str(_export(Path(pt_path), backend, int8)), task="detect")
+        print(f"[INFERENCE] {Path(pt_path).name}: {backend}{' int8' if int8 else ''}")
+        return model
+    except Exception as e:
+        print(f"[INFERENCE] ใช้ {backend} กับ {pt_path} ไม่ได้ ({e}) ใช้ torch แทน")
+        return YOLO(pt_path)
+
+
+def warm_up(model: YOLO, runs: int = WARMUP_RUNS, imgsz: int = INFERENCE_IMGSZ) -> float:
+    """รันภาพว่างก่อนรับงานจริง ให้ lazy init (graph/kernel/memory) เกิดตอน startup; คืนเวลาเป็น ms"""
+    dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    t0 = time.perf_counter()
+    for _ in range(max(1, runs)):
+        model([dummy], verbose=False)
+    return round((time.perf_counter() - t0) * 1000, 1)
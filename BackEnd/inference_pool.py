@@ -0,0 +1,164 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+import detector
+
+# ===================================================================
+# CONFIGURATION
+# ===================================================================
+
+# จำนวน process ที่รันโมเดล (0 = รันใน process ของ API ผ่าน thread เหมือนเดิม)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+# burst ที่รอคิวได้เพิ่มจากที่กำลังประมวลผลอยู่ เกินนี้ตอบ 429
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "8"))
+RETRY_AFTER_SECONDS = 1
+
+
+class InferencePoolBusy(Exception):
+    """คิว inference เต็ม ให้ client ส่ง burst ใหม่ภายหลัง"""
+
+
+class InferencePoolUnavailable(Exception):
+    """worker process ตาย (เช่น OOM) burst นี้ประมวลผลไม่ได้ pool กำลังเริ่มใหม่"""
+
+
+class InferencePool:
+    """
+    กระจาย burst ไปให้ worker process แต่ละตัว (โหลดโมเดลครั้งเดียวตอนเริ่ม) รันขนานกันได้ตามจำนวน core
+    - เฟรม (JPEG bytes) ของ burst ถูกคัดลอกลง shared memory block เดียว worker อ่านตาม offset
+      ไม่ต้อง pickle ภาพ ผลที่ส่งกลับมีแค่ภาพป้ายกับคะแนน
+    - รับงานค้างได้ไม่เกิน workers + queue_size burst เกินนั้นโยน InferencePoolBusy ทันที
+    - worker ตายทำให้ ProcessPoolExecutor ใช้ต่อไม่ได้ จะสร้าง pool ใหม่แล้วโยน InferencePoolUnavailable
+    workers=0 จะรัน detector.process_frames ใน thread ของ process นี้ (ยังจำกัดคิวเหมือนกัน)
+    """
+
+    def __init__(self, workers: int = INFERENCE_WORKERS, queue_size: int = INFERENCE_QUEUE_SIZE):
+        self.workers = max(0, workers)
+        self.max_pending = max(1, self.workers) + max(0, queue_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._restart_lock = asyncio.Lock()
+        self.stats = {"processed": 0, "rejected": 0, "errors": 0, "restarts": 0}
+
+    async def start(self):
+        if self.workers == 0:
+            detector.load_models()
+            print(f"Warm-up models: {await asyncio.to_thread(detector.warm_up_models)} ms")
+            return
+        await self._start_workers()
+
+    async def _start_workers(self):
+        # spawn: worker ไม่รับ state ของ event loop / thread / client จาก process แม่
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=detector.init_worker,
+        )
+        # สั่งงานเปล่าให้ครบทุกตัว worker จะ spawn และโหลดโมเดลตอน startup ไม่ใช่ตอน burst แรก
+        loop = asyncio.get_running_loop()
+        try:
+            pids = await asyncio.gather(
+                *(loop.run_in_executor(executor, detector.worker_info) for _ in range(self.workers))
+            )
+        except Exception:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        self._executor = executor
+        print(f"[INFERENCE] worker pool พร้อม {len(set(pids))} process (คิวสูงสุด {self.max_pending} burst)")
+
+    async def _restart(self, broken: Optional[ProcessPoolExecutor]):
+        """สร้าง pool ใหม่แทนตัวที่ตาย (request ที่เจอพร้อมกันสร้างแค่ครั้งเดียว)"""
+        async with self._restart_lock:
+            if self._executor is not broken:
+                return
+            if broken is not None:
+                broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self.stats["restarts"] += 1
+            print("[INFERENCE] worker process ตาย เริ่ม worker pool ใหม่")
+            try:
+                await self._start_workers()
+            except Exception as e:
+                print(f"[INFERENCE] เริ่ม worker pool ใหม่ไม่สำเร็จ: {e}")
+
+    async def stop(self):
+        if self._executor:
+            await asyncio.to_thread(self._executor.shutdown, True, cancel_futures=True)
+            self._executor = None
+
+    async def process_frames(self, frames: List[Tuple[bytes, str]]) -> Tuple[Optional[dict], dict]:
+        if self._pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise InferencePoolBusy(f"inference queue full ({self._pending} bursts pending)")
+
+        self._pending += 1
+        try:
+            if self.workers == 0:
+                result = await asyncio.to_thread(detector.process_frames, frames)
+            else:
+                result = await self._process_in_worker(frames)
+            self.stats["processed"] += 1
+            return result
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self._pending -= 1
+
+    async def _process_in_worker(self, frames: List[Tuple[bytes, str]]) -> Tuple[Optional[dict], dict]:
+        if not frames:
+            return None, {}
+
+        executor = self._executor
+        if executor is None:
+            await self._restart(None)
+            raise InferencePoolUnavailable("inference workers are restarting")
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, sum(len(b) for b, _ in frames)))
+        future = None
+        try:
+            layout, offset = [], 0
+            for image_bytes, filename in frames:
+                shm.buf[offset:offset + len(image_bytes)] = image_bytes
+                layout.append((offset, len(image_bytes), filename))
+                offset += len(image_bytes)
+
+            future = executor.submit(detector.process_shared_frames, shm.name, layout)
+            best_result, timings = await asyncio.shield(asyncio.wrap_future(future))
+        except BrokenProcessPool as e:
+            await self._restart(executor)
+            raise InferencePoolUnavailable(f"inference worker crashed: {e}") from e
+        except asyncio.CancelledError:
+            # request ถูกยกเลิก: ยกเลิกงานที่ยังไม่เริ่ม งานที่รันอยู่ต้องรอให้จบก่อนคืน shared memory
+            if future is not None:
+                future.cancel()
+            raise
+        finally:
+            if future is None or future.done():
+                _release_shared_memory(shm)
+            else:
+                future.add_done_callback(lambda _: _release_shared_memory(shm))
+
+        # worker ไม่ส่งภาพเต็มกลับ ใช้ bytes เดิมของเฟรมที่ชนะ (decode ตอนบีบอัดรูป)
+        if best_result is not None:
+            best_result['full_image_bytes'] = frames[best_result['frame_index']][0]
+            best_result['full_image_np'] = None
+        return best_result, timings
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+        }
+
+
+def _release_shared_memory(shm: shared_memory.SharedMemory):
+    shm.close()
+    shm.unlink()
@@ -11,17 +11,28 @@ from fastapi import (
 )
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, field_validator
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ValidationError, field_validator
 from typing import Optional, Union, Literal
 from passlib.context import CryptContext
 from matching_logic import find_best_match
-from background_matcher import process_unmatched_sessions
+from background_matcher import (
+    process_unmatched_sessions,
+    notify_unmatched_exit,
+    notify_new_entry,
+    notify_session_corrected,
+    notify_event_corrected,
+)
+from session_index import ParkedSessionIndex, parked_index
+from dashboard_stats import DashboardAggregator
+from ws_pubsub import LocalPubSub, build_pubsub
 from datetime import datetime, timedelta, timezone
 import os
 import io
+import itertools
 import csv
 import json
+import zlib
 import jwt
 import asyncio
 import logging
@@ -29,7 +40,13 @@ import sys
 
 from supabase import create_client
 from dotenv import load_dotenv
-from utils import upload_image_to_storage
+from utils import (
+    create_presigned_upload,
+    get_upload_stats,
+    upload_image_background,
+    wait_background_uploads,
+)
+import httpx
 
 # ===================================================================
 # CONFIGURATION & SETUP
@@ -74,7 +91,11 @@ BKK = get_bkk_tz()
 load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Event.thumb_url / Event.plate_url exist (event_image_columns.sql applied)
+EVENT_IMAGE_COLUMNS = os.getenv("EVENT_IMAGE_COLUMNS", "false").lower() in ("1", "true", "yes")
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+dashboard_stats = DashboardAggregator(supabase, BKK)
+storage_client: httpx.AsyncClient | None = None  # created on startup
 
 # FastAPI Initialization
 app = FastAPI(title="License Plate Recognition API")
@@ -85,6 +106,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
 # Authentication Configuration
@@ -118,8 +140,13 @@ class EventIn(BaseModel):
     province: str | None = None
     cam_id: int | None = None
     blob: str | None = None
+    # Derivatives stored next to blob (Event.thumb_url / Event.plate_url, nullable text)
+    thumb_url: str | None = None
+    plate_url: str | None = None
     vehicle_id: int | None = None
     direction: str | None = None
+    # Set by the batch server outbox; retries reuse it (Event.idempotency_key, unique)
+    idempotency_key: str | None = None
 
     @field_validator("datetime")
     @classmethod
@@ -244,34 +271,213 @@ async def get_current_user(
 # ===================================================================
 
 
+WS_CLIENT_QUEUE_SIZE = int(os.getenv("WS_CLIENT_QUEUE_SIZE", "100"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "5"))
+
+
+WS_ANY = "*"
+
+
+class WSSubscription(BaseModel):
+    """Filters sent by a client: {"action": "subscribe", ...}"""
+
+    direction: Literal["IN", "OUT"] | None = None
+    cam_id: int | None = None
+    plate_prefix: str | None = None
+    role: Literal["member", "visitor"] | None = None
+    session_only: bool = False
+
+    @field_validator("plate_prefix")
+    @classmethod
+    def _canon_prefix(cls, v):
+        return ("".join(v.split()).lower() or None) if v else None
+
+    @property
+    def topic(self) -> tuple:
+        return (
+            self.direction or WS_ANY,
+            self.cam_id if self.cam_id is not None else WS_ANY,
+        )
+
+    def matches(self, info: dict) -> bool:
+        """Filters not covered by the (direction, cam_id) topic index"""
+        if self.session_only and not info["session"]:
+            return False
+        if self.plate_prefix and not info["plate"].startswith(self.plate_prefix):
+            return False
+        if self.role and info["role"] != self.role:
+            return False
+        return True
+
+
+def _ws_message_info(message: str) -> dict:
+    """Routing attributes of a broadcast message (parsed once per worker)"""
+    try:
+        data = json.loads(message)
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+
+    kind = data.get("type")
+    direction = data.get("direction") or {"entry": "IN", "exit": "OUT"}.get(kind)
+    plate = data.get("plate") if data.get("plate") not in (None, "-") else ""
+    # Messages without role info only reach subscribers that do not filter on role
+    role = None
+    if "role" in data:
+        role = (
+            "visitor"
+            if (data["role"] or "visitor").lower() == "visitor"
+            else "member"
+        )
+
+    return {
+        "direction": (direction or "").upper() or None,
+        "cam_id": data.get("cam_id"),
+        "plate": "".join(plate.split()).lower(),
+        "role": role,
+        "session": kind in ("entry", "exit"),
+    }
+
+
+class _WSClient:
+    """One connected browser with its own bounded send queue"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=WS_CLIENT_QUEUE_SIZE)
+        self.dropped = 0
+        self.task: asyncio.Task | None = None
+        self.subscription = WSSubscription()
+
+
 class ConnectionManager:
-    """Manage WebSocket connections"""
+    """Manage WebSocket connections
 
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+    broadcast() hands the (already serialized) message to the pub/sub backend,
+    which calls publish() in every worker. publish() only enqueues it for each
+    local client; a sender task per client does the actual send_text, so a slow
+    or dead browser never delays the request that produced the event.
+
+    Clients are indexed by their (direction, cam_id) topic, with "*" as a
+    wildcard, so a message is only matched against subscribers that can want it.
+    """
+
+    def __init__(self, pubsub=None):
+        self.clients: dict[WebSocket, _WSClient] = {}
+        self.topics: dict[tuple, set[WebSocket]] = {}
+        self.pubsub = pubsub or LocalPubSub()
+
+    async def start(self):
+        try:
+            await self.pubsub.start(self.publish)
+        except Exception as e:
+            logger.error(
+                f"Pub/sub backend '{self.pubsub.name}' unavailable, using local: {e}"
+            )
+            self.pubsub = LocalPubSub()
+            await self.pubsub.start(self.publish)
+
+    async def stop(self):
+        await self.pubsub.stop()
+
+    @property
+    def active_connections(self) -> list[WebSocket]:
+        return list(self.clients)
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info(f"WebSocket connected: {len(self.active_connections)} active")
+        client = _WSClient(websocket)
+        client.task = asyncio.create_task(self._sender(client))
+        self.clients[websocket] = client
+        self.topics.setdefault(client.subscription.topic, set()).add(websocket)
+        logger.info(f"WebSocket connected: {len(self.clients)} active")
+
+    def _unindex(self, client: _WSClient):
+        topic = client.subscription.topic
+        subscribers = self.topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(client.websocket)
+            if not subscribers:
+                del self.topics[topic]
+
+    def subscribe(self, websocket: WebSocket, subscription: WSSubscription):
+        client = self.clients.get(websocket)
+        if not client:
+            return
+        self._unindex(client)
+        client.subscription = subscription
+        self.topics.setdefault(subscription.topic, set()).add(websocket)
+        logger.debug(f"WebSocket subscribed: {subscription.model_dump()}")
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            logger.info(
-                f"WebSocket disconnected: {len(self.active_connections)} active"
-            )
+        client = self.clients.pop(websocket, None)
+        if client:
+            self._unindex(client)
+            if client.task and client.task is not asyncio.current_task():
+                client.task.cancel()
+            logger.info(f"WebSocket disconnected: {len(self.clients)} active")
+
+    async def _sender(self, client: _WSClient):
+        try:
+            while True:
+                message = await client.queue.get()
+                await asyncio.wait_for(
+                    client.websocket.send_text(message), WS_SEND_TIMEOUT_SECONDS
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Timed out or connection gone: drop the client, the browser reconnects
+            logger.warning(f"WebSocket sender stopped: {e}")
+            self.disconnect(client.websocket)
+            try:
+                await client.websocket.close()
+            except Exception:
+                pass
+
+    def _subscribers(self, info: dict) -> set[WebSocket]:
+        direction, cam_id = info["direction"], info["cam_id"]
+        keys = [(WS_ANY, WS_ANY)]
+        if direction:
+            keys.append((direction, WS_ANY))
+        if cam_id is not None:
+            keys.append((WS_ANY, cam_id))
+            if direction:
+                keys.append((direction, cam_id))
+
+        subscribers = set()
+        for key in keys:
+            subscribers.update(self.topics.get(key, ()))
+        return subscribers
+
+    def publish(self, message: str):
+        """Enqueue message for every matching client without awaiting any send"""
+        info = _ws_message_info(message)
+        for websocket in self._subscribers(info):
+            client = self.clients.get(websocket)
+            if not client or not client.subscription.matches(info):
+                continue
+            try:
+                client.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Client fell behind: drop its oldest pending message
+                try:
+                    client.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+                client.queue.put_nowait(message)
+                client.dropped += 1
+                if client.dropped % WS_CLIENT_QUEUE_SIZE == 1:
+                    logger.warning(
+                        f"WebSocket client lagging, dropped {client.dropped} messages"
+                    )
 
     async def broadcast(self, message: str):
-        logger.info(f"Broadcasting to {len(self.active_connections)} clients")
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                logger.error(f"Broadcast error: {e}")
+        await self.pubsub.publish(message)
 
 
-manager = ConnectionManager()
+manager = ConnectionManager(build_pubsub())
 
 
 # ===================================================================
@@ -293,6 +499,62 @@ def _canon_text(s: str | None) -> str | None:
     return s.strip().lower() or None
 
 
+def _event_ws_payload(saved_event: dict, vehicle_data: dict | None) -> dict:
+    """WebSocket message for a newly inserted Event"""
+    return {
+        "datetime": saved_event.get("datetime"),
+        "plate": saved_event.get("plate") or "-",
+        "province": saved_event.get("province") or "-",
+        "direction": saved_event.get("direction") or "-",
+        "cam_id": saved_event.get("cam_id"),
+        "role": (
+            (vehicle_data.get("member") or {}).get("role")
+            if vehicle_data
+            else "Visitor"
+        ),
+        "image": saved_event.get("blob"),
+        "blob": saved_event.get("blob"),
+        "thumb": saved_event.get("thumb_url"),
+    }
+
+
+def _pg_quote(value: str) -> str:
+    """Quote a value for use inside a PostgREST or=() filter"""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _lookup_vehicles_bulk(pairs: set[tuple[str, str]]) -> dict[tuple[str, str], dict]:
+    """Resolve many (plate, province) pairs with the same contains-match as create_event"""
+    plates = sorted({plate for plate, _ in pairs})
+    candidates = []
+    for i in range(0, len(plates), VEHICLE_LOOKUP_CHUNK):
+        condition = ",".join(
+            f"plate.ilike.{_pg_quote(f'*{plate}*')}"
+            for plate in plates[i : i + VEHICLE_LOOKUP_CHUNK]
+        )
+        resp = (
+            supabase.table("Vehicle")
+            .select(
+                "vehicle_id, plate, province, member_id, "
+                "member:Member!Vehicle_member_id_fkey(role)"
+            )
+            .or_(condition)
+            .execute()
+        )
+        candidates.extend(resp.data or [])
+
+    vehicles = {}
+    for plate, province in pairs:
+        for v in candidates:
+            if (
+                plate.lower() in (v.get("plate") or "").lower()
+                and province.lower() in (v.get("province") or "").lower()
+            ):
+                vehicles[(plate, province)] = v
+                break
+    return vehicles
+
+
 def _role_from_plate_province(plate: str | None, province: str | None):
     """Get role from plate and province (fallback)"""
     if not plate or not province:
@@ -329,6 +591,356 @@ def clean_blob(blob: str | None) -> str | None:
     return blob
 
 
+def event_image_columns(thumb_url: str | None, plate_url: str | None) -> dict:
+    """thumb_url/plate_url for an Event insert, leaving out empty ones and
+    everything until the columns are migrated (EVENT_IMAGE_COLUMNS)"""
+    if not EVENT_IMAGE_COLUMNS:
+        return {}
+    urls = {"thumb_url": clean_blob(thumb_url), "plate_url": clean_blob(plate_url)}
+    return {k: v for k, v in urls.items() if v}
+
+
+# An exit may lose its best candidate to another worker; give up after this many
+EXIT_MATCH_ATTEMPTS = 3
+
+
+def _complete_parked_session(
+    plate: str, province: str | None, exit_time: datetime, exit_event_id: int
+) -> tuple[dict | None, dict | None, int | None]:
+    """
+    Match an exit to a parked session and close it.
+    The update only applies while the session is still parked; if another worker
+    completed it first, drop it from the index and try the next candidate.
+    Returns (match_result, updated_session, duration_minutes).
+    """
+    for _ in range(EXIT_MATCH_ATTEMPTS):
+        match_result = find_best_match(plate, province or "", supabase)
+        if not match_result:
+            return None, None, None
+
+        session = match_result["session"]
+        entry_time = datetime.fromisoformat(session["entry_time"])
+        duration = int((exit_time - entry_time).total_seconds() / 60)
+
+        updated = (
+            supabase.table("parkingsession")
+            .update(
+                {
+                    "plate_number_exit": plate,
+                    "exit_time": exit_time.isoformat(),
+                    "exit_event_id": exit_event_id,
+                    "status": "completed",
+                    "match_type": match_result["match_type"],
+                    "confidence_score": match_result["confidence"],
+                    "duration_minutes": duration,
+                }
+            )
+            .eq("session_id", session["session_id"])
+            .eq("status", "parked")
+            .execute()
+        )
+        parked_index.remove(session["session_id"])
+        if updated.data:
+            return match_result, updated.data[0], duration
+
+        logger.info(
+            f"Session {session['session_id']} already closed elsewhere, "
+            f"re-matching exit {plate}"
+        )
+    return None, None, None
+
+
+def _find_events_by_key(keys: list[str]) -> dict[str, dict]:
+    """Events already stored under these idempotency keys (replayed deliveries)"""
+    found = {}
+    for i in range(0, len(keys), VEHICLE_LOOKUP_CHUNK):
+        resp = (
+            supabase.table("Event")
+            .select("*")
+            .in_("idempotency_key", keys[i : i + VEHICLE_LOOKUP_CHUNK])
+            .execute()
+        )
+        found.update({e["idempotency_key"]: e for e in resp.data or []})
+    return found
+
+
+def _events_with_sessions(event_ids: list[int]) -> set[int]:
+    """Event ids already referenced by a parkingsession (entry or exit side)"""
+    done = set()
+    for i in range(0, len(event_ids), VEHICLE_LOOKUP_CHUNK):
+        ids = ",".join(str(event_id) for event_id in event_ids[i : i + VEHICLE_LOOKUP_CHUNK])
+        resp = (
+            supabase.table("parkingsession")
+            .select("entry_event_id, exit_event_id")
+            .or_(f"entry_event_id.in.({ids}),exit_event_id.in.({ids})")
+            .execute()
+        )
+        for row in resp.data or []:
+            done.update(
+                event_id
+                for event_id in (row.get("entry_event_id"), row.get("exit_event_id"))
+                if event_id is not None
+            )
+    return done
+
+
+def _needs_session(saved_event: dict) -> bool:
+    """Entries always open a session; exits only when a plate was read"""
+    return saved_event.get("direction") == "IN" or (
+        saved_event.get("direction") == "OUT" and bool(saved_event.get("plate"))
+    )
+
+
+# Keyset pagination on (datetime, event_id), newest first
+EVENT_PAGE_SIZE = 1000
+EVENTS_MAX_PAGE_SIZE = 1000
+EVENTS_BULK_MAX = 1000
+VEHICLE_LOOKUP_CHUNK = 100
+EVENT_OUTPUT_FIELDS = [
+    "event_id",
+    "time",
+    "plate",
+    "province",
+    "status",
+    "check",
+    "imgUrl",
+    "thumbUrl",
+    "plateUrl",
+    "member_name",
+    "member_role",
+    "member_firstname",
+    "member_lastname",
+    "member_std_id",
+]
+EVENT_MEMBER_FIELDS = {
+    "check",
+    "member_name",
+    "member_role",
+    "member_firstname",
+    "member_lastname",
+    "member_std_id",
+}
+EXPORT_DEFAULT_FIELDS = ["datetime", "plate", "province", "direction"]
+EVENT_ARROW_INT_FIELDS = {"event_id", "cam_id", "vehicle_id"}
+
+
+def _parse_event_cursor(cursor: str) -> tuple[str, int]:
+    """Parse cursor "<datetime>,<event_id>" """
+    try:
+        dt, event_id = cursor.rsplit(",", 1)
+        datetime.fromisoformat(dt)
+        return dt, int(event_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail="Invalid cursor. Use <datetime>,<event_id>."
+        )
+
+
+def _apply_event_cursor(qb, cursor: tuple[str, int]):
+    """Rows strictly after cursor in (datetime DESC, event_id DESC) order"""
+    dt, event_id = cursor
+    return qb.or_(
+        f'datetime.lt."{dt}",and(datetime.eq."{dt}",event_id.lt.{event_id})'
+    )
+
+
+def _iter_event_pages(build_query, page_size: int = EVENT_PAGE_SIZE):
+    """Yield Event pages by keyset so memory stays flat and no row cap applies"""
+    cursor = None
+    while True:
+        qb = (
+            build_query()
+            .order("datetime", desc=True)
+            .order("event_id", desc=True)
+            .limit(page_size)
+        )
+        if cursor:
+            qb = _apply_event_cursor(qb, cursor)
+
+        rows = qb.execute().data or []
+        if not rows:
+            return
+        yield rows
+
+        if len(rows) < page_size:
+            return
+        cursor = (rows[-1]["datetime"], rows[-1]["event_id"])
+
+
+def _event_row(e: dict, fields: list[str]) -> dict:
+    """Shape an Event row for GET /events, keeping only the requested fields"""
+    vehicle = e.get("Vehicle") or {}
+    if isinstance(vehicle, list):
+        vehicle = vehicle[0] if vehicle else {}
+
+    member = vehicle.get("Member") or {}
+    if isinstance(member, list):
+        member = member[0] if member else {}
+
+    role = member.get("role")
+    check_status = (
+        "บุคคล ภายนอก"
+        if not role or str(role).lower() == "visitor"
+        else "บุคคล ภายใน"
+    )
+
+    direction_en = (e.get("direction") or "").upper()
+    direction_th = {"IN": "เข้า", "OUT": "ออก"}.get(direction_en, "ไม่ทราบ")
+
+    member_name = None
+    if member.get("firstname") or member.get("lastname"):
+        member_name = f"{member.get('firstname', '')} {member.get('lastname', '')}".strip()
+
+    row = {
+        "event_id": e.get("event_id"),
+        "time": e.get("datetime"),
+        "plate": e.get("plate") or "-",
+        "province": e.get("province") or "-",
+        "status": direction_th,
+        "check": check_status,
+        "imgUrl": e.get("blob") or None,
+        "thumbUrl": e.get("thumb_url") or None,
+        "plateUrl": e.get("plate_url") or None,
+        "member_name": member_name,
+        "member_role": role,
+        "member_firstname": member.get("firstname"),
+        "member_lastname": member.get("lastname"),
+        "member_std_id": member.get("std_id"),
+    }
+    return {k: row[k] for k in fields}
+
+
+def _stream_csv(pages):
+    """Yield CSV text page by page (header from the first page)"""
+    buffer = io.StringIO(newline="")
+    writer = None
+
+    try:
+        for rows in pages:
+            if writer is None:
+                buffer.write("\ufeff")
+                writer = csv.DictWriter(
+                    buffer, fieldnames=list(rows[0].keys()), extrasaction="ignore"
+                )
+                writer.writeheader()
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    except Exception as e:
+        # Re-raise so the connection aborts instead of ending a truncated 200
+        logger.error(f"Export stream aborted: {e}")
+        raise
+
+    if writer is None:
+        buffer.write("\ufeff")
+        csv.DictWriter(buffer, fieldnames=EXPORT_DEFAULT_FIELDS).writeheader()
+        yield buffer.getvalue()
+
+
+def _gzip_stream(chunks):
+    """
+    Compress a text stream into a single gzip member on the fly.
+    Errors from the source propagate before flush, so a failed export never
+    ends with a valid gzip trailer.
+    """
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _StreamSink(io.RawIOBase):
+    """Write-only sink that hands written bytes back to a generator"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _stream_arrow(pages, parquet: bool):
+    """Yield Parquet (one row group per page) or Arrow IPC stream bytes"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise HTTPException(
+            status_code=501, detail="Parquet/Arrow export requires pyarrow"
+        )
+
+    def to_table(rows, fields):
+        columns = {
+            name: [
+                r.get(name) if name in EVENT_ARROW_INT_FIELDS or r.get(name) is None
+                else str(r.get(name))
+                for r in rows
+            ]
+            for name in fields
+        }
+        return pa.table(
+            {
+                name: pa.array(
+                    values,
+                    type=pa.int64() if name in EVENT_ARROW_INT_FIELDS else pa.string(),
+                )
+                for name, values in columns.items()
+            }
+        )
+
+    def generate():
+        sink = _StreamSink()
+        writer = None
+        fields = EXPORT_DEFAULT_FIELDS
+
+        try:
+            for rows in pages:
+                if writer is None:
+                    fields = list(rows[0].keys())
+                table = to_table(rows, fields)
+                if writer is None:
+                    writer = (
+                        pq.ParquetWriter(sink, table.schema)
+                        if parquet
+                        else pa.ipc.new_stream(sink, table.schema)
+                    )
+                writer.write_table(table)
+                yield sink.drain()
+
+            if writer is None:
+                table = to_table([], fields)
+                writer = (
+                    pq.ParquetWriter(sink, table.schema)
+                    if parquet
+                    else pa.ipc.new_stream(sink, table.schema)
+                )
+            writer.close()
+            yield sink.drain()
+        except Exception as e:
+            # Re-raise so the client never gets a Parquet file without a footer
+            logger.error(f"Export stream aborted: {e}")
+            raise
+
+    return generate()
+
+
 # ===================================================================
 # AUTHENTICATION ROUTES
 # ===================================================================
@@ -366,6 +978,25 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 # ===================================================================
 
 
+def _handle_ws_command(websocket: WebSocket, data: str):
+    """Apply {"action": "subscribe" | "unsubscribe", ...filters} from a client"""
+    try:
+        command = json.loads(data)
+    except ValueError:
+        return
+    if not isinstance(command, dict):
+        return
+
+    action = command.pop("action", None)
+    if action == "unsubscribe":
+        manager.subscribe(websocket, WSSubscription())
+    elif action == "subscribe":
+        try:
+            manager.subscribe(websocket, WSSubscription(**command))
+        except ValidationError as ve:
+            logger.debug(f"[WS] Invalid subscription: {ve}")
+
+
 @app.websocket("/ws/events")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket connection for real-time events"""
@@ -374,7 +1005,10 @@ async def websocket_endpoint(websocket: WebSocket):
         while True:
             data = await websocket.receive_text()
             logger.debug(f"[WS] Received from client: {data}")
+            _handle_ws_command(websocket, data)
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
 
@@ -578,24 +1212,47 @@ def get_members_batch(plates: list[str]):
 
 @app.get("/events")
 def get_events(
-    limit: int = Query(1000, ge=1),
+    response: Response,
+    limit: int = Query(EVENTS_MAX_PAGE_SIZE, ge=1),
     start_date: str | None = Query(None, description="YYYY-MM-DD"),
     end_date: str | None = Query(None, description="YYYY-MM-DD"),
     direction: str | None = Query(None),
     query: str | None = Query(None, description="Plate query"),
+    after: str | None = Query(None, description="Cursor <datetime>,<event_id>"),
+    fields: str | None = Query(None, description="Comma-separated output fields"),
+    count: Literal["estimated"] | None = Query(None),
 ):
-    """Get all events with filters"""
+    """Get events with filters, keyset pagination and field projection"""
     try:
-        qb = (
-            supabase.table("Event")
-            .select(
-                "event_id, datetime, plate, province, direction, blob, vehicle_id, "
-                "Vehicle!Event_vehicle_id_fkey("
+        limit = min(limit, EVENTS_MAX_PAGE_SIZE)
+        wanted = (
+            [f.strip() for f in fields.split(",") if f.strip()]
+            if fields
+            else EVENT_OUTPUT_FIELDS
+        )
+        unknown = set(wanted) - set(EVENT_OUTPUT_FIELDS)
+        if unknown:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+            )
+
+        # Only embed Vehicle -> Member when a member-derived field is requested
+        columns = "event_id, datetime, plate, province, direction, blob, vehicle_id"
+        if EVENT_IMAGE_COLUMNS:
+            columns += ", thumb_url, plate_url"
+        if EVENT_MEMBER_FIELDS & set(wanted):
+            columns += (
+                ", Vehicle!Event_vehicle_id_fkey("
                 "  plate, province, "
                 "  Member!Vehicle_member_id_fkey(firstname, lastname, role, std_id)"
                 ")"
             )
+
+        qb = (
+            supabase.table("Event")
+            .select(columns, count=count)
             .order("datetime", desc=True)
+            .order("event_id", desc=True)
             .limit(limit)
         )
 
@@ -607,50 +1264,19 @@ def get_events(
             qb = qb.eq("direction", direction.upper())
         if query:
             qb = qb.ilike("plate", f"%{query.strip()}%")
+        if after:
+            qb = _apply_event_cursor(qb, _parse_event_cursor(after))
 
         resp = qb.execute()
-        dir_th = {"IN": "เข้า", "OUT": "ออก"}
-        results = []
-
-        for e in resp.data or []:
-            vehicle = e.get("Vehicle") or {}
-            if isinstance(vehicle, list):
-                vehicle = vehicle[0] if vehicle else {}
-
-            member = vehicle.get("Member") or {}
-            if isinstance(member, list):
-                member = member[0] if member else {}
+        rows = resp.data or []
+        results = [_event_row(e, wanted) for e in rows]
 
-            role = member.get("role")
-            check_status = (
-                "บุคคล ภายนอก"
-                if not role or str(role).lower() == "visitor"
-                else "บุคคล ภายใน"
-            )
-
-            direction_en = (e.get("direction") or "").upper()
-            direction_th = dir_th.get(direction_en, "ไม่ทราบ")
-
-            member_name = None
-            if member.get("firstname") or member.get("lastname"):
-                member_name = f"{member.get('firstname', '')} {member.get('lastname', '')}".strip()
-
-            results.append(
-                {
-                    "event_id": e.get("event_id"),
-                    "time": e.get("datetime"),
-                    "plate": e.get("plate") or "-",
-                    "province": e.get("province") or "-",
-                    "status": direction_th,
-                    "check": check_status,
-                    "imgUrl": e.get("blob") or None,
-                    "member_name": member_name,
-                    "member_role": role,
-                    "member_firstname": member.get("firstname"),
-                    "member_lastname": member.get("lastname"),
-                    "member_std_id": member.get("std_id"),
-                }
+        if len(rows) == limit:
+            response.headers["X-Next-Cursor"] = (
+                f"{rows[-1]['datetime']},{rows[-1]['event_id']}"
             )
+        if count and resp.count is not None:
+            response.headers["X-Total-Count"] = str(resp.count)
 
         filters = []
         if start_date:
@@ -667,6 +1293,8 @@ def get_events(
 
         return results
 
+    except HTTPException:
+        raise
     except Exception as ex:
         logger.error(f"Events error: {str(ex)}")
         raise HTTPException(status_code=500, detail=f"Error fetching events: {str(ex)}")
@@ -712,15 +1340,39 @@ async def create_event(event: EventIn):
             "province": event.province or None,
             "direction": direction,
             "blob": image_url,
+            **event_image_columns(event.thumb_url, event.plate_url),
             "cam_id": event.cam_id,
             "vehicle_id": vehicle_data["vehicle_id"] if vehicle_data else None,
+            "idempotency_key": event.idempotency_key,
         }
 
-        response = supabase.table("Event").insert(payload).execute()
-        if not response.data:
-            raise HTTPException(status_code=400, detail="เพิ่มข้อมูล Event ไม่สำเร็จ")
+        # A retried delivery reuses the stored event and only redoes a
+        # session step that did not complete the first time
+        saved_event = None
+        if event.idempotency_key:
+            saved_event = _find_events_by_key([event.idempotency_key]).get(
+                event.idempotency_key
+            )
+        if saved_event is None:
+            response = supabase.table("Event").insert(payload).execute()
+            if not response.data:
+                raise HTTPException(status_code=400, detail="เพิ่มข้อมูล Event ไม่สำเร็จ")
+            saved_event = response.data[0]
+            dashboard_stats.record(
+                saved_event,
+                (vehicle_data.get("member") or {}).get("role") if vehicle_data else None,
+            )
+        elif not _needs_session(saved_event) or (
+            saved_event["event_id"] in _events_with_sessions([saved_event["event_id"]])
+        ):
+            logger.info(f"Duplicate delivery ignored: {event.idempotency_key}")
+            return {
+                "message": "Event นี้บันทึกไว้แล้ว",
+                "duplicate": True,
+                "data": saved_event,
+                "vehicle_info": vehicle_data or "ไม่พบข้อมูลรถในระบบ (บันทึกเป็น visitor)",
+            }
 
-        saved_event = response.data[0]
         event_id = saved_event["event_id"]
 
         # Handle parking session
@@ -734,30 +1386,20 @@ async def create_event(event: EventIn):
                 "vehicle_id": vehicle_data["vehicle_id"] if vehicle_data else None,
                 "member_id": vehicle_data["member_id"] if vehicle_data else None,
             }
-            supabase.table("parkingsession").insert(session_data).execute()
+            session_resp = (
+                supabase.table("parkingsession").insert(session_data).execute()
+            )
+            new_session = session_resp.data[0] if session_resp.data else None
+            parked_index.add(new_session)
+            notify_new_entry(new_session)
             logger.info(f"Created parking session for {event.plate}")
 
         elif direction == "OUT" and event.plate:
-            match_result = find_best_match(event.plate, event.province or "", supabase)
+            match_result, _, _ = _complete_parked_session(
+                event.plate, event.province, event.datetime, event_id
+            )
 
             if match_result:
-                session = match_result["session"]
-                entry_time = datetime.fromisoformat(session["entry_time"])
-                exit_time = event.datetime
-                duration = int((exit_time - entry_time).total_seconds() / 60)
-
-                supabase.table("parkingsession").update(
-                    {
-                        "plate_number_exit": event.plate,
-                        "exit_time": event.datetime.isoformat(),
-                        "exit_event_id": event_id,
-                        "status": "completed",
-                        "match_type": match_result["match_type"],
-                        "confidence_score": match_result["confidence"],
-                        "duration_minutes": duration,
-                    }
-                ).eq("session_id", session["session_id"]).execute()
-
                 logger.info(
                     f"Matched exit: {event.plate} ({match_result['match_type']}, "
                     f"confidence: {match_result['confidence']})"
@@ -770,24 +1412,16 @@ async def create_event(event: EventIn):
                     "status": "unmatched",
                     "exit_event_id": event_id,
                 }
-                supabase.table("parkingsession").insert(unmatched_data).execute()
+                unmatched_resp = (
+                    supabase.table("parkingsession").insert(unmatched_data).execute()
+                )
+                notify_unmatched_exit(
+                    unmatched_resp.data[0] if unmatched_resp.data else None
+                )
                 logger.warning(f"No match for exit: {event.plate}")
 
         # Broadcast WebSocket
-        ws_payload = {
-            "datetime": saved_event.get("datetime"),
-            "plate": saved_event.get("plate") or "-",
-            "province": saved_event.get("province") or "-",
-            "direction": saved_event.get("direction") or "-",
-            "role": (
-                (vehicle_data.get("member") or {}).get("role")
-                if vehicle_data
-                else "Visitor"
-            ),
-            "image": saved_event.get("blob"),
-            "blob": saved_event.get("blob"),
-        }
-
+        ws_payload = _event_ws_payload(saved_event, vehicle_data)
         await manager.broadcast(json.dumps(ws_payload))
 
         return {
@@ -800,6 +1434,225 @@ async def create_event(event: EventIn):
         raise HTTPException(status_code=500, detail=f"เกิดข้อผิดพลาด: {str(e)}")
 
 
+@app.post("/events/bulk")
+async def create_events_bulk(events: list[EventIn]):
+    """Create many events at once (e.g. replay after an outage), in the given order"""
+    if not events:
+        return {"message": "ไม่มี Event ที่ต้องบันทึก", "inserted": 0, "event_ids": []}
+    if len(events) > EVENTS_BULK_MAX:
+        raise HTTPException(
+            status_code=413,
+            detail=f"ส่งได้ไม่เกิน {EVENTS_BULK_MAX} Event ต่อครั้ง",
+        )
+
+    try:
+        result, ws_messages = await asyncio.to_thread(_create_events_bulk, events)
+        for message in ws_messages:
+            await manager.broadcast(message)
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error in create_events_bulk: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"เกิดข้อผิดพลาด: {str(e)}")
+
+
+def _bulk_snapshot_index() -> ParkedSessionIndex:
+    """One in-memory copy of the parked sessions for matching the whole batch"""
+    if parked_index.ensure_fresh(supabase):
+        return parked_index.copy()
+    local = ParkedSessionIndex()
+    if not local.load(supabase):
+        raise HTTPException(status_code=503, detail="โหลดข้อมูลรถที่จอดอยู่ไม่สำเร็จ")
+    return local
+
+
+def _create_events_bulk(events: list[EventIn]) -> tuple[dict, list[str]]:
+    # 1. Resolve vehicles for the whole batch
+    pairs = {
+        ((e.plate or "").strip(), (e.province or "").strip())
+        for e in events
+        if _canon_plate(e.plate) and _canon_text(e.province)
+    }
+    vehicles = _lookup_vehicles_bulk(pairs) if pairs else {}
+
+    # 2. Insert the events not stored yet in one request. Events whose
+    #    idempotency key already exists are replays of an earlier delivery.
+    keys = [e.idempotency_key for e in events if e.idempotency_key]
+    stored = _find_events_by_key(keys) if keys else {}
+
+    rows, vehicle_rows, new_positions = [], [], []
+    saved_events: list[dict | None] = []
+    for i, e in enumerate(events):
+        key = ((e.plate or "").strip(), (e.province or "").strip())
+        vehicle_data = vehicles.get(key)
+        vehicle_rows.append(vehicle_data)
+        saved_events.append(stored.get(e.idempotency_key) if e.idempotency_key else None)
+        if saved_events[-1] is not None:
+            continue
+        new_positions.append(i)
+        rows.append(
+            {
+                "datetime": e.datetime.isoformat(),
+                "plate": e.plate or None,
+                "province": e.province or None,
+                "direction": e.direction
+                or ("IN" if e.cam_id == 1 else "OUT" if e.cam_id == 2 else "UNKNOWN"),
+                "blob": clean_blob(e.blob),
+                **event_image_columns(e.thumb_url, e.plate_url),
+                "cam_id": e.cam_id,
+                "vehicle_id": vehicle_data["vehicle_id"] if vehicle_data else None,
+                "idempotency_key": e.idempotency_key,
+            }
+        )
+
+    if rows:
+        response = supabase.table("Event").insert(rows).execute()
+        if not response.data or len(response.data) != len(rows):
+            raise HTTPException(status_code=400, detail="เพิ่มข้อมูล Event ไม่สำเร็จ")
+        for i, saved in zip(new_positions, response.data):
+            saved_events[i] = saved
+
+    # Replayed events only need the session step if it never completed
+    inserted_now = set(new_positions)
+    replayed_ids = [
+        saved["event_id"]
+        for i, saved in enumerate(saved_events)
+        if i not in inserted_now
+    ]
+    sessions_done = _events_with_sessions(replayed_ids) if replayed_ids else set()
+
+    # 3. Walk the batch in order against one snapshot of parked sessions.
+    #    Entries from this batch join the snapshot under a temporary id so a
+    #    later exit in the same batch can close them before they are inserted.
+    index = _bulk_snapshot_index()
+    new_sessions: dict[str, dict] = {}
+    completed: dict = {}
+    unmatched: list[dict] = []
+
+    batch = zip(events, saved_events, vehicle_rows)
+    for i, (e, saved, vehicle_data) in enumerate(batch):
+        if saved["event_id"] in sessions_done:
+            continue
+
+        if saved["direction"] == "IN":
+            temp_id = f"bulk-{i}"
+            session = {
+                "session_id": temp_id,
+                "plate_number_entry": e.plate,
+                "province": e.province,
+                "entry_time": e.datetime.isoformat(),
+                "status": "parked",
+                "entry_event_id": saved["event_id"],
+                "vehicle_id": vehicle_data["vehicle_id"] if vehicle_data else None,
+                "member_id": vehicle_data["member_id"] if vehicle_data else None,
+            }
+            new_sessions[temp_id] = session
+            index.add(session)
+
+        elif saved["direction"] == "OUT" and e.plate:
+            unmatched_row = {
+                "plate_number_exit": e.plate,
+                "province": e.province,
+                "exit_time": e.datetime.isoformat(),
+                "status": "unmatched",
+                "exit_event_id": saved["event_id"],
+            }
+            match_result = index.find_best_match(e.plate, e.province or "")
+            if not match_result:
+                unmatched.append(unmatched_row)
+                continue
+
+            session = match_result["session"]
+            entry_time = datetime.fromisoformat(session["entry_time"])
+            exit_fields = {
+                "plate_number_exit": e.plate,
+                "exit_time": e.datetime.isoformat(),
+                "exit_event_id": saved["event_id"],
+                "status": "completed",
+                "match_type": match_result["match_type"],
+                "confidence_score": float(match_result["confidence"]),
+                "duration_minutes": int(
+                    (e.datetime - entry_time).total_seconds() / 60
+                ),
+            }
+            index.remove(session["session_id"])
+            if session["session_id"] in new_sessions:
+                new_sessions[session["session_id"]].update(exit_fields)
+            else:
+                completed[session["session_id"]] = (exit_fields, unmatched_row)
+
+    # 4. Writes: new sessions in one insert; existing sessions get only their
+    #    exit columns, and only while still parked (another worker may have
+    #    closed them since the snapshot). Those exits fall back to unmatched.
+    inserted_sessions = []
+    if new_sessions:
+        session_rows = [
+            {k: v for k, v in row.items() if k != "session_id"}
+            for row in new_sessions.values()
+        ]
+        inserted_sessions = (
+            supabase.table("parkingsession").insert(session_rows).execute().data or []
+        )
+    closed_ids = []
+    for session_id, (exit_fields, unmatched_row) in completed.items():
+        updated = (
+            supabase.table("parkingsession")
+            .update(exit_fields)
+            .eq("session_id", session_id)
+            .eq("status", "parked")
+            .execute()
+        )
+        if updated.data:
+            closed_ids.append(session_id)
+        else:
+            unmatched.append(unmatched_row)
+    unmatched_sessions = []
+    if unmatched:
+        unmatched_sessions = (
+            supabase.table("parkingsession").insert(unmatched).execute().data or []
+        )
+
+    # 5. Keep the shared index, matcher, dashboard counters and live view in sync
+    for session_id in completed:
+        parked_index.remove(session_id)
+    for session in inserted_sessions:
+        if session.get("status") == "parked":
+            parked_index.add(session)
+            notify_new_entry(session)
+    for session in unmatched_sessions:
+        notify_unmatched_exit(session)
+    ws_messages = []
+    for i in new_positions:
+        saved, vehicle_data = saved_events[i], vehicle_rows[i]
+        dashboard_stats.record(
+            saved,
+            (vehicle_data.get("member") or {}).get("role") if vehicle_data else None,
+        )
+        ws_messages.append(json.dumps(_event_ws_payload(saved, vehicle_data)))
+
+    logger.info(
+        f"Bulk insert: {len(new_positions)} events "
+        f"({len(events) - len(new_positions)} replayed), "
+        f"{len(inserted_sessions)} entries, {len(closed_ids)} matched exits, "
+        f"{len(unmatched_sessions)} unmatched"
+    )
+
+    result = {
+        "message": "เพิ่มข้อมูล Event เรียบร้อยแล้ว",
+        "inserted": len(new_positions),
+        "duplicates": len(events) - len(new_positions),
+        "event_ids": [saved["event_id"] for saved in saved_events],
+        "sessions": {
+            "created": len(inserted_sessions),
+            "completed": len(closed_ids)
+            + sum(1 for s in inserted_sessions if s.get("status") == "completed"),
+            "unmatched": len(unmatched_sessions),
+        },
+    }
+    return result, ws_messages
+
+
 @app.patch("/events/{event_id}")
 def update_event(
     event_id: int,
@@ -841,6 +1694,7 @@ def update_event(
             raise HTTPException(status_code=500, detail="ไม่สามารถแก้ไขข้อมูลได้")
 
         updated_event = update_resp.data[0]
+        notify_event_corrected(updated_event)
         logger.info(f"Updated Event ID {event_id}: {update_data}")
 
         return {
@@ -880,6 +1734,7 @@ async def record_entry(event: EventIn):
             "province": event.province,
             "direction": "IN",
             "blob": image_url,
+            **event_image_columns(event.thumb_url, event.plate_url),
             "cam_id": event.cam_id or 1,
         }
         event_resp = supabase.table("Event").insert(event_data).execute()
@@ -888,6 +1743,7 @@ async def record_entry(event: EventIn):
             raise HTTPException(status_code=400, detail="บันทึก Event ไม่สำเร็จ")
 
         event_id = event_resp.data[0]["event_id"]
+        dashboard_stats.record(event_resp.data[0])
 
         vehicle_id = None
         member_id = None
@@ -920,10 +1776,14 @@ async def record_entry(event: EventIn):
         if not session_resp.data:
             raise HTTPException(status_code=400, detail="สร้าง Session ไม่สำเร็จ")
 
+        parked_index.add(session_resp.data[0])
+        notify_new_entry(session_resp.data[0])
+
         await manager.broadcast(
             json.dumps(
                 {
                     "type": "entry",
+                    "cam_id": event_data["cam_id"],
                     "plate": event.plate or "-",
                     "province": event.province or "-",
                     "time": event.datetime.isoformat(),
@@ -960,6 +1820,7 @@ async def record_exit(event: EventIn):
             "province": event.province,
             "direction": "OUT",
             "blob": image_url,
+            **event_image_columns(event.thumb_url, event.plate_url),
             "cam_id": event.cam_id or 2,
         }
         event_resp = supabase.table("Event").insert(event_data).execute()
@@ -968,11 +1829,14 @@ async def record_exit(event: EventIn):
             raise HTTPException(status_code=400, detail="บันทึก Event ไม่สำเร็จ")
 
         exit_event_id = event_resp.data[0]["event_id"]
+        dashboard_stats.record(event_resp.data[0])
 
-        # Find matching entry
-        match_result = None
+        # Find matching entry and close it
+        match_result, updated_session, duration = None, None, None
         if event.plate:
-            match_result = find_best_match(event.plate, event.province or "", supabase)
+            match_result, updated_session, duration = _complete_parked_session(
+                event.plate, event.province, event.datetime, exit_event_id
+            )
             logger.info(f"Match result: {match_result}")
 
         # No match found
@@ -989,11 +1853,13 @@ async def record_exit(event: EventIn):
             session_resp = (
                 supabase.table("parkingsession").insert(session_data).execute()
             )
+            notify_unmatched_exit(session_resp.data[0] if session_resp.data else None)
 
             await manager.broadcast(
                 json.dumps(
                     {
                         "type": "exit",
+                        "cam_id": event_data["cam_id"],
                         "plate": event.plate or "-",
                         "status": "unmatched",
                         "time": event.datetime.isoformat(),
@@ -1007,33 +1873,12 @@ async def record_exit(event: EventIn):
                 "match_type": None,
             }
 
-        # Match found - update session
-        session = match_result["session"]
-        entry_time = datetime.fromisoformat(session["entry_time"])
-        exit_time = event.datetime
-        duration = int((exit_time - entry_time).total_seconds() / 60)
-
-        update_data = {
-            "plate_number_exit": event.plate,
-            "exit_time": event.datetime.isoformat(),
-            "exit_event_id": exit_event_id,
-            "status": "completed",
-            "match_type": match_result["match_type"],
-            "confidence_score": match_result["confidence"],
-            "duration_minutes": duration,
-        }
-
-        updated = (
-            supabase.table("parkingsession")
-            .update(update_data)
-            .eq("session_id", session["session_id"])
-            .execute()
-        )
-
+        # Match found - session already updated
         await manager.broadcast(
             json.dumps(
                 {
                     "type": "exit",
+                    "cam_id": event_data["cam_id"],
                     "plate": event.plate or "-",
                     "match_type": match_result["match_type"],
                     "confidence": match_result["confidence"],
@@ -1054,7 +1899,7 @@ async def record_exit(event: EventIn):
             "match_type": match_result["match_type"],
             "confidence": match_result["confidence"],
             "duration_minutes": duration,
-            "session": updated.data[0] if updated.data else None,
+            "session": updated_session,
         }
 
     except HTTPException:
@@ -1250,6 +2095,8 @@ def fix_session_plate(
         if not updated.data:
             raise HTTPException(status_code=500, detail="อัปเดตไม่สำเร็จ")
 
+        parked_index.update(updated.data[0])
+        notify_session_corrected(updated.data[0])
         logger.info(f"Fixed plate for session {session_id}: {correct_plate}")
 
         return {"message": "แก้ไขป้ายทะเบียนสำเร็จ", "data": updated.data[0]}
@@ -1270,31 +2117,12 @@ def fix_session_plate(
 def dashboard_summary(date: str | None = None):
     """Get dashboard summary statistics"""
     try:
-        date = date or datetime.now().strftime("%Y-%m-%d")
-        start, end = f"{date}T00:00:00", f"{date}T23:59:59"
-
-        response = (
-            supabase.table("Event")
-            .select("event_id, plate, province, direction, vehicle_id")
-            .gte("datetime", start)
-            .lte("datetime", end)
-            .execute()
+        date = date or datetime.now(BKK).strftime("%Y-%m-%d")
+        return dashboard_stats.summary(date)
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail="Invalid date format. Use YYYY-MM-DD."
         )
-
-        events = response.data
-        ins = [e for e in events if e["direction"] == "IN"]
-        outs = [e for e in events if e["direction"] == "OUT"]
-        unknown = [
-            e for e in events if not e.get("plate") or e.get("vehicle_id") is None
-        ]
-
-        return {
-            "date": date,
-            "total_events": len(events),
-            "in": len(ins),
-            "out": len(outs),
-            "unknown_or_visitor": len(unknown),
-        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1307,7 +2135,8 @@ def dashboard_recent(limit: int = 50):
             supabase.table("Event")
             .select(
                 "datetime, plate, province, direction, blob, "
-                "Vehicle!Event_vehicle_id_fkey(member:Member!Vehicle_member_id_fkey(role))"
+                + ("thumb_url, " if EVENT_IMAGE_COLUMNS else "")
+                + "Vehicle!Event_vehicle_id_fkey(member:Member!Vehicle_member_id_fkey(role))"
             )
             .order("datetime", desc=True)
             .limit(limit)
@@ -1333,6 +2162,7 @@ def dashboard_recent(limit: int = 50):
                     "direction": e.get("direction") or "-",
                     "role": role,
                     "image": e.get("blob") or None,
+                    "thumb": e.get("thumb_url") or None,
                 }
             )
 
@@ -1347,37 +2177,7 @@ def dashboard_recent(limit: int = 50):
 def dashboard_daily(date: str = Query(..., description="Date in YYYY-MM-DD format")):
     """Get hourly statistics for a specific date"""
     try:
-        start_local = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=BKK)
-        end_local = start_local + timedelta(days=1)
-        start_utc = start_local.astimezone(timezone.utc).isoformat()
-        end_utc = end_local.astimezone(timezone.utc).isoformat()
-
-        response = (
-            supabase.table("Event")
-            .select("datetime, direction")
-            .gte("datetime", start_utc)
-            .lt("datetime", end_utc)
-            .execute()
-        )
-        events = response.data or []
-
-        hourly_data = {
-            h: {"label": f"{h:02d}:00", "inside": 0, "outside": 0} for h in range(24)
-        }
-
-        for e in events:
-            dt_utc = datetime.fromisoformat(e["datetime"])
-            dt_local = dt_utc.astimezone(BKK)
-            hour = dt_local.hour
-            direction = (e.get("direction") or "").lower()
-
-            if 0 <= hour < 24:
-                if direction == "in":
-                    hourly_data[hour]["inside"] += 1
-                elif direction == "out":
-                    hourly_data[hour]["outside"] += 1
-
-        return [hourly_data[h] for h in range(24)]
+        return dashboard_stats.hourly(date)
     except ValueError:
         raise HTTPException(
             status_code=400, detail="Invalid date format. Use YYYY-MM-DD."
@@ -1388,6 +2188,24 @@ def dashboard_daily(date: str = Query(..., description="Date in YYYY-MM-DD forma
         )
 
 
+@app.get("/dashboard/range")
+def dashboard_range(
+    start: str = Query(..., description="Start date in YYYY-MM-DD format"),
+    end: str = Query(..., description="End date in YYYY-MM-DD format"),
+    granularity: Literal["hour", "day", "week", "month"] = Query("day"),
+    cam_id: int | None = Query(None),
+):
+    """Get event counts per bucket from the hourly/daily rollup tables"""
+    try:
+        return dashboard_stats.range_summary(start, end, granularity, cam_id)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as ex:
+        raise HTTPException(
+            status_code=500, detail=f"Error in dashboard_range: {str(ex)}"
+        )
+
+
 # ===================================================================
 # UPLOAD & EXPORT ROUTES
 # ===================================================================
@@ -1395,25 +2213,47 @@ def dashboard_daily(date: str = Query(..., description="Date in YYYY-MM-DD forma
 
 @app.post("/upload")
 async def upload_image(file: UploadFile = File(...)):
-    """Upload image to storage"""
+    """Upload image to storage in the background and return its public URL"""
     try:
         contents = await file.read()
-        url = upload_image_to_storage(contents, folder="plates")
+        url = upload_image_background(storage_client, contents, folder="plates")
         return {"url": url}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/upload/stats")
+def upload_stats():
+    """Background upload counters (failed = gave up after all retries)"""
+    return get_upload_stats()
+
+
+@app.post("/upload/presign")
+def presign_upload(
+    ext: Literal["jpg", "jpeg", "png", "webp"] = Query("jpg"),
+    folder: str = Query("plates"),
+):
+    """Signed URL for uploading an image straight to the storage bucket"""
+    try:
+        return create_presigned_upload(ext=ext, folder=folder)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating upload URL: {str(e)}")
+
+
 @app.get("/export/events")
 def export_events(
     start: str | None = Query(None),
     end: str | None = Query(None),
     direction: str | None = Query(None),
     plate: str | None = Query(None),
+    format: Literal["csv", "csv.gz", "parquet", "arrow"] = Query("csv"),
 ):
-    """Export events to CSV"""
-    try:
-        query_builder = supabase.table("Event").select("*").order("datetime", desc=True)
+    """Export events as a streamed CSV / gzip CSV / Parquet / Arrow file"""
+
+    def build_query():
+        query_builder = supabase.table("Event").select("*")
 
         if start:
             query_builder = query_builder.gte("datetime", f"{start}T00:00:00")
@@ -1424,27 +2264,36 @@ def export_events(
         if plate:
             query_builder = query_builder.ilike("plate", f"%{plate.strip()}%")
 
-        response = query_builder.execute()
-        data = response.data or []
-
-        output = io.StringIO(newline="")
-        output.write("\ufeff")
-        fieldnames = (
-            list(data[0].keys())
-            if data
-            else ["datetime", "plate", "province", "direction"]
-        )
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-        writer.writeheader()
-        if data:
-            writer.writerows(data)
-        output.seek(0)
+        return query_builder
 
+    try:
+        pages = _iter_event_pages(build_query)
+        # Fetch the first page before streaming so query errors still return 500
+        first_page = next(pages, None)
+        pages = itertools.chain([first_page], pages) if first_page else iter(())
+
+        if format in ("parquet", "arrow"):
+            body = _stream_arrow(pages, parquet=format == "parquet")
+            media_type = (
+                "application/vnd.apache.parquet"
+                if format == "parquet"
+                else "application/vnd.apache.arrow.stream"
+            )
+        else:
+            body = _stream_csv(pages)
+            media_type = "text/csv; charset=utf-8"
+            if format == "csv.gz":
+                body = _gzip_stream(body)
+                media_type = "application/gzip"
+
+        filename = f"events_filtered.{format}"
         return StreamingResponse(
-            iter([output.getvalue()]),
-            media_type="text/csv; charset=utf-8",
-            headers={"Content-Disposition": "attachment; filename=events_filtered.csv"},
+            body,
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error exporting events: {str(e)}")
 
@@ -1455,8 +2304,21 @@ def export_events(
 @app.on_event("startup")
 async def startup_event():
     """Start background tasks on server startup"""
+    global storage_client
+    storage_client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=3.0))
+    await manager.start()
     try:
+        parked_index.load(supabase)
         asyncio.create_task(process_unmatched_sessions(supabase))
         logger.info("Background matcher started successfully")
     except Exception as e:
         logger.error(f"Failed to start background matcher: {e}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release shared resources on server shutdown"""
+    await manager.stop()
+    await wait_background_uploads()
+    if storage_client:
+        await storage_client.aclose()
@@ -1,6 +1,7 @@
-from rapidfuzz import fuzz
-from datetime import datetime, timedelta
+from rapidfuzz import fuzz, process
+from datetime import datetime, timedelta, timezone
 from supabase import Client
+import numpy as np
 import re
 import logging
 
@@ -8,6 +9,18 @@ import logging
 logger = logging.getLogger("matching_logic")
 logger.setLevel(logging.INFO)
 
+# Scoring constants (ใช้ร่วมกันทั้งแบบทีละคันและแบบ matrix)
+MATCH_THRESHOLD = 0.70
+FUZZY_THRESHOLD = 0.75
+NUMERIC_BASE_SCORE = 0.90
+PLATE_WEIGHT = 0.7
+PROVINCE_WEIGHT = 0.3
+EVENT_BOOST = 0.05
+RECENT_ENTRY_HOURS = 24
+
+MATCH_TYPES = np.array([None, "exact", "numeric_ignore_thai", "fuzzy"], dtype=object)
+_NONE, _EXACT, _NUMERIC, _FUZZY = range(4)
+
 
 def normalize_province(province: str) -> str:
     """
@@ -187,6 +200,12 @@ def find_best_match(plate_out: str, province: str, supabase: Client):
     2. เลขตรง+จังหวัดตรง (Numeric Ignore Thai) **ตามที่ user ขอ**
     3. คล้ายคลึง (Fuzzy)
     """
+    from session_index import parked_index
+
+    # ใช้ index ของรถที่จอดอยู่ใน memory ถ้าพร้อม (ไม่ต้องอ่าน database)
+    if parked_index.ensure_fresh(supabase):
+        return parked_index.find_best_match(plate_out, province)
+
     # 1. เตรียมข้อมูล
     recent_entries = check_recent_entries(plate_out, province, supabase)
 
@@ -252,3 +271,121 @@ def find_best_match(plate_out: str, province: str, supabase: Client):
         }
 
     return None
+
+
+# ===================================================================
+# VECTORIZED SCORING
+# ===================================================================
+
+
+def _to_timestamp(value: str | None) -> float:
+    if not value:
+        return np.nan
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return np.nan
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def prepare_plates(plates: list, provinces: list, entry_times: list | None = None) -> dict:
+    """
+    Normalize ป้าย/จังหวัดล่วงหน้าครั้งเดียว เก็บเป็น array ไว้ใช้กับ score_matrix
+    - fuzzy: ป้ายไม่มีช่องว่าง (ใช้กับ fuzz.ratio)
+    - key: ป้ายไม่มีช่องว่าง ตัวเล็ก (ใช้เทียบ exact)
+    """
+    fuzzy = [(p or "").replace(" ", "") for p in plates]
+    prepared = {
+        "fuzzy": fuzzy,
+        "key": np.array([p.lower() for p in fuzzy], dtype=str),
+        "province": np.array([normalize_province(p or "") for p in provinces], dtype=str),
+        "number": np.array([extract_numbers_only(p or "") for p in plates], dtype=str),
+    }
+    if entry_times is not None:
+        prepared["entry_ts"] = np.array(
+            [_to_timestamp(t) for t in entry_times], dtype=np.float64
+        )
+    return prepared
+
+
+def prepare_sessions(sessions: list[dict]) -> dict:
+    return prepare_plates(
+        [s.get("plate_number_entry") for s in sessions],
+        [s.get("province") for s in sessions],
+        [s.get("entry_time") for s in sessions],
+    )
+
+
+def _ratio_matrix(queries: list, choices: list) -> np.ndarray:
+    """fuzz.ratio ทุกคู่ในครั้งเดียว (multi-thread) คืนค่า 0-100"""
+    return process.cdist(
+        queries, choices, scorer=fuzz.ratio, dtype=np.float32, workers=-1
+    )
+
+
+def _province_ratio_matrix(out_provinces: np.ndarray, in_provinces: np.ndarray):
+    # จังหวัดซ้ำกันเยอะ คำนวณเฉพาะค่าที่ไม่ซ้ำแล้วกระจายกลับ
+    out_uniq, out_inv = np.unique(out_provinces, return_inverse=True)
+    in_uniq, in_inv = np.unique(in_provinces, return_inverse=True)
+    ratios = _ratio_matrix(list(out_uniq), list(in_uniq))
+    return ratios[out_inv][:, in_inv]
+
+
+def score_matrix(exits: dict, entries: dict, now: datetime | None = None):
+    """
+    ให้คะแนนทุกคู่ exit x entry ตามกฎเดียวกับ find_best_match
+    1. Exact: ป้าย (ไม่สนช่องว่าง/ตัวพิมพ์) + จังหวัดตรง -> 1.0
+    2. Numeric Ignore Thai: เลขชุดท้ายตรง + จังหวัด >= 85 -> 0.90 + boost
+    3. Fuzzy: ป้าย*0.7 + จังหวัด*0.3 + boost > 0.75
+    boost 0.05 เมื่อ entry เข้ามาภายใน 24 ชม. เลขตรง และจังหวัด >= 80
+    คืน (scores, type_codes) ขนาด (จำนวน exit, จำนวน entry)
+    """
+    m, n = len(exits["key"]), len(entries["key"])
+    if m == 0 or n == 0:
+        return np.zeros((m, n), dtype=np.float32), np.zeros((m, n), dtype=np.int8)
+
+    now_ts = (now or datetime.now(timezone.utc)).timestamp()
+
+    prov_ratio = _province_ratio_matrix(exits["province"], entries["province"])
+    plate_ratio = _ratio_matrix(exits["fuzzy"], entries["fuzzy"])
+
+    number_eq = (exits["number"][:, None] == entries["number"][None, :]) & (
+        exits["number"][:, None] != ""
+    )
+    recent = now_ts - entries["entry_ts"] <= RECENT_ENTRY_HOURS * 3600
+    boost = np.where(number_eq & (prov_ratio >= 80) & recent[None, :], EVENT_BOOST, 0.0)
+
+    exact = (exits["key"][:, None] == entries["key"][None, :]) & (
+        exits["province"][:, None] == entries["province"][None, :]
+    )
+    numeric = number_eq & (prov_ratio >= 85)
+    fuzzy = (
+        plate_ratio / 100.0 * PLATE_WEIGHT + prov_ratio / 100.0 * PROVINCE_WEIGHT + boost
+    )
+    is_fuzzy = fuzzy > FUZZY_THRESHOLD
+
+    scores = np.select(
+        [exact, numeric, is_fuzzy], [1.0, NUMERIC_BASE_SCORE + boost, fuzzy], 0.0
+    ).astype(np.float32)
+    types = np.select(
+        [exact, numeric, is_fuzzy], [_EXACT, _NUMERIC, _FUZZY], _NONE
+    ).astype(np.int8)
+    return scores, types
+
+
+def best_in_row(scores: np.ndarray, types: np.ndarray):
+    """เลือก entry ที่ดีที่สุดของ exit หนึ่งแถว (exact มาก่อนเสมอ) คืน (index, score, type) หรือ None"""
+    exact = np.flatnonzero(types == _EXACT)
+    if exact.size:
+        idx = int(exact[0])
+        return idx, 1.0, "exact"
+
+    if scores.size == 0:
+        return None
+    idx = int(np.argmax(scores))
+    score = float(scores[idx])
+    if score < MATCH_THRESHOLD or types[idx] == _NONE:
+        return None
+    return idx, round(score, 2), MATCH_TYPES[types[idx]]
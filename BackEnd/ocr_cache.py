@@ -0,0 +1,249 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+# ===================================================================
+# CONFIGURATION
+# ===================================================================
+
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", "512"))
+# ระยะ Hamming สูงสุด (จาก 256 bit) ที่ถือว่าเป็นภาพป้ายเดียวกัน
+# ป้ายไทยพื้นขาวหน้าตาคล้ายกันมาก ค่าที่กว้างกว่านี้จะได้ป้ายของรถคันอื่น (เท่ากับ burst_dedup)
+OCR_CACHE_MAX_DISTANCE = int(os.getenv("OCR_CACHE_MAX_DISTANCE", "4"))
+# path ของไฟล์ SQLite ถ้าไม่ตั้งจะใช้แค่ cache ใน memory
+OCR_CACHE_DB = os.getenv("OCR_CACHE_DB")
+# ผลเก็บแยกตามกล้องและอยู่ไม่นาน (รถจอดนิ่ง / burst ซ้ำ) ไม่ใช่ cache ข้ามวัน
+OCR_CACHE_TTL_SECONDS = int(os.getenv("OCR_CACHE_TTL_SECONDS", "300"))
+# ใช้ประมาณเวลา/ค่าใช้จ่ายที่ประหยัดได้ต่อ 1 hit
+OCR_CALL_SECONDS_ESTIMATE = float(os.getenv("OCR_CALL_SECONDS_ESTIMATE", "3.0"))
+OCR_CALL_COST_ESTIMATE = float(os.getenv("OCR_CALL_COST_ESTIMATE", "0.005"))
+
+HASH_W, HASH_H = 17, 16  # dHash 16x16 = 256 bit
+BAND_BITS = 16
+BAND_COUNT = (HASH_H * (HASH_W - 1)) // BAND_BITS
+INVALID_PLATE = "ไม่มีป้ายทะเบียน"
+
+
+# ===================================================================
+# PERCEPTUAL HASH
+# ===================================================================
+
+
+def plate_hash(plate_crop: np.ndarray) -> int:
+    """dHash ของภาพป้าย: ย่อเป็นขาวดำ 17x16 แล้วเทียบ pixel ติดกันในแนวนอน"""
+    gray = (
+        plate_crop
+        if plate_crop.ndim == 2
+        else cv2.cvtColor(plate_crop, cv2.COLOR_BGR2GRAY)
+    )
+    small = cv2.resize(gray, (HASH_W, HASH_H), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _band_keys(value: int) -> list[int]:
+    """แบ่ง hash เป็นช่วงละ 16 bit ภาพที่ต่างกันไม่เกิน BAND_COUNT-1 bit ต้องมีอย่างน้อย 1 ช่วงตรงกัน"""
+    mask = (1 << BAND_BITS) - 1
+    return [
+        (band << BAND_BITS) | ((value >> (band * BAND_BITS)) & mask)
+        for band in range(BAND_COUNT)
+    ]
+
+
+def is_cacheable(result: dict | None) -> bool:
+    """เก็บเฉพาะผลที่อ่านได้ครบ ไม่มี '?' และมีจังหวัด"""
+    if not result:
+        return False
+    plate = result.get("plate")
+    return bool(
+        plate and plate != INVALID_PLATE and "?" not in plate and result.get("province")
+    )
+
+
+# ===================================================================
+# CACHE
+# ===================================================================
+
+
+class OCRCache:
+    """
+    Cache ผล OCR ตาม perceptual hash ของภาพป้าย: LRU ใน memory + SQLite (optional) พร้อม TTL
+    ค้นเฉพาะผลของกล้องเดียวกัน (key = (cam_id, hash))
+    """
+
+    def __init__(
+        self,
+        max_size: int = OCR_CACHE_SIZE,
+        max_distance: int = OCR_CACHE_MAX_DISTANCE,
+        db_path: str | None = OCR_CACHE_DB,
+        ttl_seconds: int = OCR_CACHE_TTL_SECONDS,
+    ):
+        self.max_size = max_size
+        # banding รับประกันการหาเจอได้ถึง BAND_COUNT-1 bit เท่านั้น
+        self.max_distance = min(max_distance, BAND_COUNT - 1)
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[tuple[int, int], tuple[dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = self._open_db(db_path) if db_path else None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+    def _open_db(self, db_path: str) -> sqlite3.Connection | None:
+        try:
+            db = sqlite3.connect(db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(
+                """
+                -- ตารางรุ่นแรกไม่แยกกล้อง ผลเก่าเชื่อถือไม่ได้ ทิ้งไป
+                DROP TABLE IF EXISTS ocr_cache_band;
+                DROP TABLE IF EXISTS ocr_cache;
+                CREATE TABLE IF NOT EXISTS ocr_cache_cam (
+                    id INTEGER PRIMARY KEY,
+                    cam_id INTEGER NOT NULL,
+                    hash TEXT NOT NULL,
+                    plate TEXT NOT NULL,
+                    province TEXT,
+                    created_at REAL NOT NULL,
+                    UNIQUE (cam_id, hash)
+                );
+                CREATE TABLE IF NOT EXISTS ocr_cache_cam_band (
+                    band_key INTEGER NOT NULL,
+                    entry_id INTEGER NOT NULL
+                        REFERENCES ocr_cache_cam(id) ON DELETE CASCADE
+                );
+                CREATE INDEX IF NOT EXISTS idx_ocr_cache_cam_band
+                    ON ocr_cache_cam_band(band_key);
+                """
+            )
+            db.execute("PRAGMA foreign_keys=ON")
+            return db
+        except Exception as e:
+            print(f"[OCR CACHE] เปิดฐานข้อมูล {db_path} ไม่ได้ ใช้แค่ memory: {e}")
+            return None
+
+    def lookup(self, plate_crop: np.ndarray, cam_id: int = 0) -> Tuple[int, Optional[dict]]:
+        """คืน (hash, ผล OCR) ของกล้องนี้ ถ้าไม่เจอผลเป็น None; hash ใช้ต่อกับ store()"""
+        key = plate_hash(plate_crop)
+        now = time.time()
+
+        with self._lock:
+            result = self._lookup_memory(cam_id, key, now)
+            if result:
+                self.stats["memory_hits"] += 1
+                return key, result
+
+            result = self._lookup_disk(cam_id, key, now)
+            if result:
+                self.stats["disk_hits"] += 1
+                self._remember((cam_id, key), result, now)
+                return key, result
+
+            self.stats["misses"] += 1
+            return key, None
+
+    def store(self, key: int, result: dict, cam_id: int = 0) -> None:
+        if not is_cacheable(result):
+            return
+
+        entry = {"plate": result["plate"], "province": result["province"]}
+        now = time.time()
+
+        with self._lock:
+            self._remember((cam_id, key), entry, now)
+            self.stats["stores"] += 1
+            if self._db:
+                self._store_disk(cam_id, key, entry, now)
+
+    def _lookup_memory(self, cam_id: int, key: int, now: float) -> Optional[dict]:
+        best_key, best_dist = None, self.max_distance + 1
+        for cached_key, (_, created_at) in self._memory.items():
+            if cached_key[0] != cam_id or now - created_at > self.ttl_seconds:
+                continue
+            dist = hamming(key, cached_key[1])
+            if dist < best_dist:
+                best_key, best_dist = cached_key, dist
+                if dist == 0:
+                    break
+
+        if best_key is None:
+            return None
+
+        self._memory.move_to_end(best_key)
+        return dict(self._memory[best_key][0])
+
+    def _remember(self, key: tuple[int, int], result: dict, now: float) -> None:
+        self._memory[key] = (result, now)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _lookup_disk(self, cam_id: int, key: int, now: float) -> Optional[dict]:
+        if not self._db:
+            return None
+        try:
+            bands = _band_keys(key)
+            rows = self._db.execute(
+                f"""
+                SELECT DISTINCT c.hash, c.plate, c.province
+                FROM ocr_cache_cam_band b JOIN ocr_cache_cam c ON c.id = b.entry_id
+                WHERE b.band_key IN ({",".join("?" * len(bands))})
+                  AND c.cam_id = ?
+                  AND c.created_at >= ?
+                """,
+                (*bands, cam_id, now - self.ttl_seconds),
+            ).fetchall()
+        except Exception as e:
+            print(f"[OCR CACHE] อ่านฐานข้อมูลไม่ได้: {e}")
+            return None
+
+        best, best_dist = None, self.max_distance + 1
+        for hash_hex, plate, province in rows:
+            dist = hamming(key, int(hash_hex, 16))
+            if dist < best_dist:
+                best, best_dist = {"plate": plate, "province": province}, dist
+        return best
+
+    def _store_disk(self, cam_id: int, key: int, result: dict, now: float) -> None:
+        try:
+            with self._db:
+                self._db.execute(
+                    "DELETE FROM ocr_cache_cam WHERE (cam_id = ? AND hash = ?) OR created_at < ?",
+                    (cam_id, format(key, "x"), now - self.ttl_seconds),
+                )
+                cur = self._db.execute(
+                    "INSERT INTO ocr_cache_cam (cam_id, hash, plate, province, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (cam_id, format(key, "x"), result["plate"], result["province"], now),
+                )
+                self._db.executemany(
+                    "INSERT INTO ocr_cache_cam_band (band_key, entry_id) VALUES (?, ?)",
+                    [(band, cur.lastrowid) for band in _band_keys(key)],
+                )
+        except Exception as e:
+            print(f"[OCR CACHE] บันทึกลงฐานข้อมูลไม่ได้: {e}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            return {
+                **self.stats,
+                "hits": hits,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_enabled": self._db is not None,
+                "saved_seconds_estimate": round(hits * OCR_CALL_SECONDS_ESTIMATE, 1),
+                "saved_cost_estimate": round(hits * OCR_CALL_COST_ESTIMATE, 4),
+            }
+
+
+ocr_cache = OCRCache()
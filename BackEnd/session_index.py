@@ -0,0 +1,275 @@
+from bisect import bisect_left, bisect_right
+from typing import TYPE_CHECKING
+import logging
+import threading
+import time
+
+import numpy as np
+
+from matching_logic import (
+    normalize_province,
+    prepare_plates,
+    prepare_sessions,
+    score_matrix,
+    best_in_row,
+    _to_timestamp,
+)
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+logger = logging.getLogger("session_index")
+logger.setLevel(logging.INFO)
+
+# Constants
+RESYNC_INTERVAL_SECONDS = 300  # โหลดใหม่ทั้งก้อนเป็นระยะ กันข้อมูลเพี้ยนจาก worker อื่น
+PREPARED_COLUMNS = ("fuzzy", "key", "province", "number", "entry_ts")
+LOAD_PAGE_SIZE = 1000  # เท่ากับ max-rows ของ PostgREST query เดียวได้ไม่เกินนี้
+
+
+def plate_key(plate: str | None) -> str:
+    """ป้ายทะเบียนแบบไม่มีช่องว่าง ตัวเล็ก ใช้เทียบแบบ exact"""
+    return (plate or "").replace(" ", "").lower()
+
+
+class ParkedSessionIndex:
+    """
+    Index ของ parkingsession ที่ status = 'parked' เก็บใน memory ของ process
+    - hash map: (ป้ายไม่มีช่องว่าง, จังหวัด normalize) -> session สำหรับ exact match
+    - คอลัมน์ของป้าย/จังหวัด/เลขชุดท้ายที่ normalize ไว้ตอนเพิ่ม session (ทำครั้งเดียวต่อคัน)
+      เรียงตามเวลาเข้า แทรก/ลบทีละแถว ใช้ให้คะแนนทีเดียวด้วย matching_logic.score_matrix
+    ถูกอัปเดตโดย /events, /api/entry, /api/exit และ background matcher
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._sessions: dict = {}
+        self._by_plate: dict[tuple[str, str], set] = {}
+        # แถวเรียงตามเวลาเข้า (เก่าสุดก่อน): session_id, sort key และค่าที่ normalize แล้วต่อคอลัมน์
+        self._ids: list = []
+        self._order: list[float] = []
+        self._columns: dict[str, list] = {name: [] for name in PREPARED_COLUMNS}
+        self._arrays = None  # cache ของ numpy array จากคอลัมน์ (ไม่ normalize ซ้ำ)
+        self.loaded_at: float | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded_at is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    # ---------------------------------------------------------------
+    # Loading & maintenance
+    # ---------------------------------------------------------------
+
+    def load(self, supabase: "Client") -> bool:
+        """โหลด parked sessions ทั้งหมดจาก database ทีละหน้า (keyset ตาม session_id)"""
+        sessions, pages, last_id = [], 0, None
+        try:
+            while True:
+                qb = (
+                    supabase.table("parkingsession")
+                    .select("*")
+                    .eq("status", "parked")
+                    .is_("exit_time", "null")
+                    .order("session_id")
+                    .limit(LOAD_PAGE_SIZE)
+                )
+                if last_id is not None:
+                    qb = qb.gt("session_id", last_id)
+                rows = qb.execute().data or []
+                pages += 1
+                sessions.extend(rows)
+                if len(rows) < LOAD_PAGE_SIZE:
+                    break
+                last_id = rows[-1]["session_id"]
+        except Exception as e:
+            logger.error(f"Failed to load parked sessions: {e}")
+            return False
+
+        if pages > 1:
+            logger.warning(
+                f"Parked sessions exceed one page ({LOAD_PAGE_SIZE} rows): "
+                f"loaded {len(sessions)} sessions in {pages} pages"
+            )
+
+        with self._lock:
+            self._clear()
+            for session in sessions:
+                self._add(session)
+            self.loaded_at = time.monotonic()
+
+        logger.info(f"Parked session index loaded: {len(self._sessions)} sessions")
+        return True
+
+    def ensure_fresh(self, supabase: "Client") -> bool:
+        """โหลดครั้งแรก หรือโหลดใหม่เมื่อครบ RESYNC_INTERVAL_SECONDS"""
+        if (
+            self.loaded_at is None
+            or time.monotonic() - self.loaded_at > RESYNC_INTERVAL_SECONDS
+        ):
+            return self.load(supabase) or self.ready
+        return True
+
+    def copy(self) -> "ParkedSessionIndex":
+        """สำเนาที่แยกจาก index หลัก ใช้จับคู่ทั้ง batch โดยยังไม่กระทบข้อมูลจริง"""
+        clone = ParkedSessionIndex()
+        with self._lock:
+            clone._sessions = {
+                sid: (dict(session), key) for sid, (session, key) in self._sessions.items()
+            }
+            clone._by_plate = {key: set(ids) for key, ids in self._by_plate.items()}
+            clone._ids = list(self._ids)
+            clone._order = list(self._order)
+            clone._columns = {name: list(col) for name, col in self._columns.items()}
+            clone.loaded_at = self.loaded_at
+        return clone
+
+    def add(self, session: dict | None):
+        """เพิ่ม session ใหม่ (เฉพาะที่ยังจอดอยู่)"""
+        if not session or not self.ready:
+            return
+        with self._lock:
+            self._remove(session.get("session_id"))
+            if session.get("status") == "parked" and not session.get("exit_time"):
+                self._add(session)
+
+    def remove(self, session_id):
+        if not self.ready:
+            return
+        with self._lock:
+            self._remove(session_id)
+
+    def update(self, session: dict | None):
+        """แทนที่ข้อมูล session (เช่นหลังแก้ป้าย) ถ้าไม่ใช่ parked แล้วจะถูกเอาออก"""
+        self.add(session)
+
+    def _clear(self):
+        self._sessions.clear()
+        self._by_plate.clear()
+        self._ids.clear()
+        self._order.clear()
+        for col in self._columns.values():
+            col.clear()
+        self._arrays = None
+
+    def _add(self, session: dict):
+        session_id = session.get("session_id")
+        key = (
+            plate_key(session.get("plate_number_entry")),
+            normalize_province(session.get("province", "")),
+        )
+        self._sessions[session_id] = (session, key)
+        self._by_plate.setdefault(key, set()).add(session_id)
+
+        # normalize แถวเดียวตอนเพิ่ม แล้วแทรกตามเวลาเข้า
+        prepared = prepare_sessions([session])
+        ts = prepared["entry_ts"][0]
+        order = -np.inf if np.isnan(ts) else ts
+        pos = bisect_right(self._order, order)
+        self._ids.insert(pos, session_id)
+        self._order.insert(pos, order)
+        for name, col in self._columns.items():
+            col.insert(pos, prepared[name][0])
+        self._arrays = None
+
+    def _remove(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if not entry:
+            return
+        _, key = entry
+        ids = self._by_plate.get(key)
+        if ids is not None:
+            ids.discard(session_id)
+            if not ids:
+                del self._by_plate[key]
+
+        pos = self._position(session_id, entry[0])
+        if pos is not None:
+            del self._ids[pos]
+            del self._order[pos]
+            for col in self._columns.values():
+                del col[pos]
+        self._arrays = None
+
+    def _position(self, session_id, session: dict) -> int | None:
+        """ตำแหน่งแถวของ session (ค้นจากเวลาเข้าก่อน ไม่ต้องไล่ทั้ง list)"""
+        ts = _to_timestamp(session.get("entry_time"))
+        order = -np.inf if np.isnan(ts) else ts
+        for pos in range(bisect_left(self._order, order), len(self._ids)):
+            if self._ids[pos] == session_id:
+                return pos
+            if self._order[pos] != order:
+                break
+        try:
+            return self._ids.index(session_id)
+        except ValueError:
+            return None
+
+    def _entry_ts(self, session_id) -> float:
+        ts = _to_timestamp(self._sessions[session_id][0].get("entry_time"))
+        return -np.inf if np.isnan(ts) else ts
+
+    def _prepared(self):
+        """array ของ parked sessions เรียงตามเวลาเข้า (เก่าสุดก่อน) จากคอลัมน์ที่ normalize ไว้แล้ว"""
+        if self._arrays is None:
+            prepared = {
+                "fuzzy": list(self._columns["fuzzy"]),
+                "key": np.array(self._columns["key"], dtype=str),
+                "province": np.array(self._columns["province"], dtype=str),
+                "number": np.array(self._columns["number"], dtype=str),
+                "entry_ts": np.array(self._columns["entry_ts"], dtype=np.float64),
+            }
+            self._arrays = (list(self._ids), prepared)
+        return self._arrays
+
+    # ---------------------------------------------------------------
+    # Matching
+    # ---------------------------------------------------------------
+
+    def snapshot(self) -> tuple[list[dict], dict]:
+        """คืน (sessions, prepared arrays) ของรถที่จอดอยู่ ณ ตอนนี้"""
+        with self._lock:
+            session_ids, prepared = self._prepared()
+            return [self._sessions[sid][0] for sid in session_ids], prepared
+
+    def score_exits(self, plates: list, provinces: list):
+        """ให้คะแนน exit หลายคันกับรถที่จอดอยู่ทั้งหมดใน matrix call เดียว"""
+        sessions, prepared = self.snapshot()
+        scores, types = score_matrix(prepare_plates(plates, provinces), prepared)
+        return scores, types, sessions
+
+    def find_best_match(self, plate_out: str, province: str):
+        """ผลลัพธ์รูปแบบเดียวกับ matching_logic.find_best_match แต่ไม่อ่าน database"""
+        with self._lock:
+            if not self._sessions:
+                return None
+
+            # Step 1: Exact Match ผ่าน hash map
+            exact = self._by_plate.get(
+                (plate_key(plate_out), normalize_province(province))
+            )
+            if exact:
+                session_id = min(exact, key=self._entry_ts)
+                return {
+                    "session": self._sessions[session_id][0],
+                    "match_type": "exact",
+                    "confidence": 1.0,
+                }
+
+            # Step 2-3: Numeric / Fuzzy ทุกคันในครั้งเดียว
+            scores, types, sessions = self.score_exits([plate_out], [province])
+            best = best_in_row(scores[0], types[0])
+            if not best:
+                return None
+
+            idx, score, match_type = best
+            return {
+                "session": sessions[idx],
+                "match_type": match_type,
+                "confidence": score,
+            }
+
+
+parked_index = ParkedSessionIndex()
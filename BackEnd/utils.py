@@ -1,5 +1,7 @@
+import asyncio
 import base64
 import cv2
+import httpx
 import time as systime
 from datetime import datetime, timezone, timedelta
 from supabase import create_client
@@ -11,6 +13,21 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+STORAGE_BUCKET = "image_car"
+STORAGE_FOLDERS = {"plates"}
+
+# รูปที่เก็บลง storage: รูปเต็มบีบอัด + รูปย่อ + ภาพป้าย (webp หรือ jpg)
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "webp")
+FULL_MAX_WIDTH = int(os.getenv("FULL_MAX_WIDTH", "1280"))
+FULL_QUALITY = int(os.getenv("FULL_QUALITY", "80"))
+THUMB_WIDTH = int(os.getenv("THUMB_WIDTH", "320"))
+THUMB_QUALITY = int(os.getenv("THUMB_QUALITY", "70"))
+PLATE_QUALITY = int(os.getenv("PLATE_QUALITY", "90"))
+# อัปโหลดเบื้องหลังไม่สำเร็จ: ลองใหม่แบบ exponential backoff (URL ถูกส่งออกไปแล้ว ต้องพยายามให้ไฟล์มีจริง)
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", "4"))
+UPLOAD_BACKOFF_SECONDS = float(os.getenv("UPLOAD_BACKOFF_SECONDS", "1"))
+_background_uploads: set[asyncio.Task] = set()
+upload_stats = {"queued": 0, "uploaded": 0, "retries": 0, "failed": 0}
 
 def safe_crop(img, x1, y1, x2, y2, pad=0):
     h, w = img.shape[:2]
@@ -26,19 +43,61 @@ def encode_image(image):
     _, buffer = cv2.imencode(".jpg", image)
     return base64.b64encode(buffer).decode("utf-8")
 
+def _resize_max_width(image, max_width):
+    h, w = image.shape[:2]
+    if w <= max_width:
+        return image
+    return cv2.resize(
+        image, (max_width, max(1, int(h * max_width / w))), interpolation=cv2.INTER_AREA
+    )
+
+def encode_compressed(image_bgr, quality: int) -> bytes | None:
+    if IMAGE_FORMAT == "webp":
+        ok, buffer = cv2.imencode(".webp", image_bgr, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    else:
+        ok, buffer = cv2.imencode(
+            ".jpg",
+            image_bgr,
+            [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1],
+        )
+    return buffer.tobytes() if ok else None
+
+# สร้างรูปสำหรับเก็บ: full (ย่อไม่เกิน FULL_MAX_WIDTH), thumb (THUMB_WIDTH) และ plate (ภาพป้าย)
+def build_image_derivatives(image_bgr, plate_crop_bgr=None) -> dict:
+    return {
+        "full": encode_compressed(_resize_max_width(image_bgr, FULL_MAX_WIDTH), FULL_QUALITY),
+        "thumb": encode_compressed(_resize_max_width(image_bgr, THUMB_WIDTH), THUMB_QUALITY),
+        "plate": (
+            encode_compressed(plate_crop_bgr, PLATE_QUALITY)
+            if plate_crop_bgr is not None and plate_crop_bgr.size
+            else None
+        ),
+    }
+
+def storage_filename(folder="plates", ext="jpg") -> str:
+    # ตั้งชื่อไฟล์ไม่ให้ชน โดยใส่ microsecond + UUID
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
+    return f"{folder}/{timestamp}_{uuid.uuid4().hex[:6]}.{ext}"
+
+def content_type(ext: str) -> str:
+    # image/jpg ไม่ใช่ MIME type ที่ถูกต้อง
+    ext = ext.lower()
+    return "image/jpeg" if ext in ("jpg", "jpeg") else f"image/{ext}"
+
+def storage_public_url(filename: str) -> str:
+    return f"{SUPABASE_URL}/storage/v1/object/public/{STORAGE_BUCKET}/{filename}"
+
 def upload_image_to_storage(
     image_bytes: bytes, ext="jpg", folder="plates"
 ) -> str | None:
     try:
-        # ตั้งชื่อไฟล์ไม่ให้ชน โดยใส่ microsecond + UUID
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
-        filename = f"{folder}/{timestamp}_{uuid.uuid4().hex[:6]}.{ext}"
+        filename = storage_filename(folder, ext)
 
         # เลือก bucket
-        bucket = supabase.storage.from_("image_car")
+        bucket = supabase.storage.from_(STORAGE_BUCKET)
 
         # อัปโหลดไฟล์ไปยัง bucket
-        res = bucket.upload(filename, image_bytes, {"content-type": f"image/{ext}"})
+        res = bucket.upload(filename, image_bytes, {"content-type": content_type(ext)})
 
         # ตรวจสอบผลลัพธ์จาก upload
         if res is None or (
@@ -55,3 +114,103 @@ def upload_image_to_storage(
     except Exception as e:
         print("Upload error:", e)
         return None
+
+# อัปโหลดผ่าน Storage REST API ด้วย AsyncClient ที่แชร์กัน (ใช้ connection เดิมซ้ำ ไม่ block event loop)
+async def upload_image_to_storage_async(
+    client: httpx.AsyncClient,
+    image_bytes: bytes,
+    ext="jpg",
+    folder="plates",
+    filename: str | None = None,
+    upsert: bool = False,
+) -> str | None:
+    try:
+        filename = filename or storage_filename(folder, ext)
+        r = await client.post(
+            f"{SUPABASE_URL}/storage/v1/object/{STORAGE_BUCKET}/{filename}",
+            content=image_bytes,
+            headers={
+                "Authorization": f"Bearer {SUPABASE_KEY}",
+                "apikey": SUPABASE_KEY,
+                "content-type": content_type(ext),
+                # ลองซ้ำหลัง timeout ไฟล์อาจขึ้นไปแล้ว ให้เขียนทับแทนการได้ 409
+                "x-upsert": "true" if upsert else "false",
+            },
+        )
+        if r.status_code not in (200, 201):
+            print(f"Upload failed: {r.status_code} {r.text}")
+            return None
+
+        url = storage_public_url(filename)
+        print(f"[UPLOAD SUCCESS] {url}")
+        return url
+
+    except Exception as e:
+        print("Upload error:", e)
+        return None
+
+# อัปโหลดพร้อมลองใหม่ ถ้าครบทุกครั้งแล้วยังไม่ได้ นับเป็น failed และ log ชื่อไฟล์ไว้
+async def _upload_with_retry(
+    client: httpx.AsyncClient, image_bytes: bytes, ext: str, folder: str, filename: str
+) -> str | None:
+    for attempt in range(UPLOAD_RETRIES + 1):
+        if attempt:
+            upload_stats["retries"] += 1
+            await asyncio.sleep(UPLOAD_BACKOFF_SECONDS * 2 ** (attempt - 1))
+        url = await upload_image_to_storage_async(
+            client, image_bytes, ext=ext, folder=folder, filename=filename, upsert=attempt > 0
+        )
+        if url:
+            upload_stats["uploaded"] += 1
+            return url
+
+    upload_stats["failed"] += 1
+    print(f"[UPLOAD FAILED] {filename} (ลอง {UPLOAD_RETRIES + 1} ครั้ง) URL ใน Event จะยังไม่มีไฟล์")
+    return None
+
+def get_upload_stats() -> dict:
+    return {**upload_stats, "in_flight": len(_background_uploads)}
+
+# เริ่มอัปโหลดเบื้องหลังแล้วคืน public URL ทันที (ชื่อไฟล์กำหนดไว้ก่อน URL จึงรู้ล่วงหน้าได้)
+def upload_image_background(
+    client: httpx.AsyncClient, image_bytes: bytes, ext="jpg", folder="plates"
+) -> str:
+    filename = storage_filename(folder, ext)
+    upload_stats["queued"] += 1
+    task = asyncio.create_task(
+        _upload_with_retry(client, image_bytes, ext, folder, filename)
+    )
+    _background_uploads.add(task)
+    task.add_done_callback(_background_uploads.discard)
+    return storage_public_url(filename)
+
+# รออัปโหลดที่ค้างอยู่ให้เสร็จก่อนปิด client (ตอน shutdown)
+async def wait_background_uploads():
+    if _background_uploads:
+        await asyncio.gather(*_background_uploads, return_exceptions=True)
+
+# สร้าง signed upload URL ให้กล้อง/แอปอัปโหลดตรงเข้า bucket โดยไม่ผ่าน API
+def create_presigned_upload(ext="jpg", folder="plates") -> dict:
+    if folder not in STORAGE_FOLDERS:
+        raise ValueError(f"folder must be one of {sorted(STORAGE_FOLDERS)}")
+    filename = storage_filename(folder, ext)
+    signed = supabase.storage.from_(STORAGE_BUCKET).create_signed_upload_url(filename)
+    return {
+        "upload_url": signed["signed_url"],
+        "token": signed["token"],
+        "path": filename,
+        "public_url": storage_public_url(filename),
+        "content_type": content_type(ext),
+    }
+
+# อัปโหลดรูปทั้งสามแบบเบื้องหลัง คืน URL สำหรับใส่ใน Event (blob / thumb_url / plate_url)
+def upload_derivatives_background(client: httpx.AsyncClient, derivatives: dict) -> dict:
+    ext = "webp" if IMAGE_FORMAT == "webp" else "jpg"
+    folders = {"full": "plates", "thumb": "thumbs", "plate": "crops"}
+    urls = {
+        name: upload_image_background(client, data, ext=ext, folder=folders[name])
+        if data
+        else None
+        for name, data in derivatives.items()
+    }
+    return {"blob": urls["full"], "thumb_url": urls["thumb"], "plate_url": urls["plate"]}
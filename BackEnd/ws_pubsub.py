@@ -0,0 +1,121 @@
+from typing import Callable
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger("ws_pubsub")
+logger.setLevel(logging.INFO)
+
+# Constants
+# ไม่ตั้ง = ส่งเฉพาะใน process นี้, ตั้งเป็น redis://host:6379/0 เมื่อรันหลาย worker
+WS_PUBSUB_URL = os.getenv("WS_PUBSUB_URL")
+WS_PUBSUB_CHANNEL = os.getenv("WS_PUBSUB_CHANNEL", "lpr:ws:events")
+RECONNECT_DELAY_SECONDS = 1.0
+
+Handler = Callable[[str], None]
+
+
+class LocalPubSub:
+    """
+    Backend เริ่มต้น: ส่งข้อความให้ handler ของ process ตัวเองทันที
+    ใช้กับ worker เดียว และใช้แทน backend จริงตอนทดสอบได้
+    """
+
+    name = "local"
+
+    def __init__(self):
+        self._handler: Handler | None = None
+
+    async def start(self, handler: Handler):
+        self._handler = handler
+
+    async def publish(self, message: str):
+        if self._handler:
+            self._handler(message)
+
+    async def stop(self):
+        self._handler = None
+
+
+class RedisPubSub:
+    """
+    ส่งข้อความผ่าน Redis PUBLISH/SUBSCRIBE ทุก worker (รวมตัวที่ส่ง) subscribe channel
+    เดียวกัน แล้วกระจายต่อให้ WebSocket ที่ต่ออยู่กับตัวเอง
+    ต้องติดตั้ง `redis` (import ตอน start เท่านั้น)
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, channel: str = WS_PUBSUB_CHANNEL):
+        self.url = url
+        self.channel = channel
+        self._handler: Handler | None = None
+        self._redis = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self, handler: Handler):
+        import redis.asyncio as redis  # optional dependency
+
+        # from_url ยังไม่ได้เชื่อมต่อจริง ต้อง ping ก่อน ถ้าไม่ได้ให้ผู้เรียกใช้ local แทน
+        client = redis.from_url(self.url)
+        try:
+            await client.ping()
+        except Exception:
+            await client.aclose()
+            raise
+
+        self._handler = handler
+        self._redis = client
+        self._task = asyncio.create_task(self._listen())
+        logger.info(f"WebSocket pub/sub via Redis channel '{self.channel}'")
+
+    async def _listen(self):
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for msg in pubsub.listen():
+                    if msg.get("type") != "message":
+                        continue
+                    data = msg["data"]
+                    if isinstance(data, bytes):
+                        data = data.decode("utf-8")
+                    self._handler(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis subscription lost, retrying: {e}")
+                await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def publish(self, message: str):
+        try:
+            await self._redis.publish(self.channel, message)
+        except Exception as e:
+            # Redis ล่ม: อย่างน้อยหน้าจอที่ต่อกับ worker นี้ยังได้ข้อความ
+            logger.error(f"Redis publish failed, delivering locally: {e}")
+            if self._handler:
+                self._handler(message)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self._redis:
+            await self._redis.aclose()
+
+
+def build_pubsub(url: str | None = WS_PUBSUB_URL):
+    """เลือก backend จาก WS_PUBSUB_URL"""
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisPubSub(url)
+    if url:
+        logger.warning(f"Unsupported WS_PUBSUB_URL '{url}', using local pub/sub")
+    return LocalPubSub()
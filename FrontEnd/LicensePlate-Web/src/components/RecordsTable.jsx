@@ -66,6 +66,18 @@ function getImageUrl(rec = {}) {
   return buildImageUrl(raw);
 }
 
+// URL รูปย่อ (thumbnail) สำหรับแสดงในตาราง ถ้าไม่มีค่อยใช้รูปเต็ม
+function getThumbUrl(rec = {}) {
+  const raw =
+    rec.thumbUrl ||
+    rec.thumb_url ||
+    rec._raw?.thumbUrl ||
+    rec._raw?.thumb_url ||
+    null;
+
+  return buildImageUrl(raw);
+}
+
 // ทิศทาง IN / OUT / UNKNOWN
 function getDirection(rec = {}) {
   const rawDir = (rec._raw?.direction || rec.direction || "")
@@ -289,6 +301,12 @@ function normalizeSession(rec = {}) {
     raw.exit_img ||
     (dir === "OUT" ? getImageUrl(rec) : null);
 
+  const entryThumb =
+    rec.entry_thumb || raw.entry_thumb || (dir === "IN" ? getThumbUrl(rec) : null);
+
+  const exitThumb =
+    rec.exit_thumb || raw.exit_thumb || (dir === "OUT" ? getThumbUrl(rec) : null);
+
   let statusKey = "unknown";
   if (entryTime && exitTime) {
     statusKey = "completed";
@@ -354,6 +372,8 @@ function normalizeSession(rec = {}) {
     exitTime,
     entryImage,
     exitImage,
+    entryThumb,
+    exitThumb,
     direction: dir,
     statusKey,
     rawStatus,
@@ -478,6 +498,10 @@ function mergeEntryExitRecords(entryItem, exitItem) {
       rawExit.exit_img ||
       getImageUrl(exitRec) ||
       null,
+    entry_thumb:
+      entrySession.entryThumb || rawEntry.entry_thumb || getThumbUrl(entryRec) || null,
+    exit_thumb:
+      exitSession.exitThumb || rawExit.exit_thumb || getThumbUrl(exitRec) || null,
     plate_number_entry:
       entrySession.plateEntry || rawEntry.plate || entryRec.plate,
     plate_number_exit: exitSession.plateExit || rawExit.plate || exitRec.plate,
@@ -1491,8 +1515,9 @@ export default function RecordsTable({ records, filters = {} }) {
                       <div className="flex h-16 w-24 items-center justify-center overflow-hidden rounded-xl bg-slate-100 text-xs font-semibold text-slate-500 shadow-sm">
                         {session.entryImage ? (
                           <img
-                            src={session.entryImage}
+                            src={session.entryThumb || session.entryImage}
                             alt={`Entry ${session.plate || ""}`}
+                            loading="lazy"
                             className="h-full w-full object-cover"
                           />
                         ) : (
@@ -1526,8 +1551,9 @@ export default function RecordsTable({ records, filters = {} }) {
                           <div className="flex h-16 w-24 items-center justify-center overflow-hidden rounded-xl bg-slate-100 text-xs font-semibold text-slate-500 shadow-sm">
                             {session.exitImage ? (
                               <img
-                                src={session.exitImage}
+                                src={session.exitThumb || session.exitImage}
                                 alt={`Exit ${session.plate || ""}`}
+                                loading="lazy"
                                 className="h-full w-full object-cover"
                               />
                             ) : (
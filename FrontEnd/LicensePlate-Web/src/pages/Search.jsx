@@ -176,6 +176,29 @@ function recordMatchesDateFilter(rec, filters) {
   });
 }
 
+// สถานะรถในฟิลเตอร์ -> ทิศทางของ event ที่ทำให้เกิดแถวสถานะนั้น
+// กำลังจอด = รถเข้า, ออกแล้ว / ไม่พบข้อมูลขาเข้า = รถออก
+const STATUS_DIRECTION = {
+  parked: "IN",
+  completed: "OUT",
+  unmatched: "OUT",
+  IN: "IN",
+  OUT: "OUT",
+};
+
+// เงื่อนไขที่ส่งให้ server กรอง live update ก่อนส่งมา
+// (ประเภทบุคคล / คำค้นยังกรองฝั่ง client เพราะเกณฑ์ไม่ตรงกับ role / plate_prefix ของ server)
+function buildSubscription(filters) {
+  const direction = STATUS_DIRECTION[filters?.direction] || null;
+  return JSON.stringify({ action: "subscribe", direction });
+}
+
+function sendSubscription(ws, filters) {
+  if (ws && ws.readyState === WebSocket.OPEN) {
+    ws.send(buildSubscription(filters));
+  }
+}
+
 /* ================= Page ================= */
 
 export default function Search() {
@@ -285,6 +308,7 @@ export default function Search() {
 
       ws.onopen = () => {
         retryRef.current = 0;
+        sendSubscription(ws, filtersRef.current);
       };
 
       ws.onmessage = (ev) => {
@@ -362,6 +386,7 @@ export default function Search() {
 
   const onApply = () => {
     load(filters);
+    sendSubscription(wsRef.current, filters);
   };
 
   const onReset = () => {
@@ -374,6 +399,7 @@ export default function Search() {
     };
     setFilters(next);
     load(next);
+    sendSubscription(wsRef.current, next);
   };
 
   const onExport = () => {